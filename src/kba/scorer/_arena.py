@@ -0,0 +1,230 @@
+'''
+read-only, mmap-backed annotation arena shared by scoring processes
+
+Each worker process in a multi-process scoring gets its own copy of a
+python dict of the annotation, because the reference counts that get
+updated on every lookup defeat copy-on-write after fork.  An arena
+stores the annotation in a file of sorted fixed-width records that
+every worker maps read-only, so the operating system shares a single
+copy of the pages between all of them.
+
+A record is the packed key (epoch, md5 of the stream_id, target
+number, slot_type number) followed by a one byte label.  The key is
+packed big-endian so that byte order and key order agree.  Each
+process keeps the first key of every block of BLOCK_RECORDS records in
+a list, a small fraction of the file, so that a lookup is a bisect of
+that list followed by a search of one block of the mapped bytes.
+
+'''
+import os
+import json
+import mmap
+import struct
+import binascii
+from bisect import bisect_right
+
+MAGIC = 'KBA-ARENA-1\n'
+
+_key_struct = struct.Struct('>I16sHB')
+KEY_SIZE = _key_struct.size
+RECORD_SIZE = KEY_SIZE + 1
+
+## records per block of the in-memory index of first keys
+BLOCK_RECORDS = 64
+
+class AnnotationArena(object):
+    '''
+    dict-like, read-only view of an annotation stored in an arena file.
+
+    Keys are (stream_id, target_id) for CCR or (stream_id, target_id,
+    slot_type) for SSF, and values are small non-negative ints, e.g.
+    True/False for CCR.  Pickling an arena only pickles its path, so
+    passing one to worker processes does not copy it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        fh = open(path, 'rb')
+        assert fh.read(len(MAGIC)) == MAGIC, path
+        meta_len = struct.unpack('>I', fh.read(4))[0]
+        meta = json.loads(fh.read(meta_len))
+        self.target_ids = meta['target_ids']
+        self.slot_types = meta['slot_types']
+        self._num_positives = meta['num_positives']
+        self._key_len = meta['key_len']
+        self._target_nums = dict((target_id, num) for num, target_id in enumerate(self.target_ids))
+        self._slot_nums = dict((slot_type, num) for num, slot_type in enumerate(self.slot_types))
+        self._offset = meta['records_offset']
+        self._count = meta['count']
+        self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        fh.close()
+        ## first key of each block, for bisecting
+        block_size = BLOCK_RECORDS * RECORD_SIZE
+        end = self._offset + self._count * RECORD_SIZE
+        self._first_keys = [self._mm[start:start + KEY_SIZE]
+                            for start in xrange(self._offset, end, block_size)]
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self._count
+
+    def num_positives(self):
+        '''
+        :returns dict: target_id --> number of keys with a true label
+        '''
+        return dict(self._num_positives)
+
+    def _pack(self, key):
+        stream_id = key[0]
+        target_num = self._target_nums.get(key[1])
+        if target_num is None:
+            return None
+        if self._key_len == 3:
+            slot_num = self._slot_nums.get(key[2])
+            if slot_num is None:
+                return None
+        else:
+            slot_num = 0
+        try:
+            epoch, doc_id = stream_id.split('-', 1)
+            return _key_struct.pack(int(epoch), binascii.unhexlify(doc_id), target_num, slot_num)
+        except (ValueError, TypeError, struct.error):
+            return None
+
+    def _unpack(self, record):
+        epoch, doc_id, target_num, slot_num = _key_struct.unpack(record[:KEY_SIZE])
+        key = ('%d-%s' % (epoch, binascii.hexlify(doc_id)), self.target_ids[target_num])
+        if self._key_len == 3:
+            key += (self.slot_types[slot_num],)
+        return key, ord(record[KEY_SIZE])
+
+    def _find(self, packed):
+        block = bisect_right(self._first_keys, packed) - 1
+        if block < 0:
+            return None
+        start = self._offset + block * BLOCK_RECORDS * RECORD_SIZE
+        end = min(start + BLOCK_RECORDS * RECORD_SIZE,
+                  self._offset + self._count * RECORD_SIZE)
+        records = self._mm[start:end]
+        pos = records.find(packed)
+        ## a match that straddles two records is not a key
+        while pos > 0 and pos % RECORD_SIZE:
+            pos = records.find(packed, pos + 1)
+        if pos < 0:
+            return None
+        return ord(records[pos + KEY_SIZE])
+
+    def get(self, key, default=None):
+        packed = self._pack(key)
+        if packed is None:
+            return default
+        label = self._find(packed)
+        if label is None:
+            return default
+        return label
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        label = self.get(key)
+        if label is None:
+            raise KeyError(key)
+        return label
+
+    def iteritems(self):
+        for num in xrange(self._count):
+            start = self._offset + num * RECORD_SIZE
+            yield self._unpack(self._mm[start:start + RECORD_SIZE])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        for key, label in self.iteritems():
+            yield key
+
+    def keys(self):
+        return list(self)
+
+def can_pack(annotation):
+    '''
+    True if every stream_id in the annotation has the usual
+    <epoch>-<md5 hex> form that the arena records require
+    '''
+    for key in annotation:
+        epoch, _, doc_id = key[0].partition('-')
+        if not epoch.isdigit() or len(doc_id) != 32:
+            return False
+        try:
+            binascii.unhexlify(doc_id)
+        except TypeError:
+            return False
+    return True
+
+def write_arena(annotation, path):
+    '''
+    write a dict mapping (stream_id, target_id) or (stream_id,
+    target_id, slot_type) keys to small int labels into an arena file
+
+    :returns AnnotationArena: attached to the new file
+    '''
+    key_len = None
+    ## target_ids stay in the order in which the annotation first
+    ## mentions them, so that confusion matrices built from the arena
+    ## iterate, and hence average, in the same order as ones built
+    ## from the dict
+    target_ids = []
+    num_positives = dict()
+    slot_types = set()
+    for key, label in annotation.iteritems():
+        if key_len is None:
+            key_len = len(key)
+        assert len(key) == key_len, key
+        if key[1] not in num_positives:
+            target_ids.append(key[1])
+            num_positives[key[1]] = 0
+        if key_len == 3:
+            slot_types.add(key[2])
+        if label:
+            num_positives[key[1]] += 1
+    slot_types = sorted(slot_types)
+    assert len(target_ids) < 2**16 and len(slot_types) < 2**8
+
+    target_nums = dict((target_id, num) for num, target_id in enumerate(target_ids))
+    slot_nums = dict((slot_type, num) for num, slot_type in enumerate(slot_types))
+    records = []
+    for key, label in annotation.iteritems():
+        epoch, doc_id = key[0].split('-', 1)
+        slot_num = key_len == 3 and slot_nums[key[2]] or 0
+        records.append(_key_struct.pack(int(epoch), binascii.unhexlify(doc_id),
+                                        target_nums[key[1]], slot_num)
+                       + chr(int(label)))
+    records.sort()
+
+    meta = dict(target_ids=target_ids, slot_types=slot_types, key_len=key_len or 2,
+                num_positives=num_positives, count=len(records))
+    ## the records start after the header, which needs to know its
+    ## own length, so pad the JSON out to a fixed width
+    meta['records_offset'] = 0
+    meta_len = len(json.dumps(meta)) + 32
+    meta['records_offset'] = len(MAGIC) + 4 + meta_len
+    meta_json = json.dumps(meta).ljust(meta_len)
+
+    tmp_path = path + '.tmp'
+    out = open(tmp_path, 'wb')
+    out.write(MAGIC)
+    out.write(struct.pack('>I', meta_len))
+    out.write(meta_json)
+    out.write(''.join(records))
+    out.close()
+    os.rename(tmp_path, path)
+
+    return AnnotationArena(path)
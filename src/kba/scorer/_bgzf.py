@@ -0,0 +1,316 @@
+'''
+tools for reading disjoint byte ranges of a gzipped run file in
+parallel
+
+A gzip file is a sequence of one or more independently compressed
+members.  Block-compressed gzip (BGZF, as written by ``bgzip``) uses
+many small members and records each member's size in its header, so
+the member boundaries can be found without decompressing anything.
+Plain gunzip still reads these files.
+
+For other gzip files, the member boundaries are recorded in a side
+index the first time the run is read.  A run written by ordinary gzip
+has only one member and so cannot be split, but it can be rewritten
+as BGZF with::
+
+    python -m kba.scorer._bgzf run.gz run.bgzf.gz
+
+'''
+import os
+import sys
+import json
+import zlib
+import struct
+import multiprocessing
+
+from kba.scorer._outputs import log
+
+INDEX_SUFFIX = '.members.json'
+
+## largest amount of uncompressed data that bgzip puts in one block
+BGZF_BLOCK_SIZE = 0xff00
+
+## the empty block that terminates a BGZF file
+BGZF_EOF = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' \
+           '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+READ_SIZE = 2**16
+
+def _bgzf_block_size(header):
+    '''
+    :returns int: total size of the BGZF block starting with header,
+    or None if header is not the start of a BGZF block
+    '''
+    if len(header) < 18 or header[:4] != '\x1f\x8b\x08\x04':
+        return None
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = header[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield_id = extra[pos:pos + 2]
+        subfield_len = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if subfield_id == 'BC' and subfield_len == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + subfield_len
+    return None
+
+def is_bgzf(path_to_run_file):
+    header = open(path_to_run_file, 'rb').read(18)
+    return _bgzf_block_size(header) is not None
+
+def _bgzf_members(path_to_run_file):
+    '''
+    find the block offsets of a BGZF file by hopping from one block
+    header to the next
+    '''
+    offsets = []
+    file_size = os.path.getsize(path_to_run_file)
+    fh = open(path_to_run_file, 'rb')
+    offset = 0
+    while offset < file_size:
+        fh.seek(offset)
+        block_size = _bgzf_block_size(fh.read(18 + 6))
+        if block_size is None:
+            raise ValueError('%s is not BGZF after offset %d' % (path_to_run_file, offset))
+        offsets.append(offset)
+        offset += block_size
+    fh.close()
+    return offsets
+
+def inflate_members(fh, offset=0):
+    '''
+    decompress the gzip members in fh starting at the compressed
+    offset, which must be the start of a member
+
+    yields (offset of the member that produced the data, data)
+    '''
+    fh.seek(offset)
+    member_offset = offset
+    consumed = 0
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ''
+    while True:
+        chunk = pending or fh.read(READ_SIZE)
+        pending = ''
+        if not chunk:
+            break
+        data = decompressor.decompress(chunk)
+        if data:
+            yield member_offset, data
+        if decompressor.unused_data:
+            ## reached the end of this member
+            pending = decompressor.unused_data
+            consumed += len(chunk) - len(pending)
+            data = decompressor.flush()
+            if data:
+                yield member_offset, data
+            member_offset += consumed
+            consumed = 0
+            if not pending.strip('\0'):
+                ## some gzip writers pad the end of the file with zeros
+                break
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            consumed += len(chunk)
+
+def _index_path(path_to_run_file):
+    return path_to_run_file + INDEX_SUFFIX
+
+def save_member_index(path_to_run_file, offsets):
+    st = os.stat(path_to_run_file)
+    index = dict(size=st.st_size, mtime=st.st_mtime, members=offsets)
+    tmp_path = _index_path(path_to_run_file) + '.tmp'
+    try:
+        json.dump(index, open(tmp_path, 'w'))
+        os.rename(tmp_path, _index_path(path_to_run_file))
+    except (IOError, OSError), exc:
+        ## the run directory might be read-only
+        log('could not save member index for %s: %s' % (path_to_run_file, exc))
+
+def load_member_index(path_to_run_file):
+    '''
+    get the offsets of the gzip members in a run file, or None if a
+    plain gzip run has not yet been read with iter_lines_and_index
+
+    BGZF files get indexed immediately by reading their block
+    headers.
+    '''
+    st = os.stat(path_to_run_file)
+    try:
+        index = json.load(open(_index_path(path_to_run_file)))
+        if index['size'] == st.st_size and index['mtime'] == st.st_mtime:
+            return index['members']
+    except (IOError, ValueError):
+        pass
+
+    if is_bgzf(path_to_run_file):
+        offsets = _bgzf_members(path_to_run_file)
+        save_member_index(path_to_run_file, offsets)
+        return offsets
+
+    return None
+
+def iter_lines_and_index(path_to_run_file):
+    '''
+    yield the lines of a gzipped run while recording the member
+    offsets, which get saved as a side index once the whole file has
+    been read
+    '''
+    offsets = []
+    fh = open(path_to_run_file, 'rb')
+    tail = ''
+    for member_offset, data in inflate_members(fh):
+        if not offsets or offsets[-1] != member_offset:
+            offsets.append(member_offset)
+        lines = (tail + data).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if tail:
+        yield tail
+    fh.close()
+    save_member_index(path_to_run_file, offsets)
+
+def split_ranges(path_to_run_file, offsets, num_splits):
+    '''
+    group contiguous gzip members into at most num_splits byte ranges
+    of roughly equal compressed size
+
+    :returns list: (start, end) compressed byte offsets
+    '''
+    file_size = os.path.getsize(path_to_run_file)
+    target = file_size / float(num_splits)
+    ranges = []
+    start = 0
+    for offset in offsets[1:]:
+        if offset - start >= target:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, file_size))
+    return ranges
+
+def iter_range_lines(path_to_run_file, start, end):
+    '''
+    yield the lines of a gzipped run that belong to the compressed
+    byte range [start, end), which must begin and end on member
+    boundaries.
+
+    A line belongs to the range that holds the newline in front of it
+    (the first line of the file belongs to the first range), so every
+    line is yielded by exactly one range: a range skips everything up
+    to its first newline, and reads past its end to finish its last
+    line.
+    '''
+    fh = open(path_to_run_file, 'rb')
+    skip_first = start > 0
+    tail = ''
+    for member_offset, data in inflate_members(fh, start):
+        past_end = member_offset >= end
+        if skip_first:
+            if past_end:
+                ## no newline in this range, so it owns no lines
+                tail = ''
+                break
+            newline = data.find('\n')
+            if newline == -1:
+                continue
+            data = data[newline + 1:]
+            skip_first = False
+
+        if past_end:
+            newline = data.find('\n')
+            if newline == -1:
+                tail += data
+                continue
+            yield tail + data[:newline + 1]
+            tail = ''
+            break
+
+        lines = (tail + data).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if tail:
+        yield tail
+    fh.close()
+
+def _apply_to_range(job):
+    func, path_to_run_file, start, end, args = job
+    return func(iter_range_lines(path_to_run_file, start, end), *args)
+
+def map_line_ranges(path_to_run_file, num_workers, func, *args):
+    '''
+    call func(lines, *args) on disjoint ranges of the lines of a
+    gzipped run in up to num_workers processes.  func and args must
+    be picklable.
+
+    A run that cannot be split is read in this process, and if it is
+    a plain gzip run that has not been indexed yet, then its side
+    index gets built during this first read.
+
+    :returns list: results of func in file order
+    '''
+    offsets = load_member_index(path_to_run_file)
+    if offsets is None:
+        log('building member index for %s during this read' % path_to_run_file)
+        return [func(iter_lines_and_index(path_to_run_file), *args)]
+
+    ranges = split_ranges(path_to_run_file, offsets, num_workers)
+    if len(ranges) == 1:
+        log('%s has a single gzip member and cannot be split, '
+            'rewrite it with kba.scorer._bgzf to parse it in parallel' % path_to_run_file)
+        return [func(iter_range_lines(path_to_run_file, *ranges[0]), *args)]
+
+    log('parsing %s in %d ranges' % (path_to_run_file, len(ranges)))
+    jobs = [(func, path_to_run_file, start, end, args) for start, end in ranges]
+    pool = multiprocessing.Pool(len(ranges))
+    results = pool.map(_apply_to_range, jobs, chunksize=1)
+    pool.close()
+    pool.join()
+    return results
+
+def write_bgzf(lines, path_to_output, level=6):
+    '''
+    write lines to path_to_output as BGZF, i.e. a gzip file made of
+    independently compressed blocks that plain gunzip still reads
+    '''
+    out = open(path_to_output, 'wb')
+
+    def write_block(data):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = compressor.compress(data) + compressor.flush()
+        block_size = 18 + len(cdata) + 8
+        out.write('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00')
+        out.write(struct.pack('<H', block_size - 1))
+        out.write(cdata)
+        out.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+    buf = []
+    buf_len = 0
+    for line in lines:
+        buf.append(line)
+        buf_len += len(line)
+        if buf_len >= BGZF_BLOCK_SIZE:
+            data = ''.join(buf)
+            while len(data) >= BGZF_BLOCK_SIZE:
+                write_block(data[:BGZF_BLOCK_SIZE])
+                data = data[BGZF_BLOCK_SIZE:]
+            buf = [data]
+            buf_len = len(data)
+    if buf_len:
+        write_block(''.join(buf))
+    out.write(BGZF_EOF)
+    out.close()
+
+if __name__ == '__main__':
+    import gzip
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='rewrite a gzipped run file as BGZF so that it can be scored by several processes at once')
+    parser.add_argument('input', help='path to a gzipped run file')
+    parser.add_argument('output', help='path for the BGZF copy')
+    args = parser.parse_args()
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        sys.exit('output must be a different file than input')
+    write_bgzf(gzip.open(args.input), args.output)
+    log('wrote %d blocks to %s' % (len(load_member_index(args.output)), args.output))
@@ -0,0 +1,193 @@
+'''
+tools for packaging the per-team score files into zip archives
+
+Each team gets one archive, ``<team_id>.zip``, in the run directory
+containing all of the CSV and PNG files that the scorers wrote for
+that team's runs.  Archives are built in parallel, one worker process
+per team.  An archive always gets written to a temporary file that
+replaces it once complete, so a crash never leaves a half-written
+archive behind.  Unchanged members get copied from the old archive
+rather than compressed again from their files.  The archives of teams
+that no longer have any score files get removed.
+
+'''
+import os
+import sys
+import time
+import zipfile
+import multiprocessing
+from collections import defaultdict
+
+from kba.scorer._outputs import log
+from kba.scorer._catalog import load_catalog
+
+def team_points_of_contact(run_dir):
+    '''
+    :returns dict: team_id --> set of "poc_name <poc_email>" strings
+    '''
+    POC = defaultdict(set)
+    for fname, entry in load_catalog(run_dir).items():
+        header = entry['header']
+        if header is None:
+            log('no point of contact for %s: %s' % (fname, entry['error']))
+            continue
+        POC[entry['team_id']].add('%s <%s>' % (header['poc_name'], header['poc_email']))
+    return POC
+
+def team_score_files(run_dir):
+    '''
+    :returns dict: team_id --> set of CSV and PNG file names in run_dir
+    '''
+    teams = defaultdict(set)
+    for fname in os.listdir(run_dir):
+        if not fname.endswith(('.png', '.csv')):
+            continue
+        parts = fname.split('-')
+        if not len(parts) >= 2:
+            sys.exit('died: ' + fname)
+        teams[parts[0]].add(fname)
+    return teams
+
+def _dos_date_time(fpath):
+    '''
+    the date_time that zipfile stores for fpath, which has a
+    resolution of two seconds
+    '''
+    date_time = time.localtime(os.stat(fpath).st_mtime)[0:6]
+    return date_time[:5] + (date_time[5] // 2 * 2,)
+
+def _is_unchanged(info, fpath):
+    return info.file_size == os.path.getsize(fpath) \
+        and info.date_time == _dos_date_time(fpath)
+
+def _compression(fname):
+    ## PNG data is already deflated, so compressing it again only
+    ## burns CPU
+    if fname.endswith('.png'):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def _copy_member(src, dst, info):
+    '''
+    copy one member from the src ZipFile into the dst ZipFile, keeping
+    its date_time and compression, so that _is_unchanged still holds
+    for it in the new archive
+    '''
+    member = zipfile.ZipInfo(info.filename, info.date_time)
+    member.compress_type = info.compress_type
+    member.external_attr = info.external_attr
+    dst.writestr(member, src.read(info.filename))
+
+def bundle_team(zip_fpath, run_dir, fnames, arc_dir=''):
+    '''
+    make zip_fpath contain exactly the files in fnames, only adding
+    those that are new or have changed since the archive was written
+
+    :returns int: number of files that were (re)compressed
+    '''
+    wanted = dict()
+    for fname in fnames:
+        wanted[os.path.join(arc_dir, fname)] = os.path.join(run_dir, fname)
+
+    existing = dict()
+    if os.path.exists(zip_fpath):
+        try:
+            old = zipfile.ZipFile(zip_fpath, 'r')
+            existing = dict((info.filename, info) for info in old.infolist())
+            old.close()
+        except zipfile.BadZipfile:
+            log('rebuilding corrupt archive %s' % zip_fpath)
+
+    keep = set(arcname for arcname, info in existing.items()
+               if arcname in wanted and _is_unchanged(info, wanted[arcname]))
+    to_add = sorted(set(wanted) - keep)
+
+    if not to_add and keep == set(existing):
+        return 0
+
+    ## copy the unchanged members across from the old archive, which
+    ## saves reading their files again
+    tmp_fpath = zip_fpath + '.tmp'
+    fh = zipfile.ZipFile(tmp_fpath, 'w')
+    if keep:
+        old = zipfile.ZipFile(zip_fpath, 'r')
+        for arcname in sorted(keep):
+            _copy_member(old, fh, old.getinfo(arcname))
+        old.close()
+
+    for arcname in to_add:
+        fh.write(wanted[arcname], arcname, _compression(arcname))
+    fh.close()
+
+    os.rename(tmp_fpath, zip_fpath)
+
+    return len(to_add)
+
+def _is_team_bundle(zip_fpath, team_id):
+    '''
+    True if zip_fpath is an archive of team_id's score files, as
+    bundle_team writes them
+    '''
+    try:
+        fh = zipfile.ZipFile(zip_fpath, 'r')
+        names = fh.namelist()
+        fh.close()
+    except zipfile.BadZipfile:
+        return False
+    return all(os.path.basename(name).startswith(team_id + '-')
+               and name.endswith(('.png', '.csv'))
+               for name in names)
+
+def remove_stale_bundles(run_dir, team_ids):
+    '''
+    remove the <team_id>.zip archives in run_dir of teams other than
+    team_ids, i.e. teams that no longer have any score files
+
+    :returns list: team_ids whose archives were removed
+    '''
+    removed = []
+    for fname in sorted(os.listdir(run_dir)):
+        team_id, ext = os.path.splitext(fname)
+        if ext != '.zip' or '-' in team_id or team_id in team_ids:
+            continue
+        zip_fpath = os.path.join(run_dir, fname)
+        if _is_team_bundle(zip_fpath, team_id):
+            os.remove(zip_fpath)
+            removed.append(team_id)
+    return removed
+
+def _bundle_team_job(job):
+    team_id, zip_fpath, run_dir, fnames, arc_dir = job
+    return team_id, bundle_team(zip_fpath, run_dir, fnames, arc_dir)
+
+def write_team_bundles(run_dir, arc_dir='', processes=None):
+    '''
+    write a <team_id>.zip archive into run_dir for every team that has
+    score files in run_dir, compressing the archives in parallel.
+
+    :param arc_dir: path to use for the files inside the archives
+
+    :param processes: number of worker processes, defaults to the
+    number of CPUs
+    '''
+    teams = team_score_files(run_dir)
+    for team_id in remove_stale_bundles(run_dir, teams):
+        log('removed the bundle of %s, which has no score files left' % team_id)
+
+    jobs = []
+    for team_id, fnames in sorted(teams.items()):
+        zip_fpath = os.path.join(run_dir, '%s.zip' % team_id)
+        jobs.append((team_id, zip_fpath, run_dir, sorted(fnames), arc_dir))
+
+    if processes == 1 or len(jobs) < 2:
+        results = map(_bundle_team_job, jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_bundle_team_job, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+
+    for team_id, num_added in results:
+        log('bundled %s: %d files added' % (team_id, num_added))
+
+    return dict(results)
@@ -0,0 +1,149 @@
+'''
+catalog of the run files in a run directory
+
+The catalog records each .gz run's JSON header, task, team_id and
+system_id, size, mtime, number of rows and an md5 of the file, and is
+kept in <run_dir>/.run-catalog.json.  Loading the catalog only opens
+the runs that are new or whose size or mtime has changed since the
+catalog was last written, so the scorers and the bundling script can
+choose runs without reading their headers every time.
+
+A run without a JSON header still gets an entry, with header, task_id
+and task set to None and the problem in error, because the CCR scorer
+has always scored such runs.  ssf_run_names refuses them.
+
+'''
+import os
+import json
+import hashlib
+
+from kba.scorer._outputs import log
+from kba.scorer._runparser import sniff_run, open_run, iter_line_batches, RunFormatError
+
+CATALOG_NAME = '.run-catalog.json'
+
+## bumped when the fields of an entry change, so that old catalogs
+## get rebuilt
+CATALOG_VERSION = 1
+
+def _file_md5(path_to_run_file):
+    md5 = hashlib.md5()
+    run_file = open(path_to_run_file, 'rb')
+    while True:
+        data = run_file.read(2**20)
+        if not data:
+            break
+        md5.update(data)
+    run_file.close()
+    return md5.hexdigest()
+
+def _count_rows(path_to_run_file):
+    num_rows = 0
+    run_file = open_run(path_to_run_file)
+    for first_line_num, lines in iter_line_batches(run_file):
+        for line in lines:
+            if line[:1] != '#' and line.strip():
+                num_rows += 1
+    run_file.close()
+    return num_rows
+
+def _catalog_entry(path_to_run_file, st):
+    run_name = os.path.basename(path_to_run_file)[:-len('.gz')]
+    team_id, _, system_id = run_name.partition('-')
+    error = None
+    try:
+        header, first_row = sniff_run(path_to_run_file)
+    except RunFormatError, exc:
+        log('cataloging %s without a header: %s' % (path_to_run_file, exc))
+        header = task_id = task = None
+        error = str(exc)
+    else:
+        task_id = header.get('task_id', '')
+        ## many CCR runs, including some from organizers, have task_id
+        ## set to SSF, so SSF runs must also fill slots in their first row
+        if task_id.startswith('kba-ssf') and first_row is not None and 'NULL' not in first_row:
+            task = 'ssf'
+        else:
+            task = 'ccr'
+    return dict(
+        size=st.st_size,
+        mtime=st.st_mtime,
+        header=header,
+        task_id=task_id,
+        task=task,
+        team_id=team_id,
+        system_id=system_id,
+        num_rows=_count_rows(path_to_run_file),
+        md5=_file_md5(path_to_run_file),
+        error=error,
+        )
+
+def load_catalog(run_dir):
+    '''
+    get the catalog entries of every .gz run in run_dir, refreshing
+    the entries of runs that changed since the catalog was saved
+
+    :returns dict: run file name --> entry dict
+    '''
+    catalog_path = os.path.join(run_dir, CATALOG_NAME)
+    try:
+        saved = json.load(open(catalog_path))
+        if saved.get('version') != CATALOG_VERSION:
+            saved = dict()
+    except (IOError, ValueError):
+        saved = dict()
+    saved_runs = saved.get('runs', {})
+
+    runs = dict()
+    modified = False
+    for fname in sorted(os.listdir(run_dir)):
+        if not fname.endswith('.gz'):
+            continue
+        path_to_run_file = os.path.join(run_dir, fname)
+        st = os.stat(path_to_run_file)
+        entry = saved_runs.get(fname)
+        if not entry or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            log('cataloging %s' % fname)
+            entry = _catalog_entry(path_to_run_file, st)
+            modified = True
+        runs[fname] = entry
+
+    if modified or set(saved_runs) != set(runs):
+        ## several scorers may share a run_dir, so write to a file of
+        ## our own and move it into place
+        tmp_path = '%s.%d.tmp' % (catalog_path, os.getpid())
+        try:
+            json.dump(dict(version=CATALOG_VERSION, runs=runs),
+                      open(tmp_path, 'w'), indent=4, sort_keys=True)
+            os.rename(tmp_path, catalog_path)
+        except (IOError, OSError), exc:
+            ## the run directory might be read-only
+            log('could not save run catalog for %s: %s' % (run_dir, exc))
+
+    return runs
+
+def select_runs(run_dir, task=None, task_id=None, name_filter=None, catalog=None):
+    '''
+    :param task: 'ccr' or 'ssf' to only select runs of that task,
+    which leaves out runs without a header
+
+    :param task_id: only select runs whose header has this task_id
+
+    :param name_filter: only select runs whose file name starts with this
+
+    :param catalog: from load_catalog for run_dir, if already loaded
+
+    :returns list: (run file name, catalog entry) sorted by file name
+    '''
+    if catalog is None:
+        catalog = load_catalog(run_dir)
+    selected = []
+    for fname, entry in sorted(catalog.items()):
+        if name_filter and not fname.startswith(name_filter):
+            continue
+        if task and entry['task'] != task:
+            continue
+        if task_id and entry['task_id'] != task_id:
+            continue
+        selected.append((fname, entry))
+    return selected
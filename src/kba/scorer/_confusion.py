@@ -0,0 +1,118 @@
+'''
+confusion matrices kept as histograms of confidence scores
+
+Rather than adding one to a TP, FP or TN counter of every cutoff for
+each assertion, a ConfusionHistogram adds one to a single bucket of
+the target_id's positive or negative histogram.  The bucket of a conf
+is the number of cutoffs below it, so the counts at cutoff i are sums
+over the buckets above i (TP, FP) or up to i (TN), which
+confusion_matrix computes once per target_id after the run has been
+read.  Each histogram is an array of len(cutoffs) + 1 counts.
+
+A histogram with fractional credit sums a float credit between 0 and 1
+into the positive bucket instead of one, so that its TPs, and the FNs
+that the missing credit leaves, are floats.  It also counts its
+positive assertions, because one that earned no credit still counts
+as a TP for FN_needs_TP.
+
+'''
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+class ConfusionHistogram(object):
+    '''
+    the positive and negative assertions of one mode, per target_id
+    '''
+    def __init__(self, cutoffs, fractional=False):
+        ## ascending, as from range(0, 999, cutoff_step_size)
+        self.cutoffs = list(cutoffs)
+        self._empty = array('l', [0]) * (len(self.cutoffs) + 1)
+        self._empty_positive = array(fractional and 'd' or 'l', self._empty)
+        self.fractional = fractional
+        ## target_id --> number of positive assertions, if fractional
+        self.num_credited = dict()
+        ## in the order that target_ids were first seen, which fixes
+        ## the order of the averages' floating point sums
+        self.positive = OrderedDict()
+        self.negative = OrderedDict()
+
+    def add_target(self, target_id):
+        '''
+        make sure that target_id gets a confusion matrix, even if no
+        assertions about it are added
+        '''
+        if target_id not in self.positive:
+            self.positive[target_id] = array(self._empty_positive.typecode,
+                                             self._empty_positive)
+            self.negative[target_id] = array('l', self._empty)
+
+    def add(self, target_id, conf, is_positive):
+        '''
+        count an assertion that is a TP above its conf, if is_positive,
+        and otherwise an FP above its conf and a TN at or below it
+        '''
+        if target_id not in self.positive:
+            self.add_target(target_id)
+        bucket = bisect_left(self.cutoffs, conf)
+        if is_positive:
+            self.positive[target_id][bucket] += 1
+            if self.fractional:
+                self.num_credited[target_id] = self.num_credited.get(target_id, 0) + 1
+        else:
+            self.negative[target_id][bucket] += 1
+
+    def add_credit(self, target_id, conf, credit):
+        '''
+        count an assertion as a fraction credit of a TP above its conf,
+        for a histogram with fractional credit
+        '''
+        if target_id not in self.positive:
+            self.add_target(target_id)
+        self.positive[target_id][bisect_left(self.cutoffs, conf)] += credit
+        self.num_credited[target_id] = self.num_credited.get(target_id, 0) + 1
+
+    def num_positive(self, target_id):
+        '''
+        :returns int: number of positive assertions of target_id,
+        including those that earned no fractional credit
+        '''
+        if self.fractional:
+            return self.num_credited.get(target_id, 0)
+        return sum(self.positive.get(target_id, ()))
+
+    def confusion_matrix(self, positives, FN_needs_TP=False):
+        '''
+        :param positives: dict of target_id --> number of positives in
+        the annotation, from which FN = positives - TP
+
+        :param FN_needs_TP: leave FN at zero for target_ids without any
+        positive assertions, see num_positive
+
+        :returns dict: target_id --> cutoff --> dict(TP=, FP=, FN=, TN=)
+        '''
+        CM = dict()
+        for target_id, positive in self.positive.iteritems():
+            negative = self.negative[target_id]
+            num_positives = positives.get(target_id, 0)
+            total_positive = sum(positive)
+            total_negative = sum(negative)
+            if self.fractional:
+                set_FN = self.num_credited.get(target_id, 0) or not FN_needs_TP
+            else:
+                set_FN = total_positive or not FN_needs_TP
+            CM[target_id] = dict()
+            positive_below = negative_below = 0
+            for i, cutoff in enumerate(self.cutoffs):
+                positive_below += positive[i]
+                negative_below += negative[i]
+                TP = total_positive - positive_below
+                FN = 0
+                if set_FN:
+                    FN = num_positives - TP
+                    assert FN_needs_TP or FN >= 0, \
+                        "how did we get more TPs than available positives[target_id=%s] = %d >= %d = CM[target_id][cutoff=%f]['TP']" \
+                        % (target_id, num_positives, TP, cutoff)
+                CM[target_id][cutoff] = dict(TP=TP, FP=total_negative - negative_below,
+                                             FN=FN, TN=negative_below)
+        return CM
@@ -0,0 +1,189 @@
+'''
+B-cubed and pairwise scores of how a run's equiv_ids group the slot
+fills that the assessors' equiv_ids group
+
+FILL only checks each assertion against the first pairing of its
+equiv_id with a true equiv_id that it saw, so one mistake costs
+every later assertion of both equiv_ids.  These scores instead compare
+the two clusterings of the assertions that reach FILL, i.e. the
+OVERLAP TPs, within each (target_id, slot_type), giving partial
+credit:
+
+    B-cubed P: average over the assertions of the fraction of its run
+    cluster that is in its true cluster, and R the reverse
+
+    pairwise P: fraction of the pairs of assertions in the same run
+    cluster that are also in the same true cluster, and R the reverse
+
+The assertions above a cutoff only grow as the cutoff goes down, so
+CorefScores sorts each target_id's assertions into confidence buckets
+and adds them from the highest cutoff down, updating the sums behind
+both scores in constant time per assertion.
+
+'''
+## use float division instead of integer division
+from __future__ import division
+
+import csv
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+from kba.scorer._metrics import precision, recall, fscore
+
+class _Clusters(object):
+    '''
+    running sums over a growing set of assertions, each in one run
+    cluster and one true cluster
+    '''
+    def __init__(self):
+        self.num = 0
+        ## (run cluster, true cluster) --> number of assertions in both
+        self.both = defaultdict(int)
+        ## cluster --> [number of assertions, sum of squares of its
+        ## overlaps with the clusters of the other side]
+        self.run = defaultdict(lambda: [0, 0])
+        self.true = defaultdict(lambda: [0, 0])
+        ## sums over the assertions of the B-cubed P and R of each
+        self.B3_P = 0.0
+        self.B3_R = 0.0
+        ## pairs in the same cluster of both, of the run, and of the truth
+        self.pairs_both = 0
+        self.pairs_run = 0
+        self.pairs_true = 0
+
+    def add(self, run_cluster, true_cluster):
+        overlap = self.both[(run_cluster, true_cluster)]
+        self.both[(run_cluster, true_cluster)] = overlap + 1
+        self.num += 1
+        self.pairs_both += overlap
+        self.B3_P += self._grow(self.run[run_cluster], overlap)
+        self.B3_R += self._grow(self.true[true_cluster], overlap)
+        self.pairs_run += self.run[run_cluster][0] - 1
+        self.pairs_true += self.true[true_cluster][0] - 1
+
+    def _grow(self, cluster, overlap):
+        '''
+        add one assertion to cluster, where overlap of the cluster's
+        assertions are in the same cluster on the other side
+
+        :returns float: the change in sum of squares / size, which is
+        the cluster's part of the B-cubed sum
+        '''
+        size, squares = cluster
+        cluster[0] = size + 1
+        cluster[1] = squares + 2 * overlap + 1
+        if size == 0:
+            return 1.0
+        return ((2 * overlap + 1) * size - squares) / (size * (size + 1))
+
+    def sums(self):
+        return dict(N=self.num, B3_P=self.B3_P, B3_R=self.B3_R,
+                    pairs_both=self.pairs_both, pairs_run=self.pairs_run,
+                    pairs_true=self.pairs_true)
+
+def _metrics(sums):
+    '''
+    :returns dict: the B-cubed and pairwise scores from the sums of
+    _Clusters, or of several of them added together
+    '''
+    num = sums['N']
+    stats = dict(N=num)
+    stats['B3_P'] = num and sums['B3_P'] / num or 0.0
+    stats['B3_R'] = num and sums['B3_R'] / num or 0.0
+    stats['B3_F'] = fscore(stats['B3_P'], stats['B3_R'])
+    stats['pairwise_TP'] = sums['pairs_both']
+    stats['pairwise_FP'] = sums['pairs_run'] - sums['pairs_both']
+    stats['pairwise_FN'] = sums['pairs_true'] - sums['pairs_both']
+    stats['pairwise_P'] = precision(stats['pairwise_TP'], stats['pairwise_FP'])
+    stats['pairwise_R'] = recall(stats['pairwise_TP'], stats['pairwise_FN'])
+    stats['pairwise_F'] = fscore(stats['pairwise_P'], stats['pairwise_R'])
+    return stats
+
+class CorefScores(object):
+    '''
+    the FILL assertions of one run, per target_id, for B-cubed and
+    pairwise scores at each cutoff
+    '''
+    def __init__(self):
+        self.cutoffs = []
+        ## target_id --> list of (bucket, run cluster, true cluster)
+        self.assertions = OrderedDict()
+
+    def set_cutoffs(self, cutoffs):
+        ## ascending, as from range(0, 999, cutoff_step_size)
+        self.cutoffs = list(cutoffs)
+
+    def add_target(self, target_id):
+        '''
+        make sure that target_id gets scores, even without assertions
+        '''
+        self.assertions.setdefault(target_id, [])
+
+    def add(self, target_id, slot_type, runs_equiv_id, true_equiv_id, conf):
+        '''
+        add an assertion that reached FILL, where the bucket of conf is
+        the number of cutoffs below it, as in ConfusionHistogram
+        '''
+        self.assertions.setdefault(target_id, []).append(
+            (bisect_left(self.cutoffs, conf), (slot_type, runs_equiv_id), (slot_type, true_equiv_id)))
+
+    def scores(self):
+        '''
+        :returns dict: target_id --> cutoff --> dict of N, B3_P, B3_R,
+        B3_F, pairwise_TP, pairwise_FP, pairwise_FN, pairwise_P,
+        pairwise_R and pairwise_F, for the assertions above the cutoff.
+        The micro_average pools the assertions of all target_ids, and
+        the macro_average averages the P and R of each target_id.
+        '''
+        sums = dict()
+        for target_id, assertions in self.assertions.iteritems():
+            by_bucket = [[] for bucket in xrange(len(self.cutoffs) + 1)]
+            for bucket, run_cluster, true_cluster in assertions:
+                by_bucket[bucket].append((run_cluster, true_cluster))
+            clusters = _Clusters()
+            sums[target_id] = dict()
+            for idx in reversed(xrange(len(self.cutoffs))):
+                for run_cluster, true_cluster in by_bucket[idx + 1]:
+                    clusters.add(run_cluster, true_cluster)
+                sums[target_id][self.cutoffs[idx]] = clusters.sums()
+
+        stats = dict()
+        for target_id in sums:
+            stats[target_id] = dict((cutoff, _metrics(sums[target_id][cutoff]))
+                                    for cutoff in sums[target_id])
+
+        stats['micro_average'] = dict()
+        stats['macro_average'] = dict()
+        num_entities = len(sums)
+        for cutoff in self.cutoffs:
+            total = defaultdict(int)
+            for target_id in sums:
+                for key, value in sums[target_id][cutoff].iteritems():
+                    total[key] += value
+            stats['micro_average'][cutoff] = _metrics(total)
+
+            average = dict(N=total['N'])
+            for kind in ['B3', 'pairwise']:
+                for metric in ['P', 'R']:
+                    name = kind + '_' + metric
+                    average[name] = num_entities and \
+                        sum(stats[target_id][cutoff][name] for target_id in sums) / num_entities
+                average[kind + '_F'] = fscore(average[kind + '_P'], average[kind + '_R'])
+            stats['macro_average'][cutoff] = average
+
+        return stats
+
+COLUMNS = ['N', 'B3_P', 'B3_R', 'B3_F', 'pairwise_TP', 'pairwise_FP', 'pairwise_FN',
+           'pairwise_P', 'pairwise_R', 'pairwise_F']
+
+def write_coref_metrics(path_to_write_csv, stats):
+    '''
+    Write a CSV file with the scores from CorefScores.scores at each
+    cutoff, leaving the pairwise counts of the macro_average empty
+    '''
+    writer = csv.writer(open(path_to_write_csv, 'wb'), delimiter=',')
+    writer.writerow(['target_id', 'cutoff'] + COLUMNS)
+    for target_id in sorted(stats):
+        for cutoff in sorted(stats[target_id], reverse=True):
+            writer.writerow([target_id, cutoff] +
+                            [stats[target_id][cutoff].get(column, '') for column in COLUMNS])
@@ -0,0 +1,143 @@
+'''
+per-entity index of the gzip members that hold each target_id's rows
+
+Scorings that only consider a subset of the entities, e.g. with
+--group, --entity-type, --restricted-entity-list or --reject-twitter,
+can use the index to decompress only the members of a run that hold
+rows for those entities.  This only saves work on runs made of many
+members, such as BGZF runs; see kba.scorer._bgzf
+
+The index is saved next to the run as <run>.gz.entities.json and is
+built the first time a run is read with iter_entity_lines.
+
+'''
+import os
+import json
+
+from kba.scorer._outputs import log
+from kba.scorer._bgzf import inflate_members, iter_range_lines, save_member_index
+
+INDEX_SUFFIX = '.entities.json'
+
+def _index_path(path_to_run_file):
+    return path_to_run_file + INDEX_SUFFIX
+
+def _target_id(line):
+    parts = line.split(None, 4)
+    if len(parts) < 4:
+        return None
+    return parts[3]
+
+def load_entity_index(path_to_run_file):
+    '''
+    :returns dict: with keys "members", a list of member offsets, and
+    "entities", a dict mapping target_id to a list of [first, last]
+    ranges of member numbers, or None if the run has not been
+    indexed since it last changed
+    '''
+    st = os.stat(path_to_run_file)
+    try:
+        index = json.load(open(_index_path(path_to_run_file)))
+    except (IOError, ValueError):
+        return None
+    if index['size'] != st.st_size or index['mtime'] != st.st_mtime:
+        return None
+    return index
+
+def _save_entity_index(path_to_run_file, offsets, entity_members):
+    st = os.stat(path_to_run_file)
+    entities = dict()
+    for target_id, member_nums in entity_members.items():
+        ranges = []
+        for member_num in member_nums:
+            if ranges and ranges[-1][1] + 1 == member_num:
+                ranges[-1][1] = member_num
+            else:
+                ranges.append([member_num, member_num])
+        entities[target_id] = ranges
+    index = dict(size=st.st_size, mtime=st.st_mtime, members=offsets, entities=entities)
+    tmp_path = _index_path(path_to_run_file) + '.tmp'
+    try:
+        json.dump(index, open(tmp_path, 'w'))
+        os.rename(tmp_path, _index_path(path_to_run_file))
+    except (IOError, OSError), exc:
+        log('could not save entity index for %s: %s' % (path_to_run_file, exc))
+    save_member_index(path_to_run_file, offsets)
+
+def _iter_lines_building_index(path_to_run_file):
+    '''
+    yield every line of the run while recording which member owns
+    each line, using the same rule as iter_range_lines: a line
+    belongs to the member that holds the newline in front of it.
+    '''
+    offsets = []
+    ## target_id --> sorted list of member numbers
+    entity_members = dict()
+
+    def record(line, member_num):
+        target_id = _target_id(line)
+        if target_id is None or line.startswith('#'):
+            return
+        member_nums = entity_members.setdefault(target_id, [])
+        if not member_nums or member_nums[-1] != member_num:
+            member_nums.append(member_num)
+
+    fh = open(path_to_run_file, 'rb')
+    tail = ''
+    owner = 0
+    for member_offset, data in inflate_members(fh):
+        if not offsets or offsets[-1] != member_offset:
+            offsets.append(member_offset)
+        member_num = len(offsets) - 1
+        lines = (tail + data).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            record(line, owner)
+            ## every later line in this data is preceded by a newline
+            ## from this member
+            owner = member_num
+            yield line + '\n'
+    if tail:
+        record(tail, owner)
+        yield tail
+    fh.close()
+    _save_entity_index(path_to_run_file, offsets, entity_members)
+
+def iter_entity_lines(path_to_run_file, target_ids):
+    '''
+    yield the lines of a gzipped run that carry assertions about the
+    target_ids, decompressing only the members that hold them.  If the
+    run has not been indexed yet, every line gets read once to build
+    the index.
+    '''
+    index = load_entity_index(path_to_run_file)
+    if index is None:
+        log('building entity index for %s during this read' % path_to_run_file)
+        for line in _iter_lines_building_index(path_to_run_file):
+            if _target_id(line) in target_ids:
+                yield line
+        return
+
+    offsets = index['members']
+    member_nums = set()
+    for target_id in target_ids:
+        for first, last in index['entities'].get(target_id, []):
+            member_nums.update(range(first, last + 1))
+
+    ## coalesce neighboring members into byte ranges
+    file_size = os.path.getsize(path_to_run_file)
+    ranges = []
+    for member_num in sorted(member_nums):
+        end = member_num + 1 < len(offsets) and offsets[member_num + 1] or file_size
+        if ranges and ranges[-1][1] == offsets[member_num]:
+            ranges[-1][1] = end
+        else:
+            ranges.append([offsets[member_num], end])
+
+    log('reading %d of %d members of %s for %d entities'
+        % (len(member_nums), len(offsets), path_to_run_file, len(target_ids)))
+
+    for start, end in ranges:
+        for line in iter_range_lines(path_to_run_file, start, end):
+            if _target_id(line) in target_ids:
+                yield line
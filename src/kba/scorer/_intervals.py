@@ -0,0 +1,63 @@
+'''
+static interval index for finding the byte ranges that overlap a query
+
+The intervals get sorted by start and laid out as an implicit balanced
+binary search tree over that list, where each node also holds the
+largest end in its subtree.  A search skips every subtree whose ends
+all come before the query and every right subtree whose starts all
+come after it, so it visits O(log n + k) nodes to find k overlapping
+intervals.
+
+'''
+
+class IntervalIndex(object):
+    '''
+    closed intervals [start, end], each with a label
+    '''
+    def __init__(self, intervals):
+        '''
+        :param intervals: iterable of (start, end, label)
+        '''
+        intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.labels = [interval[2] for interval in intervals]
+        self.max_ends = list(self.ends)
+        self._augment(0, len(intervals))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _augment(self, lo, hi):
+        '''
+        set the max_ends of the subtree over lo:hi
+
+        :returns int: the largest end in lo:hi, or -1 if it is empty,
+        which is below every byte offset
+        '''
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        max_end = max(self.ends[mid], self._augment(lo, mid), self._augment(mid + 1, hi))
+        self.max_ends[mid] = max_end
+        return max_end
+
+    def search(self, start, end):
+        '''
+        yield the (start, end, label) of every interval that overlaps
+        [start, end]
+        '''
+        stack = [(0, len(self.starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_ends[mid] < start:
+                ## nothing in this subtree reaches start
+                continue
+            stack.append((lo, mid))
+            if self.starts[mid] <= end:
+                if self.ends[mid] >= start:
+                    yield self.starts[mid], self.ends[mid], self.labels[mid]
+                stack.append((mid + 1, hi))
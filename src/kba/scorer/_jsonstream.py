@@ -0,0 +1,122 @@
+'''
+incremental reader for large JSON files of nested objects
+
+json.load builds the whole file in memory before the caller can throw
+any of it away.  A JSONStream instead walks the members of the outer
+objects one key at a time, and only decodes the values that the caller
+asks for, so a loader can filter the file as it reads it:
+
+    stream = JSONStream(open(path))
+    for target_id in stream.members():
+        for slot_type in stream.members():
+            for equiv_id in stream.members():
+                equiv_class = stream.value()
+
+Each call to members must consume the value of every key it yields,
+either by iterating a nested members or by calling value or skip.
+The keys and values are the unicode strings and objects that json.load
+would give.
+
+'''
+import re
+import codecs
+from json.decoder import JSONDecoder, scanstring
+
+WHITESPACE = ' \t\n\r'
+
+## the characters that can end a number, true, false or null
+END_OF_SCALAR = re.compile(r'[\s,\]}]')
+
+class JSONStream(object):
+    '''
+    reads the nested objects of a JSON file from fh one key at a time
+    '''
+    def __init__(self, fh, chunk_size=2**20):
+        self._fh = codecs.getreader('utf-8')(fh)
+        self._chunk_size = chunk_size
+        self._decoder = JSONDecoder()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        '''
+        read another chunk, at least as long as what is left of the
+        buffer, so that decoding a long value again after each chunk
+        stays linear in its length
+
+        :returns bool: False at the end of the file
+        '''
+        if self._eof:
+            return False
+        data = self._fh.read(max(self._chunk_size, len(self._buf) - self._pos))
+        if not data:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        '''
+        skip whitespace and return the next character, or '' at the end
+        '''
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError('expected one of %r but found %r at character %d of the buffer'
+                             % (chars, char, self._pos))
+        self._pos += 1
+        return char
+
+    def _decode(self, decode):
+        '''
+        call decode(buf, pos) until the buffer holds all of the value
+        '''
+        while True:
+            try:
+                value, end = decode(self._buf, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            self._pos = end
+            return value
+
+    def members(self):
+        '''
+        yield the keys of the object that comes next, leaving the
+        stream at the value of each key
+        '''
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            self._expect('"')
+            key = self._decode(lambda buf, pos: scanstring(buf, pos))
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def value(self):
+        '''
+        decode the value that comes next
+        '''
+        if self._peek() not in '{["':
+            ## a number at the end of the buffer might go on in the
+            ## next chunk, whereas a truncated object, array or string
+            ## fails to decode
+            while not END_OF_SCALAR.search(self._buf, self._pos) and self._fill():
+                pass
+        return self._decode(self._decoder.raw_decode)
+
+    def skip(self):
+        self.value()
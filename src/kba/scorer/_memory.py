@@ -0,0 +1,169 @@
+'''
+memory accounting for the stages of scoring a run
+
+A MemoryReport records, at each stage boundary, the current and peak
+RSS of the process and the approximate sizes of the structures that
+the stage holds, e.g. the annotation, the de-duplicated run_set, the
+confusion matrix and the TPs passed between the SSF modes.  Sizes are
+estimated with sys.getsizeof on the first SAMPLE_SIZE items of each
+container, scaled up to the container's length, so measuring a dict
+of millions of entries costs about as much as measuring a hundred.
+
+Given a budget, a thread checks the RSS every BUDGET_POLL_SECONDS and
+logs a warning once it passes WARN_FRACTION of the budget, which is
+usually before the scorer runs out of memory, and again if it goes
+over the budget.
+
+'''
+import sys
+import json
+import time
+import resource
+import threading
+from itertools import islice
+
+from kba.scorer._outputs import log
+from kba.scorer._arena import AnnotationArena
+
+SAMPLE_SIZE = 100
+
+## how deep approx_size looks into nested containers
+MAX_DEPTH = 4
+
+WARN_FRACTION = 0.8
+
+BUDGET_POLL_SECONDS = 1
+
+MB = 2**20
+
+def current_rss():
+    '''
+    :returns int: resident set size of this process in bytes, or None
+    if /proc is not available
+    '''
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize()
+
+def peak_rss():
+    '''
+    :returns int: largest resident set size of this process so far, in bytes
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    ## Linux reports kilobytes
+    return peak * 1024
+
+def approx_size(obj, depth=0):
+    '''
+    estimate the bytes held by obj and the objects that it contains
+    '''
+    if isinstance(obj, AnnotationArena):
+        ## mapped from a file and shared between processes
+        return len(obj._mm)
+    size = sys.getsizeof(obj)
+    if depth >= MAX_DEPTH or isinstance(obj, basestring):
+        return size
+    if isinstance(obj, dict):
+        num_items = len(obj)
+        items = islice(obj.iteritems(), SAMPLE_SIZE)
+        sample = [approx_size(key, depth + 1) + approx_size(value, depth + 1)
+                  for key, value in items]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        num_items = len(obj)
+        sample = [approx_size(item, depth + 1) for item in islice(obj, SAMPLE_SIZE)]
+    elif hasattr(obj, '__dict__'):
+        return size + approx_size(obj.__dict__, depth + 1)
+    else:
+        return size
+    if not sample:
+        return size
+    return size + int(sum(sample) * num_items / len(sample))
+
+class BudgetWatcher(threading.Thread):
+    '''
+    log a warning when the RSS approaches and when it crosses budget bytes
+    '''
+    def __init__(self, name, budget):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.run_name = name
+        self.budget = budget
+        self.warned = False
+        self.exceeded = False
+        self._stop_event = threading.Event()
+
+    def check(self, stage=None):
+        rss = current_rss()
+        if rss is None:
+            return
+        where = stage and 'after %s' % stage or 'while scoring'
+        if not self.warned and rss > WARN_FRACTION * self.budget:
+            self.warned = True
+            log('WARNING: %s is using %d MB %s, which is over %d%% of its %d MB memory budget'
+                % (self.run_name, rss // MB, where, WARN_FRACTION * 100, self.budget // MB))
+        if not self.exceeded and rss > self.budget:
+            self.exceeded = True
+            log('WARNING: %s is using %d MB %s, which is over its %d MB memory budget'
+                % (self.run_name, rss // MB, where, self.budget // MB))
+
+    def run(self):
+        while not self._stop_event.wait(BUDGET_POLL_SECONDS):
+            self.check()
+
+    def stop(self):
+        self._stop_event.set()
+
+class MemoryReport(object):
+    '''
+    memory used at each stage of scoring one run
+    '''
+    def __init__(self, name, budget_mb=None):
+        '''
+        :param name: the run being scored, for the log
+
+        :param budget_mb: warn when the RSS nears this many megabytes
+        '''
+        self.name = name
+        self.budget_mb = budget_mb
+        self.stages = []
+        self.start_time = time.time()
+        self.watcher = None
+        if budget_mb:
+            self.watcher = BudgetWatcher(name, budget_mb * MB)
+            self.watcher.start()
+
+    def stage(self, stage, **structures):
+        '''
+        record the memory in use at the end of a stage, and the sizes of
+        the structures given as keyword arguments
+        '''
+        sizes = dict((name, approx_size(value)) for name, value in structures.items())
+        record = dict(
+            stage=stage,
+            seconds=time.time() - self.start_time,
+            rss=current_rss(),
+            peak_rss=peak_rss(),
+            sizes=sizes,
+            )
+        self.stages.append(record)
+        log('memory after %s: rss %s MB, peak %d MB, %s'
+            % (stage, record['rss'] is None and '?' or record['rss'] // MB,
+               record['peak_rss'] // MB,
+               ', '.join('%s ~%.1f MB' % (name, size / float(MB)) for name, size in sorted(sizes.items()))))
+        if self.watcher:
+            self.watcher.check(stage)
+
+    def write(self, path):
+        '''
+        write the report as JSON and stop watching the budget
+        '''
+        if self.watcher:
+            self.watcher.stop()
+        json.dump(dict(name=self.name, budget_mb=self.budget_mb,
+                       peak_rss=peak_rss(), stages=self.stages),
+                  open(path, 'w'), indent=4, sort_keys=True)
+        log('wrote ' + path)
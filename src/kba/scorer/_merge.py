@@ -0,0 +1,84 @@
+'''
+streaming merge-join of a time-ordered run with the annotation
+
+KBA runs are supposed to list their assertions in stream order, and
+every stream_id starts with the epoch_ticks of the document.  All of
+the assertions that could be duplicates of each other have the same
+stream_id, and hence the same epoch_ticks, so a run in stream order
+can be de-duplicated one epoch at a time.  Walking the annotation in
+the same order yields the judgments for each epoch alongside the
+run's assertions, so the scorer only ever holds one epoch of the run.
+
+A run that goes back in time raises RunOutOfOrder, after which the
+caller has to score the run some other way.
+
+'''
+from kba.scorer._arena import AnnotationArena
+
+class RunOutOfOrder(Exception):
+    pass
+
+def _epoch(stream_id):
+    return int(stream_id.split('-', 1)[0])
+
+def annotation_by_time(annotation):
+    '''
+    get the (key, label) items of the annotation in the order of the
+    epoch_ticks in their stream_ids.  The records of an AnnotationArena
+    are already in this order, so they get streamed from the arena.
+    '''
+    if isinstance(annotation, AnnotationArena):
+        return annotation.iteritems()
+    return sorted(annotation.iteritems(), key=lambda item: _epoch(item[0][0]))
+
+def epoch_windows(lines):
+    '''
+    group the data rows in lines by the epoch_ticks of their stream_id
+
+    yields (epoch_ticks, list of lines)
+
+    :raises RunOutOfOrder: if the epoch_ticks ever decrease
+    '''
+    epoch = None
+    window = []
+    for line_num, line in enumerate(lines):
+        ## Skip Comments
+        if line.startswith('#') or len(line.strip()) == 0:
+            continue
+        line_epoch = _epoch(line.split(None, 3)[2])
+        if line_epoch != epoch:
+            if line_epoch < epoch:
+                raise RunOutOfOrder('line %d goes back in time from %d to %d'
+                                    % (line_num, epoch, line_epoch))
+            if window:
+                yield epoch, window
+            epoch = line_epoch
+            window = []
+        window.append(line)
+    if window:
+        yield epoch, window
+
+def merge_join(lines, sorted_annotation):
+    '''
+    walk a time-ordered run and the time-ordered annotation together
+
+    :param sorted_annotation: iterable of (key, label) in the order
+    given by annotation_by_time, where key[0] is the stream_id
+
+    yields (lines, annotation) for each epoch_ticks that has rows in the
+    run, where annotation is a dict of the annotation items for that
+    epoch_ticks
+    '''
+    sorted_annotation = iter(sorted_annotation)
+    pending = next(sorted_annotation, None)
+    for epoch, window in epoch_windows(lines):
+        window_annotation = dict()
+        while pending is not None:
+            key, label = pending
+            key_epoch = _epoch(key[0])
+            if key_epoch > epoch:
+                break
+            if key_epoch == epoch:
+                window_annotation[key] = label
+            pending = next(sorted_annotation, None)
+        yield window, window_annotation
@@ -0,0 +1,65 @@
+'''
+criteria for when a run's byte range matches a byte range of a slot
+fill in OVERLAP mode
+
+OVERLAP has always required the run's byte range to overlap one of the
+fill's and to be less than ten times as long as it, which lets a run
+that asserts whole sentences match short fills.  ssf --overlap-criteria
+scores OVERLAP again under each of these criteria in the same pass:
+
+    ratio-N      overlaps and is less than N times as long (ratio-10
+                 is the official OVERLAP)
+
+    jaccard-T    the intersection of the two ranges is at least T of
+                 their union
+
+    contains     covers the whole of the fill's range
+
+    within       lies inside the fill's range
+
+'''
+
+## the criterion of the official OVERLAP mode
+DEFAULT_CRITERION = 'ratio-10'
+
+def _ratio(ratio):
+    def criterion(start, end, true_start, true_end):
+        return end - start < ratio * (true_end - true_start)
+    return criterion
+
+def _jaccard(threshold):
+    def criterion(start, end, true_start, true_end):
+        union = max(end, true_end) - min(start, true_start)
+        if union == 0:
+            return True
+        intersection = min(end, true_end) - max(start, true_start)
+        return intersection >= threshold * union
+    return criterion
+
+def _contains(start, end, true_start, true_end):
+    return start <= true_start and true_end <= end
+
+def _within(start, end, true_start, true_end):
+    return true_start <= start and end <= true_end
+
+def make_criterion(name):
+    '''
+    :returns callable: (start, end, true_start, true_end) --> whether
+    the run's range start-end matches the fill's range, given that
+    the two overlap
+
+    :raises ValueError: for names that are not criteria
+    '''
+    kind, dash, param = name.partition('-')
+    if kind == 'ratio' and dash:
+        return _ratio(float(param))
+    if kind == 'jaccard' and dash:
+        threshold = float(param)
+        if not 0 <= threshold <= 1:
+            raise ValueError('jaccard threshold must be between 0 and 1: %r' % name)
+        return _jaccard(threshold)
+    if name == 'contains':
+        return _contains
+    if name == 'within':
+        return _within
+    raise ValueError('not an OVERLAP criterion: %r' % name)
@@ -0,0 +1,136 @@
+'''
+background threads that overlap reading runs with scoring them and
+with writing their output files
+
+prefetch_runs has a reader thread decompress the next run into
+batches of lines while the current run is being scored, and
+BackgroundWriter flushes CSV and PNG files from a writer thread.  Both
+use bounded queues, so a slow consumer makes the producer wait rather
+than letting batches pile up in memory.
+
+'''
+import sys
+import gzip
+import Queue
+import threading
+
+from kba.scorer._outputs import log
+
+## markers put on the batch queue by the reader thread
+_START = 'start'
+_BATCH = 'batch'
+_END = 'end'
+_ERROR = 'error'
+_DONE = 'done'
+
+def _open_run(path_to_run_file):
+    if path_to_run_file.endswith('.gz'):
+        return gzip.open(path_to_run_file, 'r')
+    return open(path_to_run_file, 'r')
+
+def _read_runs(paths, batch_queue, batch_size):
+    try:
+        for path in paths:
+            batch_queue.put((_START, path))
+            run_file = _open_run(path)
+            batch = []
+            for line in run_file:
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    batch_queue.put((_BATCH, batch))
+                    batch = []
+            if batch:
+                batch_queue.put((_BATCH, batch))
+            run_file.close()
+            batch_queue.put((_END, path))
+    except Exception:
+        batch_queue.put((_ERROR, sys.exc_info()))
+    batch_queue.put((_DONE, None))
+
+def _run_lines(batch_queue, state):
+    while True:
+        kind, value = batch_queue.get()
+        if kind == _BATCH:
+            for line in value:
+                yield line
+        elif kind == _END:
+            state['finished'] = True
+            return
+        elif kind == _ERROR:
+            state['finished'] = True
+            raise value[0], value[1], value[2]
+        else:
+            raise AssertionError('unexpected %r on batch queue' % kind)
+
+def prefetch_runs(paths, batch_size=10000, max_batches=16):
+    '''
+    yield (path, lines) for each run file in paths, where lines
+    iterates over the run's lines.  A reader thread stays up to
+    max_batches batches of batch_size lines ahead of the consumer,
+    including reading into the next run while this one is scored.
+    '''
+    batch_queue = Queue.Queue(max_batches)
+    reader = threading.Thread(target=_read_runs, args=(paths, batch_queue, batch_size))
+    reader.daemon = True
+    reader.start()
+
+    while True:
+        kind, value = batch_queue.get()
+        if kind == _DONE:
+            break
+        if kind == _ERROR:
+            raise value[0], value[1], value[2]
+        assert kind == _START, kind
+
+        state = dict(finished=False)
+        lines = _run_lines(batch_queue, state)
+        yield value, lines
+
+        ## drain whatever the consumer did not read of this run
+        if not state['finished']:
+            for line in lines:
+                pass
+
+    reader.join()
+
+class BackgroundWriter(object):
+    '''
+    call output functions, such as write_graph, in a single writer
+    thread so that scoring can move on to the next run.  At most
+    max_pending calls wait in the queue.
+    '''
+    def __init__(self, max_pending=8):
+        self._queue = Queue.Queue(max_pending)
+        self._errors = []
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            func, args = task
+            try:
+                func(*args)
+            except Exception:
+                log('background write failed: %s%r' % (func.__name__, args[:1]))
+                self._errors.append(sys.exc_info())
+
+    def submit(self, func, *args):
+        if self._errors:
+            self.close()
+        self._queue.put((func, args))
+
+    def close(self):
+        '''
+        wait for all submitted writes to finish, and re-raise the first
+        exception that any of them raised
+        '''
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._errors:
+            exc_info = self._errors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
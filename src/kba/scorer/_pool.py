@@ -0,0 +1,169 @@
+'''
+persistent index of the assertion keys that the SSF runs in a run
+directory make, for scoring with --pooled-only
+
+The (stream_id, target_id, slot_type) keys of each run are kept in
+<run_dir>/.ssf-pool/<run file name>.keys.gz, sorted and unique, and
+.ssf-pool/manifest.json records the md5 from the run catalog of the
+run that each key file came from.  Building the pool only reads the
+runs that are new or whose md5 changed, in parallel processes, and
+gets the keys of every other run from its much smaller key file.
+
+A run directory that cannot be written to gets its key files in a
+temporary directory instead, which is only kept for the one scoring.
+
+'''
+import os
+import json
+import gzip
+import shutil
+import tempfile
+import multiprocessing
+
+from kba.scorer._outputs import log
+from kba.scorer._runparser import open_run, iter_rows
+
+POOL_DIR = '.ssf-pool'
+
+MANIFEST_NAME = 'manifest.json'
+
+KEY_COLUMNS = ('stream_id', 'target_id', 'slot_type')
+
+class PoolIndex(object):
+    '''
+    the assertion keys of a list of runs, each with the set of runs
+    that made it, as a bitmask over the list
+    '''
+    def __init__(self, run_file_names):
+        self.run_file_names = list(run_file_names)
+        self.keys = dict()
+
+    def add_run(self, run_file_name, keys):
+        bit = 1 << self.run_file_names.index(run_file_name)
+        for key in keys:
+            self.keys[key] = self.keys.get(key, 0) | bit
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def contributors(self, key):
+        '''
+        :returns list: file names of the runs that made key
+        '''
+        mask = self.keys.get(key, 0)
+        return [run_file_name for idx, run_file_name in enumerate(self.run_file_names)
+                if mask & (1 << idx)]
+
+def _key_file_path(pool_dir, run_file_name):
+    return os.path.join(pool_dir, run_file_name + '.keys.gz')
+
+def read_run_keys(path_to_run_file):
+    '''
+    :returns list: the sorted, unique assertion keys of the run
+    '''
+    run_file = open_run(path_to_run_file)
+    keys = set(iter_rows(run_file, KEY_COLUMNS))
+    run_file.close()
+    return sorted(keys)
+
+def _cache_run_keys(job):
+    '''
+    read a run's keys and save them to its key file, in a worker process
+    '''
+    run_dir, pool_dir, run_file_name = job
+    keys = read_run_keys(os.path.join(run_dir, run_file_name))
+    key_file_path = _key_file_path(pool_dir, run_file_name)
+    tmp_path = '%s.%d.tmp' % (key_file_path, os.getpid())
+    key_file = gzip.open(tmp_path, 'wb')
+    for key in keys:
+        key_file.write('\t'.join(key) + '\n')
+    key_file.close()
+    os.rename(tmp_path, key_file_path)
+    return run_file_name, len(keys)
+
+def iter_key_file(key_file_path):
+    for line in gzip.open(key_file_path):
+        stream_id, target_id, slot_type = line.rstrip('\n').split('\t')
+        yield stream_id, intern(target_id), intern(slot_type)
+
+def _load_manifest(pool_dir):
+    try:
+        return json.load(open(os.path.join(pool_dir, MANIFEST_NAME)))
+    except (IOError, ValueError):
+        return dict()
+
+def _save_manifest(pool_dir, manifest):
+    manifest_path = os.path.join(pool_dir, MANIFEST_NAME)
+    ## several scorers may share a run_dir, so write to a file of our
+    ## own and move it into place
+    tmp_path = '%s.%d.tmp' % (manifest_path, os.getpid())
+    json.dump(manifest, open(tmp_path, 'w'), indent=4, sort_keys=True)
+    os.rename(tmp_path, manifest_path)
+
+def _pool_dir(run_dir):
+    '''
+    :returns tuple: (path of the directory for key files, whether it
+    is a temporary one)
+    '''
+    pool_dir = os.path.join(run_dir, POOL_DIR)
+    try:
+        if not os.path.isdir(pool_dir):
+            os.mkdir(pool_dir)
+        if os.access(pool_dir, os.W_OK):
+            return pool_dir, False
+    except OSError:
+        pass
+    log('could not write to %s, so the pool index only lasts for this scoring' % pool_dir)
+    return tempfile.mkdtemp(prefix='kba-pool-'), True
+
+def load_pool(run_dir, run_file_names, catalog, processes=None):
+    '''
+    get the PoolIndex of run_file_names, reading only the runs whose
+    key files are missing or out of date
+
+    :param catalog: from load_catalog for run_dir
+
+    :param processes: number of runs to read at once, defaults to the
+    number of CPUs
+    '''
+    pool_dir, is_temporary = _pool_dir(run_dir)
+    manifest = _load_manifest(pool_dir)
+
+    stale = [run_file_name for run_file_name in run_file_names
+             if manifest.get(run_file_name) != catalog[run_file_name]['md5']
+             or not os.path.exists(_key_file_path(pool_dir, run_file_name))]
+    if stale:
+        log('reading the assertion keys of %d of %d runs for the pool'
+            % (len(stale), len(run_file_names)))
+        jobs = [(run_dir, pool_dir, run_file_name) for run_file_name in stale]
+        processes = min(processes or multiprocessing.cpu_count(), len(stale))
+        if processes > 1:
+            workers = multiprocessing.Pool(processes)
+            results = workers.imap_unordered(_cache_run_keys, jobs)
+        else:
+            workers = None
+            results = map(_cache_run_keys, jobs)
+        for run_file_name, num_keys in results:
+            log('pooled %d assertion keys from %s' % (num_keys, run_file_name))
+            manifest[run_file_name] = catalog[run_file_name]['md5']
+        if workers:
+            workers.close()
+            workers.join()
+        if not is_temporary:
+            _save_manifest(pool_dir, manifest)
+
+    pool = PoolIndex(run_file_names)
+    for run_file_name in run_file_names:
+        pool.add_run(run_file_name, iter_key_file(_key_file_path(pool_dir, run_file_name)))
+
+    if is_temporary:
+        shutil.rmtree(pool_dir, ignore_errors=True)
+
+    log('pool has %d assertion keys from %d runs' % (len(pool), len(run_file_names)))
+    return pool
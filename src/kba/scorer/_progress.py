@@ -0,0 +1,215 @@
+'''
+progress of a long scoring job, for monitoring
+
+A Progress tracks the runs done out of the total, the rows read and
+the rows/sec over the last interval, the stream items fetched by
+scorer2, the run being scored and an ETA.  A thread writes them every
+interval seconds to a status file in the Prometheus text exposition
+format, which the node exporter's textfile collector can pick up, and
+can also serve them at http://127.0.0.1:<port>/metrics.  The status
+includes the time of the last update, so a job whose rows/sec drops
+to zero, or whose file stops changing, has stalled.
+
+Rows get counted as the run parser converts each batch, so runs that
+are parsed in other processes, e.g. with --parse-workers, only count
+when they finish, using the row counts in the run catalog.
+
+'''
+import os
+import time
+import threading
+import BaseHTTPServer
+
+from kba.scorer import _runparser
+from kba.scorer._outputs import log
+
+INTERVAL_SECONDS = 10
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Progress(object):
+    '''
+    progress through the runs of one scoring job
+    '''
+    def __init__(self, scorer, job, run_rows, status_file=None, status_port=None,
+                 interval=INTERVAL_SECONDS):
+        '''
+        :param scorer: name of the scorer, e.g. 'ccr'
+
+        :param job: description of the job, which labels the metrics
+
+        :param run_rows: dict of run file name --> number of rows, from
+        the run catalog, for the runs that the job will score
+
+        :param status_file: path to write the metrics to
+
+        :param status_port: if set, serve the metrics on this port of localhost
+        '''
+        self.labels = 'scorer="%s",job="%s"' % (_escape(scorer), _escape(job))
+        self.run_rows = run_rows
+        self.runs_total = len(run_rows)
+        self.rows_total = sum(run_rows.values())
+        self.runs_done = 0
+        self.rows_done = 0
+        self.stream_items_fetched = 0
+        self.current_run = None
+        self.current_run_rows = 0
+        self.start_time = time.time()
+        self.state = 'running'
+        self.status_file = status_file
+        self.interval = interval
+        self._last_time = self.start_time
+        self._last_rows = 0
+        self._rows_per_second = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        self.server = None
+        if status_port:
+            self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', status_port), _make_handler(self))
+            server_thread = threading.Thread(target=self.server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            log('serving progress at http://127.0.0.1:%d/metrics' % status_port)
+
+        _runparser.batch_listeners.append(self.add_rows)
+        self._thread = threading.Thread(target=self._write_periodically)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_rows(self, num_rows):
+        self.rows_done += num_rows
+        self.current_run_rows += num_rows
+
+    def add_stream_items(self, num_items=1):
+        self.stream_items_fetched += num_items
+
+    def start_run(self, run_file_name):
+        self.current_run = run_file_name
+        self.current_run_rows = 0
+
+    def finish_run(self):
+        '''
+        count the current run as done, along with any of its rows that
+        were not parsed in this process
+        '''
+        expected = self.run_rows.get(self.current_run, 0)
+        if self.current_run_rows < expected:
+            self.rows_done += expected - self.current_run_rows
+        self.runs_done += 1
+        self.current_run = None
+        self.current_run_rows = 0
+
+    def eta_seconds(self):
+        '''
+        :returns float: seconds until the last run finishes, at the
+        average pace so far, or -1 if there is no pace yet
+        '''
+        elapsed = time.time() - self.start_time
+        if self.rows_total and self.rows_done:
+            return max(0.0, elapsed * (self.rows_total - self.rows_done) / self.rows_done)
+        if self.runs_done:
+            return elapsed * (self.runs_total - self.runs_done) / self.runs_done
+        return -1.0
+
+    def _update_rate(self):
+        now = time.time()
+        with self._lock:
+            if now > self._last_time:
+                self._rows_per_second = (self.rows_done - self._last_rows) / (now - self._last_time)
+            self._last_time = now
+            self._last_rows = self.rows_done
+
+    def rows_per_second(self):
+        if self._last_time > self.start_time:
+            return self._rows_per_second
+        ## not written yet, so use the pace since the start
+        elapsed = time.time() - self.start_time
+        return elapsed and self.rows_done / elapsed or 0.0
+
+    def render(self):
+        '''
+        :returns str: the metrics in Prometheus text exposition format
+        '''
+        metrics = [
+            ('runs_total', 'gauge', 'runs that the job will score', self.runs_total),
+            ('runs_done', 'gauge', 'runs scored so far', self.runs_done),
+            ('rows_total', 'gauge', 'rows in all of the runs, from the run catalog', self.rows_total),
+            ('rows_read_total', 'counter', 'rows read so far', self.rows_done),
+            ('rows_per_second', 'gauge', 'rows read per second over the last interval',
+             self.rows_per_second()),
+            ('stream_items_fetched_total', 'counter', 'stream items fetched so far',
+             self.stream_items_fetched),
+            ('eta_seconds', 'gauge', 'estimated seconds until the job finishes, or -1 if unknown',
+             self.eta_seconds()),
+            ('start_time_seconds', 'gauge', 'unix time when the job started', self.start_time),
+            ('last_update_time_seconds', 'gauge', 'unix time of this update', self._last_time),
+            ('finished', 'gauge', '1 once the job has finished', int(self.state == 'finished')),
+            ]
+        lines = []
+        for name, metric_type, help_text, value in metrics:
+            lines.append('# HELP kba_scorer_%s %s' % (name, help_text))
+            lines.append('# TYPE kba_scorer_%s %s' % (name, metric_type))
+            lines.append('kba_scorer_%s{%s} %s' % (name, self.labels, repr(float(value))))
+        lines.append('# HELP kba_scorer_current_run run being scored')
+        lines.append('# TYPE kba_scorer_current_run gauge')
+        if self.current_run:
+            lines.append('kba_scorer_current_run{%s,run="%s"} 1'
+                         % (self.labels, _escape(self.current_run)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        self._update_rate()
+        if not self.status_file:
+            return
+        ## write to another file and move it into place, so that
+        ## readers never see half of the file
+        tmp_path = '%s.%d.tmp' % (self.status_file, os.getpid())
+        fh = open(tmp_path, 'w')
+        fh.write(self.render())
+        fh.close()
+        os.rename(tmp_path, self.status_file)
+
+    def _write_periodically(self):
+        while True:
+            try:
+                self.write()
+            except (IOError, OSError), exc:
+                log('could not write progress to %s: %s' % (self.status_file, exc))
+            if self._stop_event.wait(self.interval):
+                break
+
+    def close(self):
+        '''
+        write the final status and stop updating it
+        '''
+        self._stop_event.set()
+        self._thread.join()
+        if self.add_rows in _runparser.batch_listeners:
+            _runparser.batch_listeners.remove(self.add_rows)
+        self.state = 'finished'
+        self.current_run = None
+        self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+def _make_handler(progress):
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = progress.render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            ## keep requests out of the scorer's log
+            pass
+
+    return MetricsHandler
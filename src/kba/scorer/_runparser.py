@@ -0,0 +1,307 @@
+'''
+one parser for the rows of KBA run files, shared by all of the scorers
+
+Run files are read in large byte buffers rather than line by line,
+each row is only split as far as the last column that the caller asked
+for, and the requested columns are converted and validated a whole
+batch at a time.  A problem with a row raises RunFormatError naming
+the row's line number.
+
+The column names follow the 2013 filter-run schema; the 2014 SSF runs
+put the slot value in the equiv_id column and a list of byte ranges in
+the byte_range column.  Those runs get read with a tab delimiter, for
+which the rows get split by csv.reader, as scorer2 used to read them,
+so that a quoted value can hold tabs and quotes.
+
+Target: on one core, iter_rows should read a gzipped run at least
+1.25 times as many rows/sec as the old line by line split() readers,
+and iter_column_batches at least 1.5 times as many.  On a run of one
+million rows, the old readers manage about 200,000 rows/sec,
+iter_rows about 280,000 and column batches about 380,000 for
+CCR_COLUMNS.  Measure it on a real run with::
+
+    python -m kba.scorer._runparser run.gz [--columns ssf]
+
+'''
+import re
+import gc
+import sys
+import csv
+import gzip
+import json
+from itertools import izip
+
+COLUMNS = ('team_id', 'system_id', 'stream_id', 'target_id', 'conf', 'rating',
+           'contains_mention', 'date_hour', 'slot_type', 'equiv_id', 'byte_range')
+
+_column_index = dict((name, idx) for idx, name in enumerate(COLUMNS))
+
+CCR_COLUMNS = ('stream_id', 'target_id', 'conf', 'rating')
+
+SSF_COLUMNS = ('stream_id', 'target_id', 'conf', 'rating', 'contains_mention',
+               'date_hour', 'slot_type', 'equiv_id', 'byte_range')
+
+READ_SIZE = 2**20
+
+BATCH_SIZE = 10000
+
+## callables that iter_column_batches calls with the number of rows in
+## each batch that it parses, e.g. to track progress
+batch_listeners = []
+
+class RunFormatError(ValueError):
+    pass
+
+def _stream_ids(values):
+    for stream_id in values:
+        if not stream_id.partition('-')[0].isdigit():
+            raise ValueError('stream_id does not start with epoch_ticks: %r' % stream_id)
+    return values
+
+def _confs(values):
+    confs = map(int, map(float, values))
+    if confs and not (0 < min(confs) and max(confs) <= 1000):
+        raise ValueError('conf must be in (0, 1000]')
+    return confs
+
+def _ratings(values):
+    ratings = map(int, values)
+    if ratings and not (-1 <= min(ratings) and max(ratings) <= 2):
+        raise ValueError('rating must be in [-1, 2]')
+    return ratings
+
+def _ints(values):
+    return map(int, values)
+
+_byte_range = re.compile(r'\d+-\d+$')
+
+def _byte_ranges(values):
+    ## stays a string, because the SSF scorer only splits the byte
+    ## ranges of the DOCS TPs
+    for byte_range in values:
+        if not _byte_range.match(byte_range):
+            raise ValueError('byte_range is not <start>-<end>: %r' % byte_range)
+    return values
+
+## column name --> function that converts and validates a list of
+## the column's strings
+_converters = dict(
+    stream_id=_stream_ids,
+    conf=_confs,
+    rating=_ratings,
+    contains_mention=_ints,
+    byte_range=_byte_ranges,
+    )
+
+def open_run(path_to_run_file):
+    if path_to_run_file.endswith('.gz'):
+        return gzip.open(path_to_run_file, 'rb')
+    return open(path_to_run_file, 'rb')
+
+def sniff_run(path_to_run_file):
+    '''
+    read the JSON header from the first line of a run file and the
+    first row after it
+
+    :returns tuple: (header dict, first row or None if there are none)
+    '''
+    run_file = open_run(path_to_run_file)
+    try:
+        first_line = run_file.readline()
+        if not first_line.startswith('#'):
+            raise RunFormatError('%s does not start with a JSON header: %r'
+                                 % (path_to_run_file, first_line[:100]))
+        try:
+            header = json.loads(first_line[1:])
+        except ValueError:
+            raise RunFormatError('failed to get JSON out of: %r' % first_line[1:])
+        for line in run_file:
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
+            return header, line
+        return header, None
+    finally:
+        run_file.close()
+
+def iter_line_batches(source, batch_size=BATCH_SIZE):
+    '''
+    yield (line number of the first line, list of lines) for batches
+    of the lines in source.  If source has a read method, then it is
+    read in buffers of READ_SIZE bytes; otherwise source is iterated
+    over as lines.  The lines have no trailing newline, nor the
+    carriage return of a CRLF line end.
+    '''
+    line_num = 1
+    if hasattr(source, 'read'):
+        tail = ''
+        while True:
+            data = source.read(READ_SIZE)
+            if not data:
+                break
+            data = tail + data
+            lines = data.split('\n')
+            tail = lines.pop()
+            if '\r' in data:
+                lines = [line.rstrip('\r') for line in lines]
+            yield line_num, lines
+            line_num += len(lines)
+        if tail:
+            yield line_num, [tail.rstrip('\r')]
+    else:
+        batch = []
+        for line in source:
+            batch.append(line.rstrip('\r\n'))
+            if len(batch) >= batch_size:
+                yield line_num, batch
+                line_num += len(batch)
+                batch = []
+        if batch:
+            yield line_num, batch
+
+def _split_rows(lines, maxsplit, delimiter):
+    if delimiter is None:
+        return [line.split(None, maxsplit) for line in lines
+                if line[:1] != '#' and line.strip()]
+    ## all of the columns, because a quoted value can hold the delimiter
+    lines = [line for line in lines if line[:1] != '#' and line.strip()]
+    rows = list(csv.reader(lines, delimiter=delimiter, strict=True))
+    if len(rows) != len(lines):
+        raise ValueError('a quoted value runs past the end of its line')
+    return rows
+
+def _convert(columns, indexes, rows, converters, num_columns=None):
+    if num_columns:
+        for row in rows:
+            if len(row) != num_columns:
+                raise ValueError('expected %d columns, found %s'
+                                 % (num_columns, len(row) > num_columns and 'more' or len(row)))
+    batch = dict()
+    for name, idx in izip(columns, indexes):
+        values = [row[idx] for row in rows]
+        converter = converters.get(name)
+        if converter:
+            values = converter(values)
+        batch[name] = values
+    return batch
+
+def _find_error(columns, indexes, maxsplit, delimiter, first_line_num, lines,
+                converters, num_columns):
+    '''
+    convert the lines of a failed batch one at a time to find the
+    first one that is broken
+    '''
+    for offset, line in enumerate(lines):
+        try:
+            rows = _split_rows([line], maxsplit, delimiter)
+            _convert(columns, indexes, rows, converters, num_columns)
+        except (ValueError, IndexError, csv.Error), exc:
+            return RunFormatError('line %d: %s: %r' % (first_line_num + offset, exc, line))
+    return None
+
+def iter_column_batches(source, columns, delimiter=None, batch_size=BATCH_SIZE,
+                        num_columns=None, converters=None):
+    '''
+    parse the rows of a run into batches of typed columns.  Comment
+    and blank lines are skipped.
+
+    :param source: file handle or iterable of lines, see iter_line_batches
+
+    :param columns: names from COLUMNS; conf, rating and
+    contains_mention become ints and the rest stay strings.  stream_id,
+    conf, rating and byte_range also get checked.
+
+    :param delimiter: None to split on any whitespace like the 2013
+    scorers, or '\\t' for runs whose values can hold spaces, which get
+    split like csv.reader does, so a value can be quoted.  A quoted
+    value cannot span lines, though.
+
+    :param num_columns: if set, then every row must have exactly this
+    many columns, e.g. len(COLUMNS)
+
+    :param converters: column name --> converter or None, to replace
+    the checks of those columns, e.g. byte_range=None for the lists of
+    byte ranges in 2014 runs
+
+    yields dict: column name --> list of values, all of equal length
+
+    :raises RunFormatError: on the first bad row
+    '''
+    indexes = [_column_index[name] for name in columns]
+    ## the row only needs to be split up to the last requested column,
+    ## or one past the number of columns, so that extra ones show up
+    maxsplit = max(max(indexes) + 1, num_columns or 0)
+    if converters:
+        converters = dict(_converters, **converters)
+    else:
+        converters = _converters
+    for first_line_num, lines in iter_line_batches(source, batch_size):
+        ## splitting allocates a list per row, which would otherwise
+        ## set off many collections of everything else the scorer
+        ## holds, such as the de-duplicated run set
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            rows = _split_rows(lines, maxsplit, delimiter)
+            batch = _convert(columns, indexes, rows, converters, num_columns)
+        except (ValueError, IndexError, csv.Error):
+            exc = _find_error(columns, indexes, maxsplit, delimiter, first_line_num, lines,
+                              converters, num_columns)
+            if exc is None:
+                raise
+            raise exc
+        finally:
+            if gc_enabled:
+                gc.enable()
+        for listener in batch_listeners:
+            listener(len(rows))
+        yield batch
+
+def iter_rows(source, columns, delimiter=None, batch_size=BATCH_SIZE,
+              num_columns=None, converters=None):
+    '''
+    parse the rows of a run like iter_column_batches, yielding a tuple
+    of the requested columns for each row
+    '''
+    for batch in iter_column_batches(source, columns, delimiter, batch_size,
+                                     num_columns, converters):
+        for row in izip(*[batch[name] for name in columns]):
+            yield row
+
+def _split_reader(run_file, columns):
+    ## the line by line way that the scorers used to read runs, for
+    ## comparison in the benchmark
+    indexes = [_column_index[name] for name in columns]
+    for line in run_file:
+        if line.startswith('#') or len(line.strip()) == 0:
+            continue
+        row = line.split()
+        row[4] = int(float(row[4]))
+        row[5] = int(row[5])
+        yield tuple([row[idx] for idx in indexes])
+
+def _count_batch_rows(source, columns):
+    for batch in iter_column_batches(source, columns):
+        for value in batch[columns[0]]:
+            yield value
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='measure the rows/sec of the run parser against reading line by line with split()')
+    parser.add_argument('run_file', help='path to a run file')
+    parser.add_argument('--columns', default='ccr', choices=['ccr', 'ssf'])
+    args = parser.parse_args()
+    columns = args.columns == 'ccr' and CCR_COLUMNS or SSF_COLUMNS
+
+    for name, read in [('split() lines', lambda: _split_reader(open_run(args.run_file), columns)),
+                       ('iter_rows', lambda: iter_rows(open_run(args.run_file), columns)),
+                       ('column batches', lambda: _count_batch_rows(open_run(args.run_file), columns))]:
+        start = time.time()
+        num_rows = 0
+        for row in read():
+            num_rows += 1
+        elapsed = time.time() - start
+        print '%-14s %9d rows in %6.2f sec = %9d rows/sec' % (
+            name, num_rows, elapsed, num_rows / max(elapsed, 1e-6))
+    sys.exit(0)
@@ -0,0 +1,131 @@
+'''
+inputs that are expensive to load and can be reused by the scoring
+jobs that kba.scorer.orchestrate runs one after another in a process,
+and by the processes that score one run at a time for
+kba.scorer.jobqueue and kba.scorer.daemon
+
+'''
+import os
+import copy
+
+from kba.scorer import ccr, ssf
+from kba.scorer._runparser import open_run
+
+SCORERS = dict(ccr=ccr, ssf=ssf)
+
+class SharedInputs(object):
+    '''
+    memo of loaded inputs, such as parsed judgments and run catalogs.
+
+    Values loaded from a file are keyed on the file's size and mtime
+    as well as its path, so a file that changes between jobs gets
+    loaded again.  Callers must not modify the values they get.
+    '''
+    def __init__(self):
+        self._values = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, path, load, *args):
+        '''
+        get load(path, *args), calling load only if no earlier job in
+        this process already did so for the same kind, path and args
+        '''
+        st = os.stat(path)
+        key = (kind, os.path.abspath(path), st.st_size, st.st_mtime) + args
+        if key in self._values:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._values[key] = load(path, *args)
+        return self._values[key]
+
+    def get_for_sweep(self, kind, path, load, *args):
+        '''
+        like get, but ignores changes to path, e.g. for a run_dir that
+        the jobs write their scores into, but whose runs stay the same
+        for the whole sweep
+        '''
+        key = (kind, os.path.abspath(path)) + args
+        if key in self._values:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._values[key] = load(path, *args)
+        return self._values[key]
+
+class RunScorer(object):
+    '''
+    scores single runs of a job, given as a dict with the scorer's
+    name and its args like in kba.scorer.orchestrate, keeping the
+    annotation of the last job loaded for the next run
+    '''
+    def __init__(self, shared=None):
+        self.shared = shared or SharedInputs()
+        self.job_name = None
+
+    def load(self, job):
+        if job['name'] == self.job_name:
+            return
+        ## drop the last job's annotation before loading the next one
+        self.job_name = None
+        self.inputs = None
+        self.facets = []
+        scorer = SCORERS[job['scorer']]
+        self.args = scorer.make_parser().parse_args(job['args'])
+        reject = scorer.make_reject(self.args)
+        self.inputs = scorer.load_run_annotation(self.args, reject, shared=self.shared)
+        if job['scorer'] == 'ssf':
+            self.facets = ssf.load_facets(self.args, shared=self.shared)
+        self.job_name = job['name']
+
+    def _args(self, run_dir):
+        if run_dir is None:
+            return self.args
+        args = copy.copy(self.args)
+        args.run_dir = run_dir
+        return args
+
+    def _facets(self, run_dir):
+        if run_dir is None:
+            return self.facets
+        facets = []
+        for facet, annotation, positives in self.facets:
+            facet = copy.copy(facet)
+            facet.run_dir = run_dir
+            facets.append((facet, annotation, positives))
+        return facets
+
+    def score(self, job, run_file_name, run_dir=None):
+        '''
+        score one run and write its CSV and PNG files next to it
+
+        :param run_dir: directory holding the run, if not the job's run_dir
+
+        :returns dict: max_scores for ccr, or mode --> max_scores for
+        ssf, along with 'facets' --> list of the same for each --facet
+        '''
+        self.load(job)
+        args = self._args(run_dir)
+        if job['scorer'] == 'ccr':
+            return ccr.process_run(args, run_file_name[:-len('.gz')], self.inputs,
+                                   ccr.make_description(args), ccr.rating_threshold(args))
+        annotation, positives = self.inputs
+        run_file = open_run(os.path.join(args.run_dir, run_file_name))
+        try:
+            return ssf.process_ssf_run(args, run_file_name, run_file, annotation, positives,
+                                       facets=self._facets(run_dir))
+        finally:
+            run_file.close()
+
+    def output_paths(self, job, run_file_name, run_dir=None):
+        '''
+        :returns list: paths of the files that score writes for the run
+        '''
+        self.load(job)
+        args = self._args(run_dir)
+        if job['scorer'] == 'ssf':
+            return ssf.output_paths(args, run_file_name, self._facets(run_dir))
+        base_output_filepath = os.path.join(
+            args.run_dir, run_file_name[:-len('.gz')] + '-' + ccr.make_description(args))
+        return [base_output_filepath + '.csv', base_output_filepath + '.png']
@@ -0,0 +1,110 @@
+'''
+out-of-core partitioning of run files that are too big to deduplicate
+in memory
+
+The rows of a run are hash-partitioned by target_id into temporary
+spill files.  Every assertion key used for de-duplication includes the
+target_id, so each partition can be de-duplicated and scored on its
+own and the results are the same as scoring the whole run at once.
+
+'''
+import os
+import zlib
+import shutil
+import tempfile
+import itertools
+
+from kba.scorer._outputs import log
+
+## rough ratio between the memory used by a de-duplicated row held in
+## a python dict and the length of the row's text
+ROW_MEMORY_FACTOR = 6
+
+DEFAULT_NUM_PARTITIONS = 64
+
+## how many times an over-budget partition may be split again with a
+## different hash salt before giving up and processing it anyway
+MAX_RESPLITS = 4
+
+def _partition_id(key, salt, num_partitions):
+    return (zlib.crc32('%d:%s' % (salt, key)) & 0xffffffff) % num_partitions
+
+_spill_counter = itertools.count()
+
+def _spill(lines, key_column, num_partitions, salt, tmp_dir):
+    '''
+    write the data rows in lines into num_partitions spill files
+    keeping the original order within each file
+
+    :returns list: paths to the spill files
+    '''
+    spill_num = next(_spill_counter)
+    paths = [os.path.join(tmp_dir, 'partition-%d-%d' % (spill_num, idx))
+             for idx in range(num_partitions)]
+    spill_files = [open(path, 'wb') for path in paths]
+    for line in lines:
+        ## Skip Comments
+        if line.startswith('#') or len(line.strip()) == 0:
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        key = line.split(None, key_column + 1)[key_column]
+        spill_files[_partition_id(key, salt, num_partitions)].write(line)
+    for spill_file in spill_files:
+        spill_file.close()
+    return paths
+
+def partition_lines(lines, key_column, memory_budget,
+                    num_partitions=DEFAULT_NUM_PARTITIONS, tmp_dir=None):
+    '''
+    hash-partition the rows in lines by the value in key_column and
+    yield one file handle per non-empty partition.  Partitions whose
+    rows would not fit in memory_budget bytes are split again.
+
+    Spill files are removed as soon as the caller moves on to the
+    next partition.
+
+    :param lines: iterable of run file lines, comments are dropped
+
+    :param key_column: index of the whitespace separated column to
+    partition on, e.g. 3 for target_id
+
+    :param memory_budget: bytes of memory available for holding one
+    partition's de-duplicated rows
+
+    :param tmp_dir: directory in which to create the spill directory
+    '''
+    spill_dir = tempfile.mkdtemp(prefix='kba-spill-', dir=tmp_dir)
+    try:
+        pending = [(path, 0) for path in
+                   _spill(lines, key_column, num_partitions, 0, spill_dir)]
+        while pending:
+            path, salt = pending.pop(0)
+            size = os.path.getsize(path)
+            if size == 0:
+                os.remove(path)
+                continue
+
+            if size * ROW_MEMORY_FACTOR > memory_budget:
+                if salt < MAX_RESPLITS:
+                    num_splits = int(size * ROW_MEMORY_FACTOR // memory_budget) + 2
+                    sub_paths = _spill(open(path, 'rb'), key_column, num_splits,
+                                       salt + 1, spill_dir)
+                    os.remove(path)
+                    ## if every row landed in the same partition, then
+                    ## splitting again will not help
+                    non_empty = [sub_path for sub_path in sub_paths
+                                 if os.path.getsize(sub_path)]
+                    next_salt = len(non_empty) > 1 and salt + 1 or MAX_RESPLITS
+                    pending = [(sub_path, next_salt) for sub_path in sub_paths] + pending
+                    continue
+                log('partition of %d bytes exceeds memory budget of %d bytes, '
+                    'probably because of a single very large target_id'
+                    % (size, memory_budget))
+
+            partition = open(path, 'rb')
+            yield partition
+            partition.close()
+            os.remove(path)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
@@ -0,0 +1,205 @@
+'''
+flat, compact index of the SSF truth data
+
+The SSF scorer looks up (stream_id, target_id, slot_type) assertion
+keys for DOCS, and the equiv_ids and byte ranges of the fills behind
+a key for OVERLAP.  Rather than nesting dicts of stream_id -->
+target_id --> slot_type --> equiv_id --> equiv_class JSON, which keeps
+the whole truth file alive, an SSFAnnotation numbers the keys and
+holds everything else in typed arrays indexed by those numbers:
+
+    record r: rec_stream[r], rec_target[r], rec_slot[r] index the
+    interned stream_id, target_id and slot_type tables
+
+    fills of r: fill_equiv[fill_first[r]:fill_first[r + 1]] index the
+    equiv_id table
+
+    byte ranges of fill f: off_start/off_end[off_first[f]:off_first[f + 1]]
+
+For scoring how late a run finds a fill, the annotation also keeps the
+earliest date_hour of any document that the assessors found for each
+(target_id, slot_type, equiv_id), as hours since the epoch.
+
+A single dict maps each key tuple to its record number, so a DOCS
+lookup is one hash of the key.  OVERLAP scans the byte ranges of a
+record, except that a record with many of them gets an IntervalIndex,
+which is kept only until OVERLAP asks about another record.  The
+DOCS_TPs come sorted by stream_id within each date_hour, so the
+assertions of one record follow each other.  Pickling only sends the tables and
+arrays, and the dict gets rebuilt from them on the other side.
+
+'''
+import time
+import calendar
+from array import array
+
+from kba.scorer._intervals import IntervalIndex
+
+## records with fewer byte ranges than this get scanned rather than
+## indexed for OVERLAP
+MIN_INDEXED_RANGES = 16
+
+def date_hour_to_hour(date_hour):
+    '''
+    :returns int: hours since the epoch of a YYYY-MM-DD-HH date_hour
+    '''
+    return calendar.timegm(time.strptime(date_hour, '%Y-%m-%d-%H')) // 3600
+
+def _compact(value):
+    '''
+    keep ASCII strings from the JSON as str rather than unicode, which
+    compares and hashes the same but takes a quarter of the memory
+    '''
+    try:
+        return intern(value.encode('ascii'))
+    except UnicodeError:
+        return value
+
+class SSFAnnotation(object):
+    '''
+    the fills that assessors found, keyed by (stream_id, target_id,
+    slot_type), in the order that the keys were added.  target_ids
+    lists the target_ids in the order of their first keys.
+    '''
+    def __init__(self):
+        self.stream_ids = []
+        self.target_ids = []
+        self.slot_types = []
+        self.equiv_ids = []
+        self.rec_stream = array('I')
+        self.rec_target = array('H')
+        self.rec_slot = array('B')
+        self.fill_first = array('I', [0])
+        self.fill_equiv = array('I')
+        self.off_first = array('I', [0])
+        self.off_start = array('l')
+        self.off_end = array('l')
+        ## (target_id, slot_type, equiv_id) --> hour of its earliest document
+        self.earliest = dict()
+        self._init_lookups()
+
+    def _init_lookups(self):
+        self._index = dict()
+        self._nums = dict((name, dict((value, num) for num, value in enumerate(getattr(self, name))))
+                          for name in ['stream_ids', 'target_ids', 'slot_types', 'equiv_ids'])
+        for r in xrange(len(self.rec_stream)):
+            self._index[self._key(r)] = r
+        ## (record, IntervalIndex) of the last indexed record that
+        ## OVERLAP asked about
+        self._intervals = (None, None)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ['_index', '_nums', '_intervals']:
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lookups()
+
+    def _intern(self, name, value):
+        nums = self._nums[name]
+        num = nums.get(value)
+        if num is None:
+            value = _compact(value)
+            num = nums[value] = len(nums)
+            getattr(self, name).append(value)
+        return num
+
+    def _key(self, r):
+        return (self.stream_ids[self.rec_stream[r]],
+                self.target_ids[self.rec_target[r]],
+                self.slot_types[self.rec_slot[r]])
+
+    def add(self, stream_id, target_id, slot_type, fills):
+        '''
+        :param fills: list of (equiv_id, byte ranges), where byte ranges
+        is a list of [start_byte, end_byte]
+        '''
+        self.rec_stream.append(self._intern('stream_ids', stream_id))
+        self.rec_target.append(self._intern('target_ids', target_id))
+        self.rec_slot.append(self._intern('slot_types', slot_type))
+        for equiv_id, offsets in fills:
+            self.fill_equiv.append(self._intern('equiv_ids', equiv_id))
+            for offset in offsets:
+                assert isinstance(offset[0], int)
+                assert isinstance(offset[1], int)
+                self.off_start.append(offset[0])
+                self.off_end.append(offset[1])
+            self.off_first.append(len(self.off_start))
+        self.fill_first.append(len(self.fill_equiv))
+        r = len(self.rec_stream) - 1
+        self._index[self._key(r)] = r
+
+    def set_earliest(self, target_id, slot_type, equiv_id, date_hour):
+        '''
+        record the earliest date_hour of the documents that assessors
+        found for the fill equiv_id of target_id's slot_type
+        '''
+        key = (_compact(target_id), _compact(slot_type), _compact(equiv_id))
+        self.earliest[key] = date_hour_to_hour(date_hour)
+
+    def earliest_hour(self, target_id, slot_type, equiv_id):
+        '''
+        :returns int: hours since the epoch of the earliest date_hour
+        from set_earliest, or None
+        '''
+        return self.earliest.get((target_id, slot_type, equiv_id))
+
+    def __len__(self):
+        return len(self.rec_stream)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        for r in xrange(len(self.rec_stream)):
+            yield self._key(r)
+
+    def fills(self, key):
+        '''
+        :returns list: equiv_ids of the fills for key
+        '''
+        r = self._index[key]
+        return [self.equiv_ids[num]
+                for num in self.fill_equiv[self.fill_first[r]:self.fill_first[r + 1]]]
+
+    def overlapping_equiv_ids(self, key, start_byte, end_byte, criteria):
+        '''
+        :param criteria: list of callables from
+        kba.scorer._overlap.make_criterion
+
+        :returns list: (equiv_id, matches) of each fill for key, where
+        matches lists whether any of the fill's byte ranges that
+        overlap start_byte-end_byte meets each of criteria
+        '''
+        r = self._index[key]
+        first, last = self.fill_first[r], self.fill_first[r + 1]
+        if self.off_first[last] - self.off_first[first] < MIN_INDEXED_RANGES:
+            off_start, off_end = self.off_start, self.off_end
+            hits = ((off_start[o], off_end[o], f)
+                    for f in xrange(first, last)
+                    for o in xrange(self.off_first[f], self.off_first[f + 1])
+                    if off_start[o] <= end_byte and off_end[o] >= start_byte)
+        else:
+            indexed, index = self._intervals
+            if indexed != r:
+                index = IntervalIndex(
+                    (self.off_start[o], self.off_end[o], f)
+                    for f in xrange(first, last)
+                    for o in xrange(self.off_first[f], self.off_first[f + 1]))
+                self._intervals = (r, index)
+            hits = index.search(start_byte, end_byte)
+        ## fill --> whether it meets each criterion
+        matches = dict()
+        for true_start, true_end, f in hits:
+            found = matches.get(f)
+            if found is None:
+                found = matches[f] = [False] * len(criteria)
+            for idx, criterion in enumerate(criteria):
+                if not found[idx]:
+                    found[idx] = criterion(start_byte, end_byte, true_start, true_end)
+        none = [False] * len(criteria)
+        return [(self.equiv_ids[self.fill_equiv[f]], matches.get(f, none))
+                for f in xrange(first, last)]
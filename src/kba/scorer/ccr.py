@@ -20,29 +20,64 @@ import csv
 import gzip
 import json
 import time
+import shutil
 import argparse
+import tempfile
+import traceback
+import multiprocessing
 from datetime import datetime
 from collections import defaultdict, Counter
 
 from kba.scorer._metrics import compile_and_average_performance_metrics, find_max_scores
 from kba.scorer._outputs import write_team_summary, write_graph, write_performance_metrics, log
-
-def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotated_is_TN, include_training, debug, thresh=2, require_positives=0):
+from kba.scorer._bundles import write_team_bundles
+from kba.scorer._spill import partition_lines
+from kba.scorer._bgzf import map_line_ranges
+from kba.scorer._entity_index import iter_entity_lines
+from kba.scorer._pipeline import prefetch_runs, BackgroundWriter
+from kba.scorer._arena import AnnotationArena, write_arena, can_pack
+from kba.scorer._merge import annotation_by_time, merge_join, RunOutOfOrder
+from kba.scorer._runparser import iter_rows, CCR_COLUMNS
+from kba.scorer._catalog import select_runs, load_catalog
+from kba.scorer._memory import MemoryReport
+from kba.scorer._progress import Progress
+from kba.scorer.drilldown import DrilldownRecorder, CCR
+
+def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotated_is_TN, include_training, debug, thresh=2, require_positives=0, spill_budget=None, parse_workers=None, entity_index=False, run_lines=None, sorted_merge=False, sorted_annotation=None, memory=None, drilldown=None):
     '''
     This function generates the confusion matrix (number of true/false positives
     and true/false negatives.  
     
     path_to_run_file: str, a filesystem link to the run submission 
-    annotation: dict, containing the annotation data from *after* the cutoff
+    annotation: dict, containing the annotation data from *after* the cutoff,
+    or an AnnotationArena holding the same data
     cutoff_step: int, increment between cutoffs
     unannotated_is_TN: boolean, true to count unannotated as negatives
     include_training: boolean, true to include training documents
+    spill_budget: int, if set, then hash-partition the run by target_id
+    into temporary files and de-duplicate each partition within this
+    many bytes of memory
+    parse_workers: int, if set, then parse disjoint byte ranges of a
+    BGZF or multi-member gzip run in this many processes
+    entity_index: boolean, true to use a per-entity index of the run
+    to read only the rows about entities in the annotation
+    run_lines: iterable, lines of the run that were already read by
+    the caller, e.g. by a prefetching thread
+    sorted_merge: boolean, true to stream through a run that is in
+    stream order while holding only one epoch of it in memory.  Runs
+    that turn out to be out of order get scored in memory instead.
+    sorted_annotation: the annotation's items from annotation_by_time,
+    if the caller already has them
+    memory: MemoryReport that records the sizes of the run_set and CM
+    drilldown: DrilldownRecorder that saves the judged assertions
     
     returns a confusion matrix dictionary for each target_id 
     '''
     
     ## Open the run file    
-    if path_to_run_file.endswith('.gz'):
+    if run_lines is not None:
+        run_file = run_lines
+    elif path_to_run_file.endswith('.gz'):
         run_file = gzip.open(path_to_run_file, 'r')
     else:
         run_file = open(path_to_run_file, 'r')
@@ -54,37 +89,119 @@ def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotate
     ## count the total number of assertions per entity
     num_assertions = {}
 
-    num_positives = defaultdict(int)
-    for (stream_id, target_id), is_positive in annotation.items():
-        ## compute total counts of number of positives for each target_id
-        if is_positive:
-            num_positives[target_id] += 1
-
-        ## make sure that the confusion matrix has entries for all entities
-        if target_id not in CM:
+    if isinstance(annotation, AnnotationArena):
+        ## the arena stores these counts, so there is no need to walk
+        ## all of its records for every run
+        num_positives = defaultdict(int, annotation.num_positives())
+        for target_id in annotation.target_ids:
             CM[target_id] = dict()
             for cutoff in cutoffs:
-                CM[target_id][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)     
+                CM[target_id][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+    else:
+        num_positives = defaultdict(int)
+        for (stream_id, target_id), is_positive in annotation.items():
+            ## compute total counts of number of positives for each target_id
+            if is_positive:
+                num_positives[target_id] += 1
+
+            ## make sure that the confusion matrix has entries for all entities
+            if target_id not in CM:
+                CM[target_id] = dict()
+                for cutoff in cutoffs:
+                    CM[target_id][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)     
+
+    ## rows about entities that are not in the annotation cannot
+    ## change the confusion matrix, so skip the parts of the run that
+    ## only hold those
+    if entity_index and not parse_workers > 1 and path_to_run_file.endswith('.gz'):
+        run_file = iter_entity_lines(path_to_run_file, set(CM))
+
+    run_sets = None
+    if sorted_merge:
+        if sorted_annotation is None:
+            sorted_annotation = annotation_by_time(annotation)
+        try:
+            for window, window_annotation in merge_join(run_file, sorted_annotation):
+                window_set = dedup_assertions(window, num_positives, thresh, require_positives)
+                score_assertions(window_set, window_annotation, CM, cutoffs,
+                                 num_assertions, unannotated_is_TN, drilldown)
+            run_sets = []
+        except RunOutOfOrder, exc:
+            log('%s is not in stream order, %s, so scoring it in memory instead'
+                % (path_to_run_file, exc))
+            ## start over from an empty confusion matrix
+            for target_id in CM:
+                for cutoff in cutoffs:
+                    CM[target_id][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+            num_assertions.clear()
+            if drilldown:
+                drilldown.reset(CCR)
+            if path_to_run_file.endswith('.gz'):
+                run_file = gzip.open(path_to_run_file, 'r')
+            else:
+                run_file = open(path_to_run_file, 'r')
+
+    ## the assertion keys all contain the target_id, so partitions of
+    ## the run by target_id can be de-duplicated independently
+    if run_sets is not None:
+        pass
+    elif spill_budget:
+        run_sets = (dedup_assertions(run_lines, num_positives, thresh, require_positives)
+                    for run_lines in partition_lines(run_file, 3, spill_budget))
+    elif parse_workers > 1 and path_to_run_file.endswith('.gz'):
+        run_sets = [merge_run_sets(map_line_ranges(
+                    path_to_run_file, parse_workers, dedup_assertions,
+                    dict(num_positives), thresh, require_positives))]
+    else:
+        run_sets = [dedup_assertions(run_file, num_positives, thresh, require_positives)]
 
-    ## Iterate through every row of the run and construct a
-    ## de-duplicated run summary
-    run_set = dict()
-    for onerow in run_file:
-        ## Skip Comments         
-        if onerow.startswith('#') or len(onerow.strip()) == 0:
-            continue
+    for run_set in run_sets:
+        log('considering %d assertions' % len(run_set))
+        if memory:
+            memory.stage('dedup', run_set=run_set)
+        score_assertions(run_set, annotation, CM, cutoffs, num_assertions, unannotated_is_TN,
+                         drilldown)
+
+    if memory:
+        memory.stage('score', CM=CM)
+    
+    ## Correct FN for things in the annotation set that are NOT in the run
+    ## using the number of true things in the annotation set
+    annotation_positives = num_positives
+
+    for target_id in CM:
+        for cutoff in CM[target_id]:
+            ## Then subtract the number of TP at each cutoffs 
+            ## (since FN+TP==True things in annotation set)
+            #log('annotation_positives[%s] = %d' % (target_id, annotation_positives[target_id]))
+            #log('CN[%s][cutoff=%d] = %r' % (target_id, cutoff, CM[target_id][cutoff]))
+
+            CM[target_id][cutoff]['FN'] = annotation_positives[target_id] - CM[target_id][cutoff]['TP']
+
+            #log('CN[%s][cutoff=%d] = %r' % (target_id, cutoff, CM[target_id][cutoff]))
+            assert annotation_positives[target_id] >= CM[target_id][cutoff]['TP'], \
+                "how did we get more TPs than available annotation_positives[target_id=%s] = %d >= %d = CM[target_id][cutoff=%f]['TP']" \
+                % (target_id, annotation_positives[target_id], CM[target_id][cutoff]['TP'], cutoff)
+
+    log( 'showing assertion counts:' )
+    log( json.dumps(num_assertions, indent=4, sort_keys=True) )
+
+    return CM
 
-        row = onerow.split()
-        stream_id = row[2]
-        timestamp = int(stream_id.split('-')[0])
-        target_id = row[3]
-        conf = int(float(row[4]))
-        assert 0 < conf <= 1000
-        row[4] = conf
+def dedup_assertions(run_lines, num_positives, thresh=2, require_positives=0):
+    '''
+    Iterate through every row of the run and construct a
+    de-duplicated run summary
+
+    run_lines: file handle or iterable of lines from a run file
+    num_positives: dict, number of positives per target_id in the annotation
 
-        rating = int(row[5])
-        assert -1 <= rating <= 2
-        row[5] = rating
+    returns dict mapping (stream_id, target_id) to the parsed row, a
+    tuple of the CCR_COLUMNS (stream_id, target_id, conf, rating)
+    '''
+    run_set = dict()
+    for row in iter_rows(run_lines, CCR_COLUMNS):
+        stream_id, target_id, conf, rating = row
 
         #log('ratings:  %r <?> %r' % (rating, thresh))
         if rating < thresh:
@@ -98,32 +215,50 @@ def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotate
         assertion_key = (stream_id, target_id)
         if assertion_key in run_set:
             other_row = run_set[assertion_key]
-            if other_row[4] > conf:
+            if other_row[2] > conf:
                 log('ignoring a duplicate row with lower conf: %d > %d'
-                    % (other_row[4], conf))
+                    % (other_row[2], conf))
                 continue
 
-            if other_row[4] == conf:
+            if other_row[2] == conf:
                 ## compare rating level
-                if other_row[5] != rating:
+                if other_row[3] != rating:
                     log('same conf, different rating:\n%r\n%r\ntaking higher rating' % (row, other_row))
                     ## accept higher rating
-                    if other_row[5] > rating:
+                    if other_row[3] > rating:
                         continue
 
         #log('got a row: %r' % (row,))
         run_set[assertion_key] = row
 
-    log('considering %d assertions' % len(run_set))
+    return run_set
+
+def merge_run_sets(run_sets):
+    '''
+    combine run sets that dedup_assertions built from consecutive
+    parts of one run into the run set for the whole run.  Like
+    dedup_assertions, this keeps the last of the rows with the highest
+    (conf, rating) for each assertion key.
+    '''
+    merged = dict()
+    for run_set in run_sets:
+        for assertion_key, row in run_set.iteritems():
+            other_row = merged.get(assertion_key)
+            if other_row and (other_row[2], other_row[3]) > (row[2], row[3]):
+                continue
+            merged[assertion_key] = row
+    return merged
+
+def score_assertions(run_set, annotation, CM, cutoffs, num_assertions, unannotated_is_TN,
+                     drilldown=None):
+    '''
+    Add the de-duplicated assertions in run_set to the confusion
+    matrix CM and to the per-entity assertion counts in num_assertions,
+    and to drilldown, if given
+    '''
     run_set = run_set.values()
     while run_set:
-        row = run_set.pop()
-
-        stream_id = row[2]
-        timestamp = int(stream_id.split('-')[0])
-        target_id = row[3]
-        conf = row[4]
-        rating = row[5]
+        stream_id, target_id, conf, rating = run_set.pop()
 
         if target_id not in num_assertions:
             num_assertions[target_id] = {'total': 0,
@@ -134,21 +269,27 @@ def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotate
         num_assertions[target_id]['total'] += 1
         num_assertions[target_id]['in_ETR'] += 1
         
-        in_annotation_set = (stream_id, target_id) in annotation
+        ## one lookup serves both tests, which matters when the
+        ## annotation is an AnnotationArena
+        label = annotation.get((stream_id, target_id))
+        in_annotation_set = label is not None
 
         if in_annotation_set:
             num_assertions[target_id]['in_annotation_set'] += 1
 
         
+        if drilldown and (in_annotation_set or unannotated_is_TN):
+            drilldown.add(CCR, target_id, stream_id, conf, label)
+
         ## In the annotation set and useful
-        if in_annotation_set and annotation[(stream_id, target_id)]:            
+        if in_annotation_set and label:            
             for cutoff in cutoffs:                
                 if conf > cutoff:
                     ## If above the cutoff: true-positive
                     CM[target_id][cutoff]['TP'] += 1                    
                    
         ## In the annotation set and non-useful                       
-        elif in_annotation_set and not annotation[(stream_id, target_id)]:
+        elif in_annotation_set and not label:
             for cutoff in cutoffs:
                 if conf > cutoff:
                     ## Above the cutoff: false-positive
@@ -165,35 +306,18 @@ def build_confusion_matrix(path_to_run_file, annotation, cutoff_step, unannotate
                 else:
                     ## Below the cutoff: true-negative
                     CM[target_id][cutoff]['TN'] += 1    
-    
-    ## Correct FN for things in the annotation set that are NOT in the run
-    ## First, calculate number of true things in the annotation set
-    annotation_positives = defaultdict(int)
-    for stream_id, target_id in annotation:
-        timestamp = int(stream_id.split('-')[0])
-
-        annotation_positives[target_id] += int(annotation[(stream_id,target_id)])
-        
-    for target_id in CM:
-        for cutoff in CM[target_id]:
-            ## Then subtract the number of TP at each cutoffs 
-            ## (since FN+TP==True things in annotation set)
-            #log('annotation_positives[%s] = %d' % (target_id, annotation_positives[target_id]))
-            #log('CN[%s][cutoff=%d] = %r' % (target_id, cutoff, CM[target_id][cutoff]))
-
-            CM[target_id][cutoff]['FN'] = annotation_positives[target_id] - CM[target_id][cutoff]['TP']
-
-            #log('CN[%s][cutoff=%d] = %r' % (target_id, cutoff, CM[target_id][cutoff]))
-            assert annotation_positives[target_id] >= CM[target_id][cutoff]['TP'], \
-                "how did we get more TPs than available annotation_positives[target_id=%s] = %d >= %d = CM[target_id][cutoff=%f]['TP']" \
-                % (target_id, annotation_positives[target_id], CM[target_id][cutoff]['TP'], cutoff)
-
-    log( 'showing assertion counts:' )
-    log( json.dumps(num_assertions, indent=4, sort_keys=True) )
 
     return CM
     
-def load_annotation(path_to_annotation_file, thresh, min_len_clean_visible, reject, require_positives=False, any_up=False, restricted_entity_list=None):
+def read_truth_rows(path_to_annotation_file):
+    '''
+    :returns list: rows of the tab-separated annotation file, each a
+    list of strings, which load_annotation can filter in different
+    ways without parsing the file again
+    '''
+    return list(csv.reader(open(path_to_annotation_file, 'r'), delimiter='\t'))
+
+def load_annotation(path_to_annotation_file, thresh, min_len_clean_visible, reject, require_positives=False, any_up=False, restricted_entity_list=None, truth_rows=None):
     '''Loads the annotation file into a dict
     
     path_to_annotation_file: string filesystem path to the annotation file
@@ -210,10 +334,16 @@ def load_annotation(path_to_annotation_file, thresh, min_len_clean_visible, reje
     :param restricted_entity_list: a list of target_id strings that
     are the only ones allowed in the annotation.
 
+    :param truth_rows: rows from read_truth_rows for the file, if
+    already read
+
     '''
     assert -1 <= thresh <= 2, thresh
 
-    annotation_file = csv.reader(open(path_to_annotation_file, 'r'), delimiter='\t')
+    if truth_rows is not None:
+        annotation_file = truth_rows
+    else:
+        annotation_file = csv.reader(open(path_to_annotation_file, 'r'), delimiter='\t')
 
     annotation = dict()
     for row in annotation_file:
@@ -331,12 +461,39 @@ def make_description(args):
 
     return description
 
-def process_run(args, run_file_name, annotation, description, thresh):
+def process_run(args, run_file_name, annotation, description, thresh,
+                run_lines=None, writer=None, sorted_annotation=None, target_order=None):
     '''
     compute scores and generate output files for a single run
+
+    :param run_lines: iterable of the run's lines, if already being read
+
+    :param writer: BackgroundWriter for the output files, or None to
+    write them before returning
+
+    :param sorted_annotation: annotation items from annotation_by_time
+    for --sorted-merge, shared by all of the runs
+
+    :param target_order: list that gets the target_ids of max_scores
+    in the order that they were added, for rebuilding the same dict in
+    another process
     
     :returns dict: max_scores for this one run
     '''
+    base_output_filepath = os.path.join(
+        args.run_dir, 
+        run_file_name + '-' + description)
+
+    memory = None
+    if args.memory_report or args.memory_budget:
+        memory = MemoryReport(run_file_name, args.memory_budget)
+        memory.stage('load', annotation=annotation)
+
+    drilldown = None
+    if args.drilldown:
+        drilldown = DrilldownRecorder('ccr', run_file_name)
+        drilldown.set_cutoffs(CCR, range(0, 999, args.cutoff_step))
+
     ## Generate confusion matrices from a run for each target_id
     ## and for each step of the confidence cutoff
     stats = build_confusion_matrix(
@@ -344,93 +501,266 @@ def process_run(args, run_file_name, annotation, description, thresh):
         annotation, args.cutoff_step, args.unan_is_true, args.include_training,
         thresh=thresh,
         require_positives=args.require_positives,
+        spill_budget=args.out_of_core_mb and args.out_of_core_mb * 2**20,
+        parse_workers=args.parse_workers,
+        entity_index=args.entity_index,
+        run_lines=run_lines,
+        sorted_merge=args.sorted_merge,
+        sorted_annotation=sorted_annotation,
+        memory=memory,
+        drilldown=drilldown,
         debug=args.debug)
 
+    if drilldown:
+        for (stream_id, target_id), is_positive in annotation.items():
+            if is_positive:
+                drilldown.add_truth(CCR, target_id, stream_id)
+        ## every target_id in the confusion matrix, even without positives
+        drilldown.set_num_positives(CCR, dict(
+                (target_id, len(drilldown.truth[CCR].get(target_id, ()))) for target_id in stats))
+        drilldown.write(base_output_filepath + '.drilldown')
+
     compile_and_average_performance_metrics(stats)
 
     max_scores = find_max_scores(stats)
+    if target_order is not None:
+        target_order.extend(stats)
 
-    log(json.dumps(stats, indent=4, sort_keys=True))
+    if memory:
+        memory.stage('metrics', stats=stats)
+        memory.write(base_output_filepath + '.memory.json')
 
-    base_output_filepath = os.path.join(
-        args.run_dir, 
-        run_file_name + '-' + description)
+    log(json.dumps(stats, indent=4, sort_keys=True))
 
     output_filepath = base_output_filepath + '.csv'
-    write_performance_metrics(output_filepath, stats)
-
-    ## Output a graph of the key performance statistics
     graph_filepath = base_output_filepath + '.png'
-    write_graph(graph_filepath, stats)
+    if writer:
+        writer.submit(write_performance_metrics, output_filepath, stats)
+        writer.submit(write_graph, graph_filepath, stats)
+    else:
+        write_performance_metrics(output_filepath, stats)
+
+        ## Output a graph of the key performance statistics
+        write_graph(graph_filepath, stats)
 
     return max_scores
 
+def _process_run_job(job):
+    '''
+    process_run in a worker process of score_all_runs.  The annotation
+    arrives as an AnnotationArena, which unpickles by mapping the
+    arena file rather than by copying the annotation.
+
+    :returns list: (target_id, scores) of max_scores, in the order
+    that process_run added them, see unpack_max_scores
+    '''
+    args, run_file_name, annotation, description, thresh = job
+    target_order = []
+    try:
+        max_scores = process_run(args, run_file_name, annotation, description, thresh,
+                                 target_order=target_order)
+    except Exception, exc:
+        ## the traceback does not survive the trip back to the parent
+        log('died on %s:\n%s' % (run_file_name, traceback.format_exc(exc)))
+        raise
+    return [(target_id, max_scores[target_id]) for target_id in target_order]
+
+def unpack_max_scores(items):
+    '''
+    rebuild the max_scores of _process_run_job.  A dict that unpickles
+    gets its keys in its old iteration order rather than in the order
+    they were added, which can change the order that it iterates in,
+    and so the order of the rows in the target_id overview.
+    '''
+    max_scores = defaultdict(dict)
+    for target_id, scores in items:
+        max_scores[target_id] = scores
+    return max_scores
+
+def rating_threshold(args):
+    '''
+    :returns int: the lowest rating that counts as positive
+    '''
+    if args.include_neutral:
+        return 0
+    elif args.include_useful:
+        return 1
+    else:
+        return 2
+
+def make_reject(args):
+    '''
+    construct the callable that rejects truth data for the entities
+    that args filter out
+    '''
+    accepted_target_ids = set()
+    if args.group or args.entity_type:
+        if not args.topics_path:
+            sys.exit('must specify --topics-path to use --group')
+        targets = json.load(open(args.topics_path))['targets']
+        for targ in targets:
+            if ('group' in targ and targ.get('group') == args.group) or targ['entity_type'] == args.entity_type:
+                accepted_target_ids.add(targ['target_id'])
+
+    def reject(target_id):
+        if args.reject_twitter and 'twitter.com' in target_id:
+            return True
+        if args.reject_wikipedia and 'wikipedia.org' in target_id:
+            return True
+        if args.group or args.entity_type:
+            if target_id not in accepted_target_ids:
+                return True  ## i.e. reject it
+        return False
+
+    return reject
+
+def load_run_annotation(args, reject, shared=None):
+    '''
+    load the annotation that every run gets scored against
 
-def score_all_runs(args, description, reject):
+    :param shared: SharedInputs to get the parsed annotation file from
+    '''
+    restricted_entity_list = None
+    if args.restricted_entity_list:
+        restricted_entity_list = set(open(args.restricted_entity_list).read().splitlines())
+        log('loaded %d entities into restricted_entity_list:\n%s' % 
+            (len(restricted_entity_list),
+             '\n'.join(restricted_entity_list)))
+
+    truth_rows = None
+    if shared:
+        truth_rows = shared.get('ccr-truth-rows', args.annotation, read_truth_rows)
+
+    return load_annotation(args.annotation, rating_threshold(args),
+                           args.min_len_clean_visible, reject,
+                           require_positives=args.require_positives,
+                           any_up=args.any_up,
+                           restricted_entity_list=restricted_entity_list,
+                           truth_rows=truth_rows,
+                           )
+
+def score_all_runs(args, description, reject, shared=None):
     '''
     score all the runs in the specified runs dir using the various
     filters and configuration settings
 
     :param description: string used for file names
     :param reject: callable to rejects truth data
+    :param shared: SharedInputs to get the parsed annotation file and
+    the run catalog from
     '''
-    if args.include_neutral:
-        thresh = 0
-    elif args.include_useful:
-        thresh = 1
-    else:
-        thresh = 2
+    thresh = rating_threshold(args)
+
+    catalog = None
+    if shared:
+        catalog = shared.get_for_sweep('run-catalog', args.run_dir, load_catalog)
 
     ## Load in the annotation data
-    annotation = load_annotation(args.annotation, thresh,
-                                 args.min_len_clean_visible, reject,
-                                 require_positives=args.require_positives,
-                                 any_up=args.any_up,
-                                 restricted_entity_list=args.restricted_entity_list,
-                                 )
+    annotation = load_run_annotation(args, reject, shared=shared)
     log( 'This assumes that all run file names end in .gz' )
 
-    #import gc
-    #from guppy import hpy
-    #hp = hpy()
-    
+    selected_runs = select_runs(args.run_dir, name_filter=args.run_name_filter,
+                                catalog=catalog)
+    run_files = [run_file for run_file, entry in selected_runs]
+
+    arena_dir = None
+    if args.run_workers > 1:
+        if args.parse_workers > 1:
+            log('ignoring --parse-workers, because --run-workers already runs several processes')
+            args.parse_workers = None
+        if can_pack(annotation):
+            ## replace the dict with an arena that every worker maps
+            ## instead of getting its own copy
+            arena_dir = tempfile.mkdtemp(prefix='kba-arena-')
+            annotation = write_arena(annotation, os.path.join(arena_dir, 'annotation.arena'))
+            log('wrote annotation arena of %d records' % len(annotation))
+        else:
+            log('stream_ids in the annotation do not all look like <epoch>-<md5>, '
+                'so each worker gets a copy of the annotation')
+
+    ## the reading modes that work from the file's path do their own I/O
+    pool = None
+    if args.run_workers > 1:
+        pool = multiprocessing.Pool(args.run_workers)
+        jobs = [(args, '.'.join(run_file.split('.')[:-1]), annotation, description, thresh)
+                for run_file in run_files]
+        ## imap hands back the results in the order of run_files
+        pooled_scores = pool.imap(_process_run_job, jobs, chunksize=1)
+        runs = ((run_file, None) for run_file in run_files)
+        writer = None
+    elif args.prefetch and not (args.parse_workers > 1 or args.entity_index):
+        runs = prefetch_runs([os.path.join(args.run_dir, run_file) for run_file in run_files])
+        writer = BackgroundWriter()
+    else:
+        runs = ((run_file, None) for run_file in run_files)
+        writer = None
+
+    ## sort the annotation once rather than for every run, except in
+    ## worker processes, which stream it from the arena
+    sorted_annotation = None
+    if args.sorted_merge and not pool:
+        sorted_annotation = annotation_by_time(annotation)
+
+    progress = None
+    if args.status_file or args.status_port:
+        progress = Progress('ccr', description,
+                            dict((run_file, entry['num_rows']) for run_file, entry in selected_runs),
+                            status_file=args.status_file, status_port=args.status_port)
+
     run_count = 0
     team_scores = defaultdict(lambda: defaultdict(dict))
-    for run_file in os.listdir(args.run_dir):
-        if not run_file.endswith('.gz'):
-            continue
-        
-        if args.run_name_filter and not run_file.startswith(args.run_name_filter):
-            continue
-
+    for run_file, run_lines in runs:
         ## take the name without the .gz
+        run_file = os.path.basename(run_file)
         run_file_name = '.'.join(run_file.split('.')[:-1])
         log( 'processing: %s.gz' % run_file_name )
+        if progress:
+            progress.start_run(run_file)
     
         try:
-            max_scores = process_run(args, run_file_name, annotation, description, thresh)
+            if pool:
+                max_scores = unpack_max_scores(pooled_scores.next())
+            else:
+                max_scores = process_run(args, run_file_name, annotation, description, thresh,
+                                         run_lines=run_lines, writer=writer,
+                                         sorted_annotation=sorted_annotation)
 
             ## split into team name and create stats file
             team_id, system_id = run_file_name.split('-')
             team_scores[team_id][system_id] = max_scores
 
         except Exception, exc:
-            logger.critical('died on %s', run_file_name, exc_info=True)
+            log('died on %s:\n%s' % (run_file_name, traceback.format_exc(exc)))
             sys.exit(str(exc))
 
-
-        #gc.collect()
-        #log(str(hp.heap()))
+        if progress:
+            progress.finish_run()
 
         run_count += 1
         #if run_count > 2:
         #    break
 
+    if writer:
+        writer.close()
+
+    if progress:
+        progress.close()
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    if arena_dir:
+        annotation.close()
+        shutil.rmtree(arena_dir, ignore_errors=True)
+
     ## When folder is finished running output a high level summary of the scores to overview.csv
     write_team_summary(description, team_scores)
 
-if __name__ == '__main__':
-    start_time = time.time()
+    if args.bundle_teams:
+        write_team_bundles(args.run_dir)
+
+def make_parser():
     parser = argparse.ArgumentParser(description=__doc__, usage=__usage__)
     parser.add_argument(
         'run_dir', 
@@ -484,38 +814,64 @@ if __name__ == '__main__':
     parser.add_argument(
         '--restricted-entity-list', default=None,
         help='text file with one target_id per line, only these entities will be used in truth data')
-    args = parser.parse_args()
+    parser.add_argument(
+        '--out-of-core-mb', default=None, type=int, metavar='MB',
+        help='partition each run by target_id into temporary spill files and de-duplicate each partition within MB megabytes of memory, for runs that are larger than RAM')
+    parser.add_argument(
+        '--parse-workers', default=None, type=int, metavar='N',
+        help='parse each run in N processes; needs BGZF runs or runs whose member index was built on an earlier read')
+    parser.add_argument(
+        '--entity-index', default=False, action='store_true',
+        help='keep a per-entity index next to each run, so that scorings of a subset of the entities only decompress the parts of the run that hold those entities')
+    parser.add_argument(
+        '--prefetch', default=False, action='store_true',
+        help='read the next run in a background thread while scoring the current one, and write output files from another thread')
+    parser.add_argument(
+        '--sorted-merge', default=False, action='store_true',
+        help='score each run in a single pass that holds only one epoch_ticks worth of its rows in memory, which requires the run to be in stream order; runs that are not get scored in memory')
+    parser.add_argument(
+        '--run-workers', default=None, type=int, metavar='N',
+        help='score N runs at a time in separate processes, which share one read-only memory-mapped copy of the annotation')
+    parser.add_argument(
+        '--bundle-teams', default=False, action='store_true',
+        help='after scoring, package each team\'s CSV and PNG files into <team_id>.zip in the run_dir')
+    parser.add_argument(
+        '--memory-report', default=False, action='store_true',
+        help='record the peak RSS and the sizes of the annotation, run_set and confusion matrix after each stage of scoring a run, in <run>-<description>.memory.json next to its CSV')
+    parser.add_argument(
+        '--memory-budget', default=None, type=int, metavar='MB',
+        help='warn when the process nears or passes MB megabytes of RSS; implies --memory-report')
+    parser.add_argument(
+        '--status-file', default=None, metavar='PATH',
+        help='keep the runs done, rows/sec, current run and ETA up to date in PATH, in Prometheus text format')
+    parser.add_argument(
+        '--status-port', default=None, type=int, metavar='PORT',
+        help='serve the same progress metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument(
+        '--drilldown', default=False, action='store_true',
+        help='save the judged assertions of each run in <run>-<description>.drilldown next to its CSV, for listing the TP/FP/FN of a target_id at a cutoff with python -m kba.scorer.drilldown')
+    return parser
 
-    accepted_target_ids = set()
-    if args.group or args.entity_type:
-        if not args.topics_path:
-            sys.exit('must specify --topics-path to use --group')
-        targets = json.load(open(args.topics_path))['targets']
-        for targ in targets:
-            if ('group' in targ and targ.get('group') == args.group) or targ['entity_type'] == args.entity_type:
-                accepted_target_ids.add(targ['target_id'])
-    
-    if args.restricted_entity_list:
-        args.restricted_entity_list = set(open(args.restricted_entity_list).read().splitlines())
-        log('loaded %d entities into restricted_entity_list:\n%s' % 
-            (len(args.restricted_entity_list),
-             '\n'.join(args.restricted_entity_list)))
+def main(args, shared=None):
+    '''
+    score the runs in args.run_dir, where args come from make_parser
+
+    :param shared: SharedInputs holding judgments and run catalogs
+    that earlier jobs in this process already loaded, see
+    kba.scorer.orchestrate
+    '''
+    start_time = time.time()
 
     description = make_description(args)
 
     ## construct reject callable
-    def reject(target_id):
-        if args.reject_twitter and 'twitter.com' in target_id:
-            return True
-        if args.reject_wikipedia and 'wikipedia.org' in target_id:
-            return True
-        if args.group or args.entity_type:
-            if target_id not in accepted_target_ids:
-                return True  ## i.e. reject it
-        return False
+    reject = make_reject(args)
 
-    score_all_runs(args, description, reject)
+    score_all_runs(args, description, reject, shared=shared)
 
     elapsed = time.time() - start_time
     log('finished after %d seconds at at %r'
         % (elapsed, datetime.utcnow()))
+
+if __name__ == '__main__':
+    main(make_parser().parse_args())
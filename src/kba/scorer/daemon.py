@@ -0,0 +1,186 @@
+'''
+a long-lived scorer that keeps the annotation, topics and entity
+filters of one scoring configuration loaded, and scores single run
+files on request over a Unix socket, e.g. to give teams quick feedback
+on the format and approximate scores of a run before they submit it.
+
+Start it with the scorer and its usual args, where run_dir is only
+used to find the runs for --pooled-only:
+
+    python -m kba.scorer.daemon serve /tmp/kba-ccr.sock ccr runs/ ccr-truth.tsv --cutoff-step 10
+
+and then ask it to score runs:
+
+    python -m kba.scorer.daemon score /tmp/kba-ccr.sock path/to/team-system.gz
+
+Each request is one line of JSON, {"run": "/path/to/team-system.gz"},
+optionally with "per_target": true to also get the max scores of each
+target_id.  Each reply is one line of JSON with "status" of "ok" or
+"error".  An ok reply holds the run's JSON header, the max scores of
+the averages ("summary"), the paths of the CSV and PNG files written
+next to the run and of the scorer's log for the run ("outputs"), and
+the seconds it took.
+
+Every connection gets handled in a forked child of the daemon, which
+shares the loaded annotation with it, so several runs can be scored
+at once and a run that crashes its child does not take down the
+daemon.
+
+'''
+import os
+import sys
+import json
+import time
+import socket
+import traceback
+import SocketServer
+
+from kba.scorer import ssf
+from kba.scorer._outputs import log
+from kba.scorer._shared import RunScorer, SCORERS
+from kba.scorer._runparser import sniff_run, RunFormatError
+
+AVERAGES = ['micro_average', 'macro_average', 'weighted_average']
+
+## most connections that get scored at once
+MAX_CHILDREN = 4
+
+def _summary(max_scores, per_target):
+    if per_target:
+        return max_scores
+    return dict((avg, max_scores[avg]) for avg in AVERAGES if avg in max_scores)
+
+def score_request(scorer, job, request):
+    '''
+    score the run named in a request
+
+    :returns dict: the reply
+    '''
+    run_path = os.path.abspath(request['run'])
+    run_dir, run_file_name = os.path.split(run_path)
+    if not run_file_name.endswith('.gz') or run_file_name[:-len('.gz')].count('-') != 1:
+        return dict(status='error', run=run_path,
+                    error='run file names must look like <team_id>-<system_id>.gz')
+    try:
+        header, first_row = sniff_run(run_path)
+    except (IOError, RunFormatError), exc:
+        return dict(status='error', run=run_path, error=str(exc))
+
+    log_path = run_path[:-len('.gz')] + '-%s.log' % job['name']
+
+    start_time = time.time()
+    stdout = sys.stdout
+    sys.stdout = open(log_path, 'w')
+    try:
+        max_scores = scorer.score(job, run_file_name, run_dir=run_dir)
+    except (Exception, SystemExit), exc:
+        ## a format error deep in the run, for example
+        log('died on %s:\n%s' % (run_path, traceback.format_exc(exc)))
+        return dict(status='error', run=run_path, error=str(exc), outputs=[log_path])
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    ## the graphs only get drawn if matplotlib is installed
+    outputs = [path for path in scorer.output_paths(job, run_file_name, run_dir=run_dir)
+               if os.path.exists(path)]
+    outputs.append(log_path)
+
+    per_target = request.get('per_target', False)
+    if job['scorer'] == 'ssf':
+        summary = dict((mode, _summary(max_scores[mode], per_target)) for mode in ssf.MODES)
+    else:
+        summary = _summary(max_scores, per_target)
+    return dict(status='ok', run=run_path, header=header, summary=summary,
+                outputs=outputs, seconds=time.time() - start_time)
+
+class ScoringServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    max_children = MAX_CHILDREN
+
+    def __init__(self, socket_path, job):
+        self.job = job
+        self.scorer = RunScorer()
+        ## load the annotation before taking requests, so that every
+        ## child starts with it
+        self.scorer.load(job)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, ScoringHandler)
+
+class ScoringHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = score_request(self.server.scorer, self.server.job, request)
+            except ValueError, exc:
+                reply = dict(status='error', error='bad request %r: %s' % (line[:200], exc))
+            self.wfile.write(json.dumps(reply, sort_keys=True) + '\n')
+            self.wfile.flush()
+
+def serve(socket_path, scorer_name, scorer_args):
+    '''
+    load the annotation for the scorer with scorer_args and score runs
+    from the socket until interrupted
+    '''
+    job = dict(name='%s-daemon' % scorer_name, scorer=scorer_name, args=scorer_args)
+    server = ScoringServer(socket_path, job)
+    log('scoring runs sent to %s' % socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+def score_runs(socket_path, run_paths, per_target=False):
+    '''
+    ask the daemon at socket_path to score run_paths, one after another
+
+    yields the reply for each run
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    sock_file = sock.makefile('rw')
+    try:
+        for run_path in run_paths:
+            sock_file.write(json.dumps(dict(run=os.path.abspath(run_path),
+                                            per_target=per_target)) + '\n')
+            sock_file.flush()
+            yield json.loads(sock_file.readline())
+    finally:
+        sock_file.close()
+        sock.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='load the annotation and wait for runs to score')
+    serve_parser.add_argument('socket_path')
+    serve_parser.add_argument('scorer', choices=sorted(SCORERS))
+    serve_parser.add_argument('scorer_args', nargs=argparse.REMAINDER,
+                              help='args for the scorer, as on its command line')
+    score_parser = subparsers.add_parser('score', help='score runs with a running daemon')
+    score_parser.add_argument('socket_path')
+    score_parser.add_argument('runs', nargs='+', help='paths to run files')
+    score_parser.add_argument(
+        '--per-target', default=False, action='store_true',
+        help='also print the max scores of each target_id')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        ## fail now rather than on the first request
+        SCORERS[args.scorer].make_parser().parse_args(args.scorer_args)
+        serve(args.socket_path, args.scorer, args.scorer_args)
+    else:
+        failed = False
+        for reply in score_runs(args.socket_path, args.runs, per_target=args.per_target):
+            print json.dumps(reply, indent=4, sort_keys=True)
+            failed = failed or reply['status'] != 'ok'
+        if failed:
+            sys.exit(1)
@@ -0,0 +1,269 @@
+'''
+lists of the true positive, false positive and false negative
+assertions behind a run's scores, for explaining them without
+rescoring the run or grepping a --debug log.
+
+Given --drilldown, ccr and ssf save the judged assertions of each run
+that they score, after de-duplication, along with their confidences
+and labels, and the positives in the annotation, in a .drilldown file
+next to the run's CSV files.  Then this answers questions like "which
+stream_ids were the FNs of target_id X at cutoff 500?":
+
+    python -m kba.scorer.drilldown runs/team-system-ccr-....drilldown https://kb.diffeo.com/X 500
+
+or, at the cutoff that gave X its best F:
+
+    python -m kba.scorer.drilldown runs/team-system.gz-ssf-....drilldown https://kb.diffeo.com/X best --mode OVERLAP
+
+The file has one line of JSON that indexes the byte ranges of the
+lines of JSON for each (mode, target_id), so a query only reads and
+parses the lines for its one target_id.
+
+For ssf, the assertions are "stream_id slot_type ..." with the byte
+range (OVERLAP) or the run's equiv_id (FILL and DATE_HOUR) added, and
+the FNs list the positives of the annotation that no TP above the
+cutoff matched: "stream_id slot_type" for DOCS, OVERLAP and FILL, and
+"slot_type equiv_id" for DATE_HOUR.  The number of FNs is the one in
+the CSV files, which counts positives rather than matches, so it can
+differ from the length of that list.  The exception is DATE_HOUR, whose
+CSV files leave FN at zero for target_ids without any TP.
+
+'''
+import os
+import sys
+import json
+from collections import defaultdict
+
+from kba.scorer._outputs import log
+from kba.scorer._metrics import precision, recall, fscore
+
+## the mode that ccr indexes its one confusion matrix under
+CCR = 'ccr'
+
+class DrilldownRecorder(object):
+    '''
+    collects the judged assertions of one run as the scorer counts
+    them in its confusion matrices
+    '''
+    def __init__(self, scorer, run_file_name):
+        self.scorer = scorer
+        self.run_file_name = run_file_name
+        self.cutoffs = dict()
+        ## mode --> target_id --> list of [item, conf, label, truth]
+        self.assertions = defaultdict(lambda: defaultdict(list))
+        ## mode --> target_id --> set of positives in the annotation
+        self.truth = defaultdict(lambda: defaultdict(set))
+        ## mode --> target_id --> number of positives, as counted by the scorer
+        self.num_positives = defaultdict(dict)
+
+    def set_cutoffs(self, mode, cutoffs):
+        self.cutoffs[mode] = list(cutoffs)
+
+    def add(self, mode, target_id, item, conf, is_positive, truth=None):
+        '''
+        record one assertion that the scorer counted as a TP (if
+        is_positive) or as an FP/TN at each cutoff, depending on conf
+
+        :param truth: the positive in the annotation that a TP matched,
+        if not item itself
+        '''
+        record = [item, conf, int(bool(is_positive))]
+        if truth is not None and truth != item:
+            record.append(truth)
+        self.assertions[mode][target_id].append(record)
+
+    def add_truth(self, mode, target_id, truth):
+        self.truth[mode][target_id].add(truth)
+
+    def set_num_positives(self, mode, num_positives):
+        '''
+        :param num_positives: dict of target_id --> number of positives
+        '''
+        self.num_positives[mode] = dict(num_positives)
+
+    def reset(self, mode):
+        '''
+        forget the assertions of mode, e.g. to score the run over again
+        '''
+        self.assertions.pop(mode, None)
+
+    def write(self, path):
+        '''
+        write the .drilldown file, with one line per (mode, target_id)
+        '''
+        body = []
+        offset = 0
+        modes = dict()
+        for mode in sorted(self.cutoffs):
+            target_ids = set(self.assertions[mode]) | set(self.truth[mode]) \
+                | set(self.num_positives[mode])
+            index = dict()
+            for target_id in sorted(target_ids):
+                truth = self.truth[mode].get(target_id, ())
+                assertions = sorted(self.assertions[mode].get(target_id, []),
+                                    key=lambda record: (-record[1], record[0]))
+                line = json.dumps(dict(
+                        assertions=assertions,
+                        truth=sorted(truth),
+                        num_positives=self.num_positives[mode].get(target_id, len(truth)),
+                        ), separators=(',', ':')) + '\n'
+                index[target_id] = [offset, len(line)]
+                offset += len(line)
+                body.append(line)
+            modes[mode] = dict(cutoffs=self.cutoffs[mode], targets=index)
+
+        header = json.dumps(dict(scorer=self.scorer, run=self.run_file_name, modes=modes),
+                            sort_keys=True, separators=(',', ':')) + '\n'
+        tmp_path = path + '.tmp'
+        fh = open(tmp_path, 'w')
+        fh.write(header)
+        fh.writelines(body)
+        fh.close()
+        os.rename(tmp_path, path)
+        log('wrote ' + path)
+
+class Drilldown(object):
+    '''
+    reads a .drilldown file written by DrilldownRecorder
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path)
+        header = json.loads(self._fh.readline())
+        self._body_offset = self._fh.tell()
+        self.scorer = header['scorer']
+        self.run_file_name = header['run']
+        self._modes = header['modes']
+
+    def close(self):
+        self._fh.close()
+
+    @property
+    def modes(self):
+        return sorted(self._modes)
+
+    def _mode(self, mode):
+        if mode is None:
+            if len(self._modes) != 1:
+                raise KeyError('%s has modes %s, so pick one' % (self.path, ', '.join(self.modes)))
+            return self._modes.keys()[0]
+        if mode not in self._modes:
+            raise KeyError('%s has no mode %r, only %s' % (self.path, mode, ', '.join(self.modes)))
+        return mode
+
+    def cutoffs(self, mode=None):
+        return self._modes[self._mode(mode)]['cutoffs']
+
+    def target_ids(self, mode=None):
+        return sorted(self._modes[self._mode(mode)]['targets'])
+
+    def entity(self, target_id, mode=None):
+        '''
+        :returns dict: the assertions, truth and num_positives recorded
+        for target_id
+        '''
+        targets = self._modes[self._mode(mode)]['targets']
+        if target_id not in targets:
+            raise KeyError('%s has nothing about %s' % (self.path, target_id))
+        offset, length = targets[target_id]
+        self._fh.seek(self._body_offset + offset)
+        return json.loads(self._fh.read(length))
+
+    def query(self, target_id, cutoff, mode=None):
+        '''
+        :returns dict: TP, FP and FN of target_id at cutoff, where TP
+        and FP are lists of (item, conf) from highest conf down, and FN
+        is the list of unmatched positives, along with the counts of
+        TP, FP, TN and FN that the scorer's confusion matrix has
+        '''
+        entity = self.entity(target_id, mode)
+        TP = []
+        FP = []
+        num_TN = 0
+        matched = set()
+        for record in entity['assertions']:
+            item, conf, label = record[:3]
+            if conf > cutoff:
+                if label:
+                    TP.append((item, conf))
+                    matched.add(len(record) > 3 and record[3] or item)
+                else:
+                    FP.append((item, conf))
+            elif not label:
+                num_TN += 1
+        FN = [truth for truth in entity['truth'] if truth not in matched]
+        counts = dict(TP=len(TP), FP=len(FP), TN=num_TN,
+                      FN=entity['num_positives'] - len(TP))
+        return dict(target_id=target_id, cutoff=cutoff, TP=TP, FP=FP, FN=FN, counts=counts)
+
+    def best_cutoff(self, target_id, mode=None):
+        '''
+        :returns int: the lowest of the cutoffs at which target_id has
+        its maximum F
+        '''
+        entity = self.entity(target_id, mode)
+        best_cutoff = None
+        best_F = -1
+        for cutoff in self.cutoffs(mode):
+            TP = FP = 0
+            for record in entity['assertions']:
+                if record[1] > cutoff:
+                    if record[2]:
+                        TP += 1
+                    else:
+                        FP += 1
+            FN = entity['num_positives'] - TP
+            F = fscore(precision(TP, FP), recall(TP, FN))
+            if F > best_F:
+                best_F = F
+                best_cutoff = cutoff
+        return best_cutoff
+
+def print_query(result, out=sys.stdout):
+    counts = result['counts']
+    P = precision(counts['TP'], counts['FP'])
+    R = recall(counts['TP'], counts['FN'])
+    out.write('%s at cutoff %d: TP=%d FP=%d FN=%d TN=%d P=%.3f R=%.3f F=%.3f\n'
+              % (result['target_id'], result['cutoff'], counts['TP'], counts['FP'],
+                 counts['FN'], counts['TN'], P, R, fscore(P, R)))
+    for label in ['TP', 'FP']:
+        for item, conf in result[label]:
+            out.write('%s\t%s\t%d\n' % (label, item, conf))
+    for item in result['FN']:
+        out.write('FN\t%s\n' % item)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('drilldown', help='path to a .drilldown file')
+    parser.add_argument('target_id', nargs='?',
+                        help='target_id to list the assertions of; lists the target_ids if omitted')
+    parser.add_argument('cutoff', nargs='?', default='best',
+                        help='confidence cutoff, or "best" for the one with the max F for target_id')
+    parser.add_argument('--mode', default=None,
+                        help='SSF mode, e.g. DOCS, which ssf drilldowns require')
+    parser.add_argument('--json', default=False, action='store_true',
+                        help='print the result as JSON')
+    args = parser.parse_args()
+
+    drilldown = Drilldown(args.drilldown)
+    try:
+        if not args.target_id:
+            for mode in drilldown.modes:
+                if args.mode in (None, mode):
+                    for target_id in drilldown.target_ids(mode):
+                        print '%s\t%s' % (mode, target_id)
+            sys.exit(0)
+        if args.cutoff == 'best':
+            cutoff = drilldown.best_cutoff(args.target_id, args.mode)
+        else:
+            cutoff = int(args.cutoff)
+        result = drilldown.query(args.target_id, cutoff, args.mode)
+    except KeyError, exc:
+        sys.exit(exc.args[0])
+
+    if args.json:
+        print json.dumps(result, indent=4, sort_keys=True)
+    else:
+        print_query(result)
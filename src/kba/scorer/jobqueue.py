@@ -0,0 +1,428 @@
+'''
+spread scoring over any number of worker processes, on one machine or
+several, through a job queue in a directory on a shared filesystem.
+
+Publishing a sweep, which is a JSON list of jobs in the format of
+kba.scorer.orchestrate, splits every job into one unit of work per
+run that the job scores.  The queue directory then holds:
+
+    jobs/<name>.json          the job, with the list of its runs
+    todo/<unit>.json          units waiting for a worker
+    claimed/<unit>.json@<worker>  units that a worker is scoring
+    results/<unit>.json       max scores of finished units
+    failed/<unit>.json        units that failed MAX_ATTEMPTS times
+    workers/<worker>          heartbeat of each worker
+    logs/<unit>.log.gz        log output of each unit
+
+A worker claims a unit by renaming it from todo/ into claimed/, which
+only one worker can do, and touches its heartbeat file while it
+scores.  Units claimed by a worker whose heartbeat stopped get put
+back in todo/, by the coordinator or by any other worker.  When every
+unit of a job has a result, the coordinator writes the job's overviews
+into its current directory, just as the scorer would have.
+
+    python -m kba.scorer.jobqueue publish queue/ jobs.json
+    python -m kba.scorer.jobqueue work queue/                  (on each machine)
+    python -m kba.scorer.jobqueue coordinate queue/ [--local-workers N]
+
+Staleness is judged by comparing heartbeat mtimes with the mtime of a
+file that the judging process just touched, so the machines' clocks
+need not agree, only the shared filesystem's.
+
+'''
+import os
+import sys
+import json
+import gzip
+import time
+import errno
+import socket
+import threading
+import traceback
+import multiprocessing
+from collections import defaultdict
+
+from kba.scorer import ccr, ssf
+from kba.scorer._outputs import log, write_team_summary
+from kba.scorer._bundles import write_team_bundles
+from kba.scorer._shared import RunScorer, SCORERS
+from kba.scorer._catalog import select_runs
+
+SUBDIRS = ['jobs', 'todo', 'claimed', 'results', 'failed', 'workers', 'logs']
+
+HEARTBEAT_SECONDS = 30
+
+## a worker whose heartbeat is this much older than now is presumed dead
+STALE_SECONDS = 300
+
+## a unit goes to failed/ after this many tries
+MAX_ATTEMPTS = 3
+
+POLL_SECONDS = 10
+
+def _path(queue_dir, subdir, name=''):
+    return os.path.join(queue_dir, subdir, name)
+
+def _write_json(path, data):
+    '''
+    write data so that readers only ever see the whole file
+    '''
+    tmp_path = '%s.%s-%d.tmp' % (path, socket.gethostname(), os.getpid())
+    fh = open(tmp_path, 'w')
+    json.dump(data, fh, indent=4, sort_keys=True)
+    fh.close()
+    os.rename(tmp_path, path)
+
+def _listdir(queue_dir, subdir):
+    return sorted(fname for fname in os.listdir(_path(queue_dir, subdir))
+                  if not fname.endswith('.tmp'))
+
+def _try_rename(src, dst):
+    '''
+    :returns bool: False if src was gone, e.g. because another process
+    renamed it first
+    '''
+    try:
+        os.rename(src, dst)
+        return True
+    except OSError, exc:
+        if exc.errno == errno.ENOENT:
+            return False
+        raise
+
+def _try_remove(path):
+    '''
+    :returns bool: False if path was gone, e.g. because requeue_stale
+    took over a unit that its worker went on to finish
+    '''
+    try:
+        os.remove(path)
+        return True
+    except OSError, exc:
+        if exc.errno == errno.ENOENT:
+            return False
+        raise
+
+def unit_id(job_name, run_file_name):
+    return '%s__%s' % (job_name, run_file_name[:-len('.gz')])
+
+def job_runs(job):
+    '''
+    :returns list: file names of the runs that a job scores
+    '''
+    args = SCORERS[job['scorer']].make_parser().parse_args(job['args'])
+    if job['scorer'] == 'ssf':
+        return list(ssf.ssf_run_names(args))
+    return [run_file for run_file, entry in
+            select_runs(args.run_dir, name_filter=args.run_name_filter)]
+
+def publish(queue_dir, jobs):
+    '''
+    add a unit to the queue for each run of each job, except for units
+    that already have a result, so publishing a sweep again only
+    queues the units that did not finish.  Failed units get queued
+    again with a fresh count of attempts, leaving their logs.
+    '''
+    for subdir in SUBDIRS:
+        if not os.path.exists(_path(queue_dir, subdir)):
+            os.makedirs(_path(queue_dir, subdir))
+
+    done = set(_listdir(queue_dir, 'results'))
+    queued = set(_listdir(queue_dir, 'todo'))
+    queued.update(fname.rsplit('@', 1)[0] for fname in _listdir(queue_dir, 'claimed'))
+    num_units = 0
+    for job in jobs:
+        if job.get('scorer') not in SCORERS:
+            sys.exit('job %r has unknown scorer %r' % (job.get('name'), job.get('scorer')))
+        if '/' in job['name'] or '@' in job['name']:
+            sys.exit('job name %r must not contain / or @' % job['name'])
+        runs = job_runs(job)
+        _write_json(_path(queue_dir, 'jobs', job['name'] + '.json'), dict(job, runs=runs))
+        for run_file_name in runs:
+            fname = unit_id(job['name'], run_file_name) + '.json'
+            if fname in done or fname in queued:
+                continue
+            _write_json(_path(queue_dir, 'todo', fname),
+                        dict(job=job['name'], run=run_file_name, attempts=0))
+            if _try_remove(_path(queue_dir, 'failed', fname)):
+                log('requeued failed unit %s' % fname)
+            num_units += 1
+    log('published %d units of %d jobs to %s' % (num_units, len(jobs), queue_dir))
+
+class Heartbeat(threading.Thread):
+    '''
+    touch workers/<worker_id> every HEARTBEAT_SECONDS until stopped
+    '''
+    def __init__(self, queue_dir, worker_id):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = _path(queue_dir, 'workers', worker_id)
+        self._stop_event = threading.Event()
+        self.beat()
+
+    def beat(self):
+        open(self.path, 'a').close()
+        os.utime(self.path, None)
+        return os.stat(self.path).st_mtime
+
+    def run(self):
+        while not self._stop_event.wait(HEARTBEAT_SECONDS):
+            self.beat()
+
+    def stop(self):
+        self._stop_event.set()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def requeue_stale(queue_dir, now, stale_seconds=STALE_SECONDS):
+    '''
+    put the units claimed by workers with no recent heartbeat back in
+    todo/, or in failed/ once they have used up their attempts
+
+    :param now: mtime of a file that the caller just touched on the
+    shared filesystem
+    '''
+    for fname in _listdir(queue_dir, 'claimed'):
+        if fname.endswith('.requeue'):
+            ## another process is already requeueing it
+            continue
+        unit_fname, _, worker_id = fname.rpartition('@')
+        try:
+            last_beat = os.stat(_path(queue_dir, 'workers', worker_id)).st_mtime
+        except OSError:
+            last_beat = None
+        if last_beat is not None and now - last_beat < stale_seconds:
+            continue
+        ## claim the stale unit ourselves, so that only one process
+        ## requeues it
+        stale_path = _path(queue_dir, 'claimed', fname) + '.requeue'
+        if not _try_rename(_path(queue_dir, 'claimed', fname), stale_path):
+            continue
+        unit = json.load(open(stale_path))
+        unit['attempts'] += 1
+        if unit['attempts'] >= MAX_ATTEMPTS:
+            unit['error'] = 'worker %s stopped sending heartbeats' % worker_id
+            _write_json(_path(queue_dir, 'failed', unit_fname), unit)
+            log('%s failed after %d attempts' % (unit_fname, unit['attempts']))
+        else:
+            _write_json(_path(queue_dir, 'todo', unit_fname), unit)
+            log('requeued %s from %s' % (unit_fname, worker_id))
+        os.remove(stale_path)
+
+def _claim(queue_dir, worker_id, preferred_job):
+    '''
+    :returns tuple: (unit file name, claimed path) or (None, None) if
+    todo/ is empty
+    '''
+    todo = _listdir(queue_dir, 'todo')
+    ## stay with the job whose annotation is already loaded
+    if preferred_job:
+        prefix = preferred_job + '__'
+        todo.sort(key=lambda fname: not fname.startswith(prefix))
+    for fname in todo:
+        claimed_path = _path(queue_dir, 'claimed', '%s@%s' % (fname, worker_id))
+        if _try_rename(_path(queue_dir, 'todo', fname), claimed_path):
+            return fname, claimed_path
+    return None, None
+
+def work(queue_dir, worker_id=None, wait=False, stale_seconds=STALE_SECONDS):
+    '''
+    score units from the queue until it is empty
+
+    :param wait: keep polling for units that get published or
+    requeued later instead of stopping
+    '''
+    if worker_id is None:
+        worker_id = '%s-%d' % (socket.gethostname(), os.getpid())
+    heartbeat = Heartbeat(queue_dir, worker_id)
+    heartbeat.start()
+    scorer = RunScorer()
+    jobs = dict()
+    num_units = 0
+    try:
+        while True:
+            fname, claimed_path = _claim(queue_dir, worker_id, scorer.job_name)
+            if fname is None:
+                requeue_stale(queue_dir, heartbeat.beat(), stale_seconds)
+                if _listdir(queue_dir, 'todo'):
+                    continue
+                if not wait and not _listdir(queue_dir, 'claimed'):
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            unit = json.load(open(claimed_path))
+            if unit['job'] not in jobs:
+                jobs[unit['job']] = json.load(open(_path(queue_dir, 'jobs', unit['job'] + '.json')))
+            job = jobs[unit['job']]
+
+            stdout = sys.stdout
+            sys.stdout = gzip.open(_path(queue_dir, 'logs', fname[:-len('.json')] + '.log.gz'), 'w')
+            start_time = time.time()
+            error = None
+            try:
+                max_scores = scorer.score(job, unit['run'])
+            except BaseException, exc:
+                if isinstance(exc, KeyboardInterrupt):
+                    raise
+                error = traceback.format_exc(exc)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            seconds = time.time() - start_time
+
+            if error:
+                log('%s failed:\n%s' % (fname, error))
+                _write_json(_path(queue_dir, 'failed', fname),
+                            dict(unit, worker=worker_id, error=error))
+            else:
+                log('%s done after %.1f seconds' % (fname, seconds))
+                _write_json(_path(queue_dir, 'results', fname),
+                            dict(unit, worker=worker_id, seconds=seconds, max_scores=max_scores))
+            ## requeue_stale may have taken the unit back meanwhile
+            _try_remove(claimed_path)
+            num_units += 1
+    finally:
+        heartbeat.stop()
+    log('worker %s scored %d units' % (worker_id, num_units))
+
+def write_overviews(job, results):
+    '''
+    write the overviews that the job's scorer would have written from
+    the max scores of its runs
+    '''
+    args = SCORERS[job['scorer']].make_parser().parse_args(job['args'])
+    if job['scorer'] == 'ccr':
+        team_scores = defaultdict(dict)
+        for run_file_name in job['runs']:
+            team_id, system_id = run_file_name[:-len('.gz')].split('-')
+            team_scores[team_id][system_id] = results[run_file_name]
+        write_team_summary(ccr.make_description(args), team_scores)
+    else:
+        ## the facets in the same order as the max scores of each run
+        facets = [args] + ssf.facet_args(args)
+        for idx, facet in enumerate(facets):
+            for mode in ssf.scored_modes(args):
+                team_scores = defaultdict(dict)
+                for run_file_name in job['runs']:
+                    team_id, system_id = run_file_name[:-len('.gz')].split('-')
+                    max_scores = results[run_file_name]
+                    if idx:
+                        max_scores = max_scores['facets'][idx - 1]
+                    team_scores[team_id][system_id] = max_scores[mode]
+                write_team_summary(ssf.make_description(facet, mode), team_scores)
+    if args.bundle_teams:
+        write_team_bundles(args.run_dir)
+
+def queue_status(queue_dir):
+    '''
+    :returns dict: job name --> dict of the number of its units in
+    each of todo, claimed, results and failed.  A unit that failed and
+    also has a result, e.g. from a worker that was presumed dead but
+    finished, only counts as a result.
+    '''
+    status = defaultdict(lambda: dict(todo=0, claimed=0, results=0, failed=0))
+    done = set(_listdir(queue_dir, 'results'))
+    for subdir in ['todo', 'claimed', 'results', 'failed']:
+        for fname in _listdir(queue_dir, subdir):
+            if subdir == 'claimed':
+                ## including units that requeue_stale is moving
+                fname = fname.rsplit('@', 1)[0]
+            if subdir == 'failed' and fname in done:
+                continue
+            status[fname.split('__', 1)[0]][subdir] += 1
+    return status
+
+def coordinate(queue_dir, local_workers=0, stale_seconds=STALE_SECONDS):
+    '''
+    requeue the units of dead workers and write the overviews of each
+    job once all of its units are scored, until the queue is empty
+
+    :param local_workers: number of worker processes to start on this
+    machine, in addition to any started elsewhere
+
+    :returns list: names of jobs with failed units, which get no overviews
+    '''
+    workers = []
+    for idx in range(local_workers):
+        worker = multiprocessing.Process(target=work, args=(queue_dir,),
+                                         kwargs=dict(stale_seconds=stale_seconds))
+        worker.start()
+        workers.append(worker)
+
+    heartbeat = Heartbeat(queue_dir, 'coordinator-%s-%d' % (socket.gethostname(), os.getpid()))
+    jobs = dict((fname[:-len('.json')], json.load(open(_path(queue_dir, 'jobs', fname))))
+                for fname in _listdir(queue_dir, 'jobs'))
+    finished = set()
+    failed_jobs = set()
+    while True:
+        requeue_stale(queue_dir, heartbeat.beat(), stale_seconds)
+        status = queue_status(queue_dir)
+        for name, job in sorted(jobs.items()):
+            if name in finished:
+                continue
+            counts = status[name]
+            if counts['todo'] or counts['claimed']:
+                continue
+            finished.add(name)
+            if counts['failed']:
+                log('not writing overviews for %s, which has %d failed units'
+                    % (name, counts['failed']))
+                failed_jobs.add(name)
+                continue
+            results = dict()
+            for run_file_name in job['runs']:
+                result_path = _path(queue_dir, 'results', unit_id(name, run_file_name) + '.json')
+                results[run_file_name] = json.load(open(result_path))['max_scores']
+            write_overviews(job, results)
+            log('wrote overviews for %s' % name)
+        if len(finished) == len(jobs):
+            break
+        time.sleep(POLL_SECONDS)
+
+    heartbeat.stop()
+    for worker in workers:
+        worker.join()
+    return sorted(failed_jobs)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    publish_parser = subparsers.add_parser('publish', help='add the units of a sweep to the queue')
+    publish_parser.add_argument('queue_dir')
+    publish_parser.add_argument('jobs', help='path to a JSON file with a list of jobs')
+    work_parser = subparsers.add_parser('work', help='score units until the queue is empty')
+    work_parser.add_argument('queue_dir')
+    work_parser.add_argument(
+        '--wait', default=False, action='store_true',
+        help='keep waiting for more units instead of stopping when the queue is empty')
+    coordinate_parser = subparsers.add_parser(
+        'coordinate', help='requeue the units of dead workers and write overviews as jobs finish')
+    coordinate_parser.add_argument('queue_dir')
+    coordinate_parser.add_argument(
+        '--local-workers', default=0, type=int, metavar='N',
+        help='also start N workers on this machine')
+    status_parser = subparsers.add_parser('status', help='count the units of each job')
+    status_parser.add_argument('queue_dir')
+    for subparser in [work_parser, coordinate_parser]:
+        subparser.add_argument(
+            '--stale-seconds', default=STALE_SECONDS, type=int,
+            help='requeue units of workers whose heartbeat is older than this')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        publish(args.queue_dir, json.load(open(args.jobs)))
+    elif args.command == 'work':
+        work(args.queue_dir, wait=args.wait, stale_seconds=args.stale_seconds)
+    elif args.command == 'coordinate':
+        if coordinate(args.queue_dir, local_workers=args.local_workers,
+                      stale_seconds=args.stale_seconds):
+            sys.exit(1)
+    else:
+        for name, counts in sorted(queue_status(args.queue_dir).items()):
+            print '%-50s %6d todo %6d claimed %6d done %6d failed' % (
+                name, counts['todo'], counts['claimed'], counts['results'], counts['failed'])
@@ -0,0 +1,274 @@
+'''
+run a sweep of scoring jobs described by a JSON list, such as:
+
+    [{"name": "ccr-primary", "scorer": "ccr",
+      "args": ["--cutoff-step", "1", "runs/", "ccr-truth.tsv"]},
+     {"name": "ssf-pooled-only", "scorer": "ssf",
+      "args": ["--pooled-only", "runs/", "ssf-truth.json"]}]
+
+where "args" are the command line arguments of kba.scorer.ccr or
+kba.scorer.ssf.  A job may also give its "cost" in arbitrary units,
+otherwise it gets estimated from the number of rows in the runs that
+it scores, according to the run catalog, times the number of cutoffs.
+
+Jobs run in worker processes, most expensive first, so that the long
+jobs do not end up alone at the end of the sweep.  Each worker loads
+the judgments, run catalogs and pooled assertion keys once and keeps
+them for all of its later jobs that need the same ones.
+
+Every finished job gets recorded in the checkpoint file, and running
+the sweep again skips the jobs recorded there that have the same
+scorer and args, so an interrupted sweep resumes where it stopped.
+
+'''
+import os
+import sys
+import json
+import gzip
+import time
+import Queue
+import hashlib
+import traceback
+import multiprocessing
+
+from kba.scorer import ssf
+from kba.scorer._outputs import log
+from kba.scorer._shared import SharedInputs, SCORERS
+from kba.scorer._catalog import select_runs, load_catalog
+
+## how often the parent checks that its workers are still alive
+POLL_SECONDS = 5
+
+def job_signature(job):
+    '''
+    identify a job by what it computes, so that renaming a job does
+    not make it run again
+    '''
+    return hashlib.md5(json.dumps([job['scorer'], job['args']])).hexdigest()
+
+def _parse_job_args(job):
+    if job.get('scorer') not in SCORERS:
+        sys.exit('job %r has unknown scorer %r, must be one of %r'
+                 % (job.get('name'), job.get('scorer'), sorted(SCORERS)))
+    try:
+        return SCORERS[job['scorer']].make_parser().parse_args(job['args'])
+    except SystemExit:
+        sys.exit('job %r has bad args: %r' % (job['name'], job['args']))
+
+def estimate_cost(job, args, catalogs):
+    '''
+    estimate the relative cost of a job as the number of run rows it
+    scores times the number of cutoffs, times the number of modes for
+    SSF
+
+    :param catalogs: dict of run_dir --> catalog to reuse between jobs
+    '''
+    if 'cost' in job:
+        return float(job['cost'])
+    if args.run_dir not in catalogs:
+        catalogs[args.run_dir] = load_catalog(args.run_dir)
+    if job['scorer'] == 'ssf':
+        task = 'ssf'
+        num_cutoffs = len(range(0, 999, args.cutoff_step_size)) * len(ssf.scored_modes(args))
+    else:
+        task = None
+        num_cutoffs = len(range(0, 999, args.cutoff_step))
+    runs = select_runs(args.run_dir, task=task, name_filter=args.run_name_filter,
+                       catalog=catalogs[args.run_dir])
+    return float(sum(entry['num_rows'] for run_file, entry in runs) * num_cutoffs)
+
+def load_checkpoint(checkpoint_path):
+    '''
+    :returns dict: job signature --> record of the job's last finish
+    '''
+    records = dict()
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        for line in open(checkpoint_path):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                ## a line cut short by an interruption
+                continue
+            records[record['signature']] = record
+    return records
+
+def _append_checkpoint(checkpoint_path, record):
+    checkpoint = open(checkpoint_path, 'a')
+    checkpoint.write(json.dumps(record, sort_keys=True) + '\n')
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+    checkpoint.close()
+
+def run_job(job, shared, log_dir=None):
+    '''
+    run one job in this process
+
+    :returns dict: record of the job's name, signature, status,
+    seconds and error, if any
+    '''
+    scorer = SCORERS[job['scorer']]
+    args = scorer.make_parser().parse_args(job['args'])
+    status = 'done'
+    error = None
+    stdout = sys.stdout
+    if log_dir:
+        sys.stdout = gzip.open(os.path.join(log_dir, job['name'] + '.log.gz'), 'w')
+    start_time = time.time()
+    try:
+        scorer.main(args, shared=shared)
+    except SystemExit, exc:
+        ## the scorers exit with a message when they give up
+        if exc.code not in (None, 0):
+            status = 'failed'
+            error = str(exc.code)
+    except Exception, exc:
+        status = 'failed'
+        error = traceback.format_exc(exc)
+    finally:
+        if log_dir:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return dict(name=job['name'], signature=job_signature(job), status=status,
+                seconds=time.time() - start_time, error=error)
+
+def _work(job_queue, result_queue, log_dir):
+    shared = SharedInputs()
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        result_queue.put(('start', os.getpid(), job['name']))
+        result_queue.put(('finish', os.getpid(), run_job(job, shared, log_dir)))
+
+def _run_in_workers(jobs, processes, log_dir, finished):
+    '''
+    run jobs in processes workers, calling finished(record) as each
+    one ends.  Workers are not daemonic, so that jobs can use their
+    own process pools, e.g. for --run-workers.
+    '''
+    job_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    workers = []
+    for idx in range(min(processes, len(jobs))):
+        job_queue.put(None)
+        worker = multiprocessing.Process(target=_work, args=(job_queue, result_queue, log_dir))
+        worker.start()
+        workers.append(worker)
+
+    ## pid --> (job name, start time) of the job it is running
+    running = dict()
+    remaining = len(jobs)
+    while remaining:
+        try:
+            kind, pid, value = result_queue.get(timeout=POLL_SECONDS)
+        except Queue.Empty:
+            for worker in workers:
+                if not worker.is_alive() and worker.pid in running:
+                    name, start_time = running.pop(worker.pid)
+                    job = [job for job in jobs if job['name'] == name][0]
+                    finished(dict(name=name, signature=job_signature(job), status='failed',
+                                  seconds=time.time() - start_time,
+                                  error='worker exited with code %r' % worker.exitcode))
+                    remaining -= 1
+            if not any(worker.is_alive() for worker in workers) and not running:
+                ## no worker is left to run the rest
+                break
+            continue
+        if kind == 'start':
+            running[pid] = (value, time.time())
+        else:
+            running.pop(pid, None)
+            finished(value)
+            remaining -= 1
+
+    for worker in workers:
+        worker.join()
+
+def run_jobs(jobs, processes=1, checkpoint_path=None, log_dir=None):
+    '''
+    run a sweep of jobs, see the module docstring for the format
+
+    :param processes: number of worker processes, or 1 to run the jobs
+    in this process
+
+    :param checkpoint_path: file recording finished jobs, which a
+    later call skips
+
+    :param log_dir: if set, then each job's log output goes to
+    <log_dir>/<name>.log.gz
+
+    :returns list: records of the jobs that ran, in the order they finished
+    '''
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        sys.exit('job names must be unique')
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    done = load_checkpoint(checkpoint_path)
+    catalogs = dict()
+    costs = dict()
+    todo = []
+    for job in jobs:
+        args = _parse_job_args(job)
+        if done.get(job_signature(job), {}).get('status') == 'done':
+            log('skipping %s, which finished in an earlier sweep' % job['name'])
+            continue
+        costs[job['name']] = estimate_cost(job, args, catalogs)
+        todo.append(job)
+
+    ## start the longest jobs first
+    todo.sort(key=lambda job: costs[job['name']], reverse=True)
+    log('%d of %d jobs to run' % (len(todo), len(jobs)))
+
+    records = []
+    def finished(record):
+        records.append(record)
+        log('%s %s after %.1f seconds' % (record['name'], record['status'], record['seconds']))
+        if record['error']:
+            log(record['error'])
+        if checkpoint_path:
+            _append_checkpoint(checkpoint_path, record)
+
+    start_time = time.time()
+    if processes > 1:
+        _run_in_workers(todo, processes, log_dir, finished)
+    else:
+        shared = SharedInputs()
+        for job in todo:
+            finished(run_job(job, shared, log_dir))
+
+    log_timing_summary(records, costs, time.time() - start_time)
+    return records
+
+def log_timing_summary(records, costs, elapsed):
+    log('%-50s %-7s %10s %12s' % ('job', 'status', 'seconds', 'est. cost'))
+    for record in sorted(records, key=lambda record: record['seconds'], reverse=True):
+        log('%-50s %-7s %10.1f %12.4g' % (record['name'], record['status'],
+                                          record['seconds'], costs[record['name']]))
+    num_failed = len([record for record in records if record['status'] != 'done'])
+    log('%d jobs took %.1f seconds of work in %.1f seconds, %d failed'
+        % (len(records), sum(record['seconds'] for record in records), elapsed, num_failed))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('jobs', help='path to a JSON file with a list of jobs')
+    parser.add_argument(
+        '--processes', default=1, type=int,
+        help='number of jobs to run at a time')
+    parser.add_argument(
+        '--checkpoint', default=None,
+        help='file recording finished jobs, so that running the sweep again resumes it')
+    parser.add_argument(
+        '--log-dir', default=None,
+        help='write the log of each job to <log-dir>/<name>.log.gz')
+    args = parser.parse_args()
+
+    records = run_jobs(json.load(open(args.jobs)), processes=args.processes,
+                       checkpoint_path=args.checkpoint, log_dir=args.log_dir)
+    if [record for record in records if record['status'] != 'done']:
+        sys.exit(1)
@@ -19,15 +19,36 @@ import sys
 import csv
 import gzip
 import json
+import copy
 import time
+import shutil
 import argparse
+import tempfile
 import traceback
+import multiprocessing
 from datetime import datetime
 from operator import itemgetter
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from kba.scorer._metrics import compile_and_average_performance_metrics, find_max_scores
 from kba.scorer._outputs import write_team_summary, write_graph, write_performance_metrics, log
+from kba.scorer._bundles import write_team_bundles
+from kba.scorer._spill import partition_lines
+from kba.scorer._bgzf import map_line_ranges
+from kba.scorer._entity_index import iter_entity_lines
+from kba.scorer._pipeline import prefetch_runs, BackgroundWriter
+from kba.scorer._arena import write_arena, can_pack
+from kba.scorer._runparser import iter_rows, open_run, COLUMNS, SSF_COLUMNS
+from kba.scorer._catalog import load_catalog
+from kba.scorer._memory import MemoryReport
+from kba.scorer._progress import Progress
+from kba.scorer._confusion import ConfusionHistogram
+from kba.scorer._ssf_annotation import SSFAnnotation, date_hour_to_hour
+from kba.scorer._jsonstream import JSONStream
+from kba.scorer._pool import load_pool
+from kba.scorer._overlap import make_criterion, DEFAULT_CRITERION
+from kba.scorer._coref import CorefScores, write_coref_metrics
+from kba.scorer.drilldown import DrilldownRecorder
 
 ## most basic level: identify documents that substantiate a particular
 ## slot_type that emerged during the corpus time range (ETR+TTR)
@@ -47,76 +68,316 @@ DATE_HOUR = 'DATE_HOUR'
 
 MODES = [DOCS, OVERLAP, FILL, DATE_HOUR]
 
-def load_annotation(path_to_annotation_file, reject, slot_type_filter=None,
-                    pooled_only=False,
-                    pooled_assertion_keys=None):
+## like DATE_HOUR, but the first assertion of an equiv_id pairing gets
+## partial credit that halves for every --date-hour-half-life hours
+## that its date_hour comes after the earliest document that the
+## assessors found for the fill, and the rest of the credit is an FN
+DATE_HOUR_LATENCY = DATE_HOUR + '-latency'
+
+## B-cubed and pairwise scores of the equiv_ids of the assertions that
+## reach FILL, see kba.scorer._coref
+FILL_COREF = FILL + '-coref'
+
+def overlap_criteria(args):
     '''
-    Loads the SSF truth data from its JSON format on disk
-    
-    path_to_annotation_file: string file system path to the JSON annotation file
-    
-    reject:  callable that returns boolean given a target_id
+    :returns list: (mode, criterion) of OVERLAP and of each of the
+    --overlap-criteria that OVERLAP also gets scored under, as the
+    mode OVERLAP-<criterion>
+    '''
+    criteria = [(OVERLAP, make_criterion(DEFAULT_CRITERION))]
+    for name in (args.overlap_criteria or '').split(','):
+        name = name.strip()
+        if not name or name == DEFAULT_CRITERION:
+            continue
+        try:
+            criteria.append((OVERLAP + '-' + name, make_criterion(name)))
+        except ValueError, exc:
+            sys.exit(str(exc))
+    return criteria
+
+def scored_modes(args):
+    '''
+    :returns list: MODES and the extra OVERLAP and DATE_HOUR modes of args
+    '''
+    modes = MODES + [mode for mode, criterion in overlap_criteria(args)[1:]]
+    if args.date_hour_half_life:
+        modes.append(DATE_HOUR_LATENCY)
+    return modes
+
+def mode_positives(positives, mode):
+    '''
+    :returns dict: target_id --> number of positives of mode, where
+    the extra OVERLAP modes have the same positives as OVERLAP, and
+    DATE_HOUR_LATENCY the same as DATE_HOUR
+    '''
+    if mode.startswith(OVERLAP + '-'):
+        return positives[OVERLAP]
+    if mode == DATE_HOUR_LATENCY:
+        return positives[DATE_HOUR]
+    return positives[mode]
+
+def latency_credit(annotation, target_id, slot_type, true_equiv_id, date_hour, half_life):
+    '''
+    :returns float: credit for first asserting the fill true_equiv_id
+    at date_hour, which is 1 at or before the earliest date_hour that
+    the assessors know for it and halves every half_life hours after
+    '''
+    earliest = annotation.earliest_hour(target_id, slot_type, true_equiv_id)
+    if earliest is None:
+        return 1.0
+    try:
+        latency = date_hour_to_hour(date_hour) - earliest
+    except ValueError:
+        log('no latency credit for unparseable date_hour: %r' % date_hour)
+        return 0.0
+    return 0.5 ** (max(0, latency) / half_life)
+
+## flags that a --facet can set: name --> (dest in args, takes a value)
+FACET_FLAGS = {
+    'slot-type': ('slot_type', True),
+    'group': ('group', True),
+    'entity-type': ('entity_type', True),
+    'reject-twitter': ('reject_twitter', False),
+    'reject-wikipedia': ('reject_wikipedia', False),
+    }
+
+def read_truth_json(path_to_annotation_file):
+    '''
+    parse the SSF truth data file, exiting if it cannot be read
     '''
     try:
-        native_annotation = json.load(open(path_to_annotation_file))
+        return json.load(open(path_to_annotation_file))
     except Exception, exc:
         sys.exit( 'failed to open %r:\n%s' % (path_to_annotation_file, traceback.format_exc(exc)) )
 
-    for target_id in native_annotation.keys():
-        if reject(target_id):
-            log('excluding truth data for %s' % target_id)
-            native_annotation.pop(target_id)
+## only scored when asked for with --slot-type
+unofficial_slots = ['SignificantOther', 'Children']
 
-    ## invert the annotation file to have a stream_id index pointing
-    ## to target_ids point to slot_types pointing to slot fills,
-    ## instead of the reverse
-    # stream_id --> target_id --> slot_types
-    annotation = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+def keep_slot_type(slot_type, slot_type_filter):
+    '''
+    :returns bool: whether the fills of slot_type get scored
+    '''
+    if slot_type_filter and slot_type != slot_type_filter:
+        log('excluding truth data for %s' % slot_type)
+        return False
+    elif (slot_type_filter not in unofficial_slots) and slot_type in unofficial_slots:
+        log('excluding truth data for %s because not part of official slot inventory.  To score this, use --slot-type' % slot_type)
+        return False
+    return True
 
-    unofficial_slots = ['SignificantOther', 'Children']
+def pooled_fills(target_id, slot_type, equiv_class, pooled_only, pooled_assertion_keys):
+    '''
+    :returns list: (stream_id, byte ranges) of the documents in
+    equiv_class, without the ones that no run found if pooled_only
+    '''
+    fills = []
+    for stream_id in equiv_class['stream_ids'].keys():
+        assertion_key = (stream_id, target_id, slot_type) 
+        if pooled_only and assertion_key not in pooled_assertion_keys:
+            log('excluding truth data for %s because not in any run submission' 
+                % (assertion_key, ))
+            continue
+        fills.append((stream_id, equiv_class['stream_ids'][stream_id][1]))
+    return fills
 
-    for target_id, slots in native_annotation.items():
-        for slot_type, fills in slots.items():
-            if slot_type_filter and slot_type != slot_type_filter:
-                log('excluding truth data for %s' % slot_type)
-                continue
-            elif (slot_type_filter not in unofficial_slots) and slot_type in unofficial_slots:
-                log('excluding truth data for %s because not part of official slot inventory.  To score this, use --slot-type' % slot_type)
-                continue
-            for equiv_id, equiv_class in fills.items():
-                for stream_id in equiv_class['stream_ids'].keys():
-                    assertion_key = (stream_id, target_id, slot_type) 
-                    if pooled_only and assertion_key not in pooled_assertion_keys:
-                        log('excluding truth data for %s because not in any run submission' 
-                            % (assertion_key, ))
-                        continue
+def earliest_date_hour(equiv_class):
+    '''
+    :returns str: the earliest date_hour of the documents in
+    equiv_class, including the ones that pooled_fills leaves out
+    '''
+    return min(doc[0] for doc in equiv_class['stream_ids'].itervalues())
+
+def count_positives(positives, target_id, equiv_class):
+    '''
+    count the true things in equiv_class for each MODE, which includes
+    the slot types and documents that the filters leave out
+    '''
+    ## number of known substantiating documents per target_id
+    positives[DOCS][target_id] += len(list(set(equiv_class['stream_ids'].keys())))
 
-                    ## one document can give multiple fills for the
-                    ## same slot type on the same entity
-                    annotation[stream_id][target_id][slot_type][equiv_id] = equiv_class
+    ## we only consider one byte range per document, so these are equal:
+    positives[OVERLAP][target_id] = positives[DOCS][target_id]
 
-    ## count number of true things in the annotation set -- for each MODE
-    positives = defaultdict(lambda: defaultdict(int))
-    for target_id, slots in native_annotation.items():
-        for slot_type, fills in slots.items():
-            for equiv_id, equiv_class in fills.items():
-                ## number of known substantiating documents per target_id
-                positives[DOCS][target_id] += len(list(set(equiv_class['stream_ids'].keys())))
+    ## these are also equal
+    positives[FILL][target_id] = positives[DOCS][target_id]
 
-                ## we only consider one byte range per document, so these are equal:
-                positives[OVERLAP][target_id] = positives[DOCS][target_id]
+    ## number of date_hours with known substantiating docs per target_id
+    #positives[DATE_HOUR][target_id] += len(list(set(map(itemgetter(0), equiv_class['stream_ids'].values()))))
 
-                ## these are also equal
-                positives[FILL][target_id] = positives[DOCS][target_id]
+    ## super strict version of date_hours is that there is
+    ## only the first date_hour and only one document for
+    ## it
+    positives[DATE_HOUR][target_id] += 1
 
-                ## number of date_hours with known substantiating docs per target_id
-                #positives[DATE_HOUR][target_id] += len(list(set(map(itemgetter(0), equiv_class['stream_ids'].values()))))
+def stream_truth_json(path_to_annotation_file, reject, slot_type_filter=None,
+                      pooled_only=False, pooled_assertion_keys=None, earliest=None):
+    '''
+    read the SSF truth data file incrementally, one equiv_class at a
+    time, keeping only the fills that get scored
+
+    :returns tuple: (truth, positives), where truth is target_id -->
+    slot_type --> equiv_id --> list of (stream_id, byte ranges) from
+    pooled_fills.  The rejected target_ids and the excluded slot_types
+    keep their keys, with None in place of their fills, so that the
+    dicts iterate in the same order as those from json.load.
+
+    earliest: if given, a dict that gets the earliest_date_hour of
+    each (target_id, slot_type, equiv_id) that the fills come from
+    '''
+    return stream_truth_json_filters(path_to_annotation_file, [dict(
+        reject=reject, slot_type_filter=slot_type_filter, pooled_only=pooled_only,
+        pooled_assertion_keys=pooled_assertion_keys, earliest=earliest)])[0]
 
-                ## super strict version of date_hours is that there is
-                ## only the first date_hour and only one document for
-                ## it
-                positives[DATE_HOUR][target_id] += 1
+def stream_truth_json_filters(path_to_annotation_file, filters):
+    '''
+    like stream_truth_json, but reads the file only once for several
+    sets of filters, e.g. one for each --facet
 
+    filters: list of dicts of the keyword args of stream_truth_json
+
+    :returns list: (truth, positives) for each dict in filters
+    '''
+    results = [(dict(), defaultdict(lambda: defaultdict(int))) for _ in filters]
+    try:
+        stream = JSONStream(open(path_to_annotation_file))
+        for target_id in stream.members():
+            ## the slot_type --> equiv_id dict of each set of filters
+            all_slots = []
+            for (truth, positives), truth_filter in zip(results, filters):
+                slots = truth[target_id] = None
+                if truth_filter['reject'](target_id):
+                    log('excluding truth data for %s' % target_id)
+                else:
+                    slots = truth[target_id] = dict()
+                all_slots.append(slots)
+            for slot_type in stream.members():
+                all_equivs = []
+                for slots, truth_filter in zip(all_slots, filters):
+                    equivs = None
+                    if slots is not None:
+                        if keep_slot_type(slot_type, truth_filter.get('slot_type_filter')):
+                            equivs = dict()
+                        slots[slot_type] = equivs
+                    all_equivs.append(equivs)
+                for equiv_id in stream.members():
+                    equiv_class = stream.value()
+                    for (truth, positives), slots, equivs, truth_filter in \
+                            zip(results, all_slots, all_equivs, filters):
+                        if slots is None:
+                            continue
+                        count_positives(positives, target_id, equiv_class)
+                        if equivs is not None:
+                            equivs[equiv_id] = pooled_fills(
+                                target_id, slot_type, equiv_class,
+                                truth_filter.get('pooled_only'), truth_filter.get('pooled_assertion_keys'))
+                            if truth_filter.get('earliest') is not None:
+                                truth_filter['earliest'][(target_id, slot_type, equiv_id)] = \
+                                    earliest_date_hour(equiv_class)
+    except Exception, exc:
+        sys.exit( 'failed to open %r:\n%s' % (path_to_annotation_file, traceback.format_exc(exc)) )
+    return results
+
+def iter_truth_fills(truth):
+    '''
+    yield (stream_id, target_id, slot_type, equiv_id, byte ranges) for
+    the fills kept by stream_truth_json
+    '''
+    for target_id, slots in truth.iteritems():
+        if slots is None:
+            continue
+        for slot_type, equivs in slots.iteritems():
+            if equivs is None:
+                continue
+            for equiv_id, fills in equivs.iteritems():
+                for stream_id, byte_ranges in fills:
+                    yield stream_id, target_id, slot_type, equiv_id, byte_ranges
+
+def iter_native_fills(native_annotation, reject, slot_type_filter, pooled_only,
+                      pooled_assertion_keys, positives, earliest=None):
+    '''
+    like iter_truth_fills, but filtering the file parsed by
+    read_truth_json as it goes, and counting its positives and, if
+    given, the earliest date_hours like stream_truth_json
+    '''
+    for target_id, slots in native_annotation.iteritems():
+        if reject(target_id):
+            log('excluding truth data for %s' % target_id)
+            continue
+        for slot_type, fills in slots.iteritems():
+            for equiv_class in fills.itervalues():
+                count_positives(positives, target_id, equiv_class)
+            if not keep_slot_type(slot_type, slot_type_filter):
+                continue
+            for equiv_id, equiv_class in fills.iteritems():
+                if earliest is not None:
+                    earliest[(target_id, slot_type, equiv_id)] = earliest_date_hour(equiv_class)
+                for stream_id, byte_ranges in pooled_fills(target_id, slot_type, equiv_class,
+                                                           pooled_only, pooled_assertion_keys):
+                    yield stream_id, target_id, slot_type, equiv_id, byte_ranges
+
+def load_annotation(path_to_annotation_file, reject, slot_type_filter=None,
+                    pooled_only=False,
+                    pooled_assertion_keys=None,
+                    native_annotation=None, streamed_truth=None):
+    '''
+    Loads the SSF truth data from its JSON format on disk
+    
+    path_to_annotation_file: string file system path to the JSON annotation file
+    
+    reject:  callable that returns boolean given a target_id
+
+    native_annotation: the file parsed by read_truth_json, if already
+    read.  It does not get modified.  Otherwise, the file gets read
+    incrementally by stream_truth_json, so that only the fills that
+    pass the filters are ever held in memory.
+
+    streamed_truth: (truth, positives, earliest) of the file, if
+    already read by stream_truth_json_filters with these filters.
+
+    returns (annotation, positives), where annotation is an
+    SSFAnnotation and positives counts the positives of each mode
+    for each target_id.  The annotation also holds the earliest
+    date_hour of each fill, for DATE_HOUR_LATENCY.
+    '''
+    ## (target_id, slot_type, equiv_id) --> earliest date_hour
+    earliest = dict()
+    if streamed_truth is not None:
+        truth, positives, earliest = streamed_truth
+        truth_fills = iter_truth_fills(truth)
+    elif native_annotation is None:
+        truth, positives = stream_truth_json(
+            path_to_annotation_file, reject, slot_type_filter,
+            pooled_only, pooled_assertion_keys, earliest)
+        truth_fills = iter_truth_fills(truth)
+    else:
+        positives = defaultdict(lambda: defaultdict(int))
+        truth_fills = iter_native_fills(
+            native_annotation, reject, slot_type_filter,
+            pooled_only, pooled_assertion_keys, positives, earliest)
+
+    ## invert the annotation file to have a stream_id index pointing
+    ## to target_ids point to slot_types pointing to slot fills,
+    ## instead of the reverse
+    # stream_id --> target_id --> slot_type --> equiv_id --> byte ranges
+    fills_by_stream = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+
+    for stream_id, target_id, slot_type, equiv_id, byte_ranges in truth_fills:
+        ## one document can give multiple fills for the
+        ## same slot type on the same entity
+        fills_by_stream[stream_id][target_id][slot_type][equiv_id] = byte_ranges
+    truth = truth_fills = None
+
+    ## flatten it in the order of the nested dicts, which the order of
+    ## the target_ids in the confusion matrices has always followed
+    annotation = SSFAnnotation()
+    for stream_id, targets in fills_by_stream.iteritems():
+        for target_id, slots in targets.iteritems():
+            for slot_type, fills in slots.iteritems():
+                annotation.add(stream_id, target_id, slot_type, fills.items())
+    del fills_by_stream
+
+    for (target_id, slot_type, equiv_id), date_hour in earliest.iteritems():
+        annotation.set_earliest(target_id, slot_type, equiv_id, date_hour)
 
     return annotation, positives
 
@@ -125,86 +386,242 @@ def assertions(run_file_handle):
     iterate over run_file_handle yielding assertion keys and rows
     
     assertion key = (stream_id, target_id, slot_type)
-    '''
-    for onerow in run_file_handle:
-        ## Skip Comments         
-        if onerow.startswith('#') or len(onerow.strip()) == 0:
-            continue
 
-        row = onerow.split()
-        assert len(row) == 11, row
-        try:
-            stream_id = row[2]
-            timestamp = int(stream_id.split('-')[0])
-            target_id = row[3]
-            conf = int(float(row[4]))
-            assert 0 < conf <= 1000
-            row[4] = conf
-
-            rating = int(row[5])
-            contains_mention = int(row[6])
-            date_hour = row[7]
-            slot_type = row[8]
-            equiv_id = row[9]
-            start_byte, end_byte = row[10].split('-')
-            start_byte = int(start_byte)
-            end_byte = int(end_byte)
-
-        except Exception, exc:
-            print repr(row)
-            sys.exit(traceback.format_exc(exc))
-
-        assertion_key = (stream_id, target_id, slot_type)
+    row = tuple of the SSF_COLUMNS (stream_id, target_id, conf, rating,
+    contains_mention, date_hour, slot_type, equiv_id, byte_range)
+
+    :raises RunFormatError: on a row without all of the COLUMNS or
+    with a bad value, naming its line
+    '''
+    for row in iter_rows(run_file_handle, SSF_COLUMNS, num_columns=len(COLUMNS)):
+        assertion_key = (row[0], row[1], row[6])
         yield assertion_key, row
 
 
-def score_confusion_matrix_DOCS(run_file_handle, annotation, positives,
-                           cutoff_step_size=50, unannotated_is_TN=False, debug=False):
+class FacetScoring(object):
+    '''
+    the histograms of scoring one run against the annotation of one
+    facet, and the DOCS TPs that the later modes start from
     '''
-    read a run submission and generate a confusion matrix (number of
-    true/false positives and true/false negatives) for DOCS mode
-    evaluation.  Generate a confusion matrix for each cutoff step and
-    each mode.
+    def __init__(self, annotation, positives, cutoffs, docs_arena=None, drilldown=None,
+                 coref=None, modes=MODES):
+        self.annotation = annotation
+        self.positives = positives
+        self.docs_arena = docs_arena
+        self.drilldown = drilldown
+        self.coref = coref
+
+        ## the modes after DOCS have always been scored in steps of 50,
+        ## whatever the cutoff_step_size, and have zero TPs, FPs and TNs
+        ## at the cutoffs in between
+        self.cutoffs = list(cutoffs)
+        later_cutoffs = [cutoff for cutoff in cutoffs if cutoff % 50 == 0]
+        self.histograms = dict((mode, ConfusionHistogram(mode == DOCS and cutoffs or later_cutoffs,
+                                                         fractional=(mode == DATE_HOUR_LATENCY)))
+                               for mode in modes)
+
+        if docs_arena is not None:
+            target_ids = docs_arena.target_ids
+        else:
+            target_ids = annotation.target_ids
+        for target_id in target_ids:
+            for mode in modes:
+                ## make sure that the confusion matrix has entries for all entities
+                self.histograms[mode].add_target(target_id)
+
+        if drilldown:
+            ## the fractional credit of DATE_HOUR_LATENCY does not
+            ## split into TPs and FNs to list
+            for mode in modes:
+                if mode != DATE_HOUR_LATENCY:
+                    drilldown.set_cutoffs(mode, self.histograms[mode].cutoffs)
+
+        if coref:
+            coref.set_cutoffs(cutoffs)
+            for target_id in target_ids:
+                coref.add_target(target_id)
+
+        ## count the total number of assertions per entity
+        self.num_assertions = {}
+
+        ## keep assertions that are in the annotation set, because this is
+        ## much smaller than the entire run submission.  We will pass this
+        ## to the three evaluation steps beyond DOCS.
+        self.DOCS_TPs = list()
+
+    def confusion_matrices(self):
+        '''
+        FN is the number of positives in the annotation set that are
+        not TPs, except that DATE_HOUR has only ever counted the FNs of
+        entities with at least one DATE_HOUR TP, and so does
+        DATE_HOUR_LATENCY
+        '''
+        CM = dict()
+        for mode in self.histograms:
+            positives = mode_positives(self.positives, mode)
+            FN_needs_TP = mode in (DATE_HOUR, DATE_HOUR_LATENCY)
+            CM[mode] = self.histograms[mode].confusion_matrix(
+                positives, FN_needs_TP=FN_needs_TP)
+            for target_id in CM[mode]:
+                FN = 0
+                if self.histograms[mode].num_positive(target_id) or not FN_needs_TP:
+                    FN = positives.get(target_id, 0)
+                for cutoff in self.cutoffs:
+                    if cutoff not in CM[mode][target_id]:
+                        CM[mode][target_id][cutoff] = dict(TP=0, FP=0, FN=FN, TN=0)
+        return CM
+
+def score_confusion_matrices(run_file_handle, annotation, positives,
+                             cutoff_step_size=50, unannotated_is_TN=False, debug=False,
+                             spill_budget=None, run_file_path=None, parse_workers=None,
+                             entity_index=False, docs_arena=None, memory=None,
+                             drilldown=None):
+    '''
+    read a run submission and generate the confusion matrices (number
+    of true/false positives and true/false negatives) for each cutoff
+    step, each target_id and each of the four modes.
+
+    The de-duplicated assertions get scored for DOCS as they are read,
+    keeping only the DOCS true positives, which are much fewer.  Those
+    then go through OVERLAP, FILL and DATE_HOUR, see score_later_modes.
     
     run_file_handle: str, a filesystem link to the run submission 
     annotation: dict, containing the annotation data
     cutoff_step_size: int, increment between cutoffs
-    unannotated_is_TN: boolean, true to count unannotated as negatives
+    unannotated_is_TN: boolean, accepted for symmetry with ccr; SSF
+    always counts assertions without a DOCS match as negatives
+    spill_budget: int, if set, then hash-partition the run by target_id
+    into temporary files and de-duplicate each partition within this
+    many bytes of memory
+    run_file_path: str, path of the run, needed for parse_workers
+    parse_workers: int, if set, then parse disjoint byte ranges of a
+    BGZF or multi-member gzip run in this many processes
+    entity_index: boolean, true to use a per-entity index of the run
+    to read only the rows about entities that have DOCS positives
+    docs_arena: AnnotationArena from write_docs_arena, if set, then
+    DOCS matches are looked up in it instead of in annotation
+    memory: MemoryReport that records the size of each run_set and of
+    the histograms after each pass
+    drilldown: DrilldownRecorder that saves the judged assertions
     
-    returns a confusion matrix dictionary for each target_id 
+    returns a confusion matrix dictionary for each mode and target_id
     '''
-    ## Create a dictionary containing the confusion matrix (CM)
-    cutoffs = range(0, 999, cutoff_step_size)
+    return score_facets(
+        run_file_handle, [(annotation, positives, docs_arena, drilldown, None)],
+        cutoff_step_size=cutoff_step_size, debug=debug, spill_budget=spill_budget,
+        run_file_path=run_file_path, parse_workers=parse_workers,
+        entity_index=entity_index, memory=memory)[0]
+
+def score_facets(run_file_handle, facets, cutoff_step_size=50, debug=False,
+                 spill_budget=None, run_file_path=None, parse_workers=None,
+                 entity_index=False, memory=None, overlap_criteria=None,
+                 date_hour_half_life=None):
+    '''
+    like score_confusion_matrices, but scores the run against the
+    annotation of each of several facets, e.g. one per slot type,
+    while reading and de-duplicating it only once
 
-    def init_confusion_matrix():
-        return dict(TP=0, FP=0, FN=0, TN=0)
+    facets: list of (annotation, positives, docs_arena, drilldown,
+    coref), where docs_arena, the DrilldownRecorder and the
+    CorefScores may be None
 
-    ## confusion matrix is mode-->target_id-->cutoff-->2-by-2 matrix
-    CM = {mode: defaultdict(lambda: defaultdict(init_confusion_matrix))
-          for mode in MODES}
+    overlap_criteria: list of (mode, criterion) from overlap_criteria,
+    if OVERLAP also gets scored under more criteria than its own
 
-    for stream_id in annotation:
-        for target_id in annotation[stream_id]:
-            for mode in MODES:
-                ## make sure that the confusion matrix has entries for all entities
-                if target_id not in CM[mode]:
-                    CM[mode][target_id] = dict()
-                    for cutoff in cutoffs:
-                        CM[mode][target_id][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+    date_hour_half_life: hours, if DATE_HOUR_LATENCY also gets scored
+
+    returns a list of the confusion matrices of each facet
+    '''
+    cutoffs = range(0, 999, cutoff_step_size)
+
+    modes = MODES
+    if overlap_criteria:
+        modes = MODES + [mode for mode, criterion in overlap_criteria[1:]]
+    if date_hour_half_life:
+        modes = modes + [DATE_HOUR_LATENCY]
 
-    ## count the total number of assertions per entity
-    num_assertions = {}
+    scorings = [FacetScoring(annotation, positives, cutoffs, docs_arena=docs_arena,
+                             drilldown=drilldown, coref=coref, modes=modes)
+                for annotation, positives, docs_arena, drilldown, coref in facets]
 
-    ## keep assertions that are in the annotation set, because this is
-    ## much smaller than the entire run submission.  We will pass this
-    ## to the four evaluation steps beyond DOCS.
-    DOCS_TPs = list()
+    if len(scorings) == 1:
+        ## the facet's own positives filter the rows of the run
+        wanted = scorings[0].positives
+    else:
+        ## keep the rows about entities that any facet has DOCS
+        ## positives for, and leave each facet to skip the others
+        wanted = {DOCS: dict((target_id, count)
+                             for scoring in scorings
+                             for target_id, count in scoring.positives[DOCS].items()
+                             if count > 0)}
+
+    ## rows about entities without DOCS positives get ignored, so skip
+    ## the parts of the run that only hold those
+    if entity_index and not parse_workers > 1 \
+            and run_file_path and run_file_path.endswith('.gz'):
+        run_file_handle = iter_entity_lines(
+            run_file_path,
+            set(target_id for target_id, count in wanted[DOCS].items() if count > 0))
+
+    ## the assertion keys all contain the target_id, so partitions of
+    ## the run by target_id can be de-duplicated independently
+    if spill_budget:
+        run_sets = (dedup_assertions(run_lines, wanted)
+                    for run_lines in partition_lines(run_file_handle, 3, spill_budget))
+    elif parse_workers > 1 and run_file_path and run_file_path.endswith('.gz'):
+        run_sets = [merge_run_sets(map_line_ranges(
+                    run_file_path, parse_workers, dedup_assertions,
+                    {DOCS: dict(wanted[DOCS])}))]
+    else:
+        run_sets = [dedup_assertions(run_file_handle, wanted)]
+
+    for run_set in run_sets:
+        if memory:
+            memory.stage('dedup', run_set=run_set)
+        for scoring in scorings:
+            score_DOCS_assertions(run_set, scoring.annotation, scoring.histograms[DOCS],
+                                  scoring.DOCS_TPs, scoring.num_assertions,
+                                  docs_arena=scoring.docs_arena, drilldown=scoring.drilldown,
+                                  positives=len(scorings) > 1 and scoring.positives or None)
+
+    for scoring in scorings:
+        if debug:
+            print 'showing assertion counts:'
+            print json.dumps(scoring.num_assertions, indent=4, sort_keys=True)
+
+        ## sort by date_hour, and then by the rest of the assertion key so
+        ## that the later stages see the same order however the run was
+        ## de-duplicated
+        scoring.DOCS_TPs.sort(key=itemgetter(5, 0, 1, 6))
+
+    if memory:
+        memory.stage(DOCS, histograms=[scoring.histograms for scoring in scorings],
+                     DOCS_TPs=[scoring.DOCS_TPs for scoring in scorings])
+
+    for scoring in scorings:
+        score_later_modes(scoring.DOCS_TPs, scoring.annotation, scoring.positives,
+                          scoring.histograms, drilldown=scoring.drilldown,
+                          overlap_criteria=overlap_criteria, coref=scoring.coref,
+                          date_hour_half_life=date_hour_half_life)
+        ## the DOCS TPs are only needed for the later modes
+        scoring.DOCS_TPs = None
+
+    if memory:
+        memory.stage('%s+%s+%s' % (OVERLAP, FILL, DATE_HOUR),
+                     histograms=[scoring.histograms for scoring in scorings])
+
+    return [scoring.confusion_matrices() for scoring in scorings]
+
+def dedup_assertions(run_lines, positives):
+    '''
+    Iterate through every row of the run and construct a
+    de-duplicated run summary
 
-    ## Iterate through every row of the run and construct a
-    ## de-duplicated run summary
+    returns dict mapping assertion keys to rows
+    '''
     run_set = dict()
-    for assertion_key, row in assertions(run_file_handle):
-        conf = row[4]
+    for assertion_key, row in assertions(run_lines):
+        conf = row[2]
 
         stream_id, target_id, slot_type = assertion_key
         if positives[DOCS].get(target_id, 0) == 0:
@@ -213,31 +630,61 @@ def score_confusion_matrix_DOCS(run_file_handle, annotation, positives,
 
         if assertion_key in run_set:
             other_row = run_set[assertion_key]
-            if other_row[4] > conf:
+            if other_row[2] > conf:
                 log('ignoring a duplicate row with lower conf: %d > %d'
-                    % (other_row[4], conf))
+                    % (other_row[2], conf))
                 continue
 
         #log('got a row: %r' % (row,))
         run_set[assertion_key] = row
 
+    return run_set
+
+def merge_run_sets(run_sets):
+    '''
+    combine run sets that dedup_assertions built from consecutive
+    parts of one run into the run set for the whole run.  Like
+    dedup_assertions, this keeps the last of the rows with the highest
+    conf for each assertion key.
+    '''
+    merged = dict()
+    for run_set in run_sets:
+        for assertion_key, row in run_set.iteritems():
+            other_row = merged.get(assertion_key)
+            if other_row and other_row[2] > row[2]:
+                continue
+            merged[assertion_key] = row
+    return merged
+
+
+def score_DOCS_assertions(run_set, annotation, histogram, DOCS_TPs,
+                          num_assertions, docs_arena=None, drilldown=None,
+                          positives=None):
+    '''
+    Add the de-duplicated assertions in run_set to the DOCS histogram,
+    appending the DOCS true positives to DOCS_TPs, and to drilldown,
+    if given
+
+    positives: if given, then skip the assertions about entities
+    without DOCS positives in it, for a run_set that was de-duplicated
+    for several facets at once
+    '''
+    if docs_arena is not None:
+        is_docs_match = docs_arena.__contains__
+    else:
+        is_docs_match = annotation.__contains__
+
     log('considering %d unique DOCS assertions' % len(run_set))
     for row in run_set.values():
 
-        stream_id = row[2]
-        timestamp = int(stream_id.split('-')[0])
-        target_id = row[3]
-        conf = row[4]
-        rating = row[5]
-
-        contains_mention = int(row[6])
-        date_hour = row[7]
-        slot_type = row[8]
-        equiv_id = row[9]
-        start_byte, end_byte = row[10].split('-')
+        stream_id, target_id, conf, rating, contains_mention, \
+            date_hour, slot_type, equiv_id, byte_range = row
+        start_byte, end_byte = byte_range.split('-')
         start_byte = int(start_byte)
         end_byte = int(end_byte)
 
+        if positives and positives[DOCS].get(target_id, 0) == 0:
+            continue
 
         if target_id not in num_assertions:
             num_assertions[target_id] = {'total': 0,
@@ -249,91 +696,62 @@ def score_confusion_matrix_DOCS(run_file_handle, annotation, positives,
         ## all modes start with DOCS, so is_annotated_TP means that
         ## the system has a DOCS-TP above some conf threshold
         is_annotated_TP = False
-        if stream_id in annotation:
-            if target_id in annotation[stream_id]:
-                if slot_type in annotation[stream_id][target_id]:
-                    is_annotated_TP = True
-                    rec = (stream_id, target_id, conf, rating, contains_mention, date_hour, slot_type, equiv_id, start_byte, end_byte)
-                    DOCS_TPs.append( rec )
-                    #log('TP: %r' % (rec,))
+        if is_docs_match((stream_id, target_id, slot_type)):
+            is_annotated_TP = True
+            rec = (stream_id, target_id, conf, rating, contains_mention, date_hour, slot_type, equiv_id, start_byte, end_byte)
+            DOCS_TPs.append( rec )
+            #log('TP: %r' % (rec,))
 
         if is_annotated_TP:
             num_assertions[target_id]['is_annotated_TP'] += 1
 
-        increment_CM(is_annotated_TP, conf=conf, cutoffs=cutoffs, CM=CM, 
-                     mode=DOCS, 
-                     target_id=target_id, unannotated_is_TN=unannotated_is_TN)
+        histogram.add(target_id, conf, is_annotated_TP)
+        if drilldown:
+            drilldown.add(DOCS, target_id, '%s %s' % (stream_id, slot_type), conf,
+                          is_annotated_TP)
 
-    correct_FN(CM, DOCS, positives)
+def score_later_modes(DOCS_TPs, annotation, positives, histograms, drilldown=None,
+                      overlap_criteria=None, coref=None, date_hour_half_life=None):
+    '''
+    pass the DOCS_TPs through the OVERLAP, FILL and DATE_HOUR stages in
+    turn, adding each assertion to the histogram of every mode that it
+    reaches.  Each stage passes on only its own TPs:
 
-    if debug:
-        print 'showing assertion counts:'
-        print json.dumps(num_assertions, indent=4, sort_keys=True)
+       OVERLAP: counts the assertion once for each slot fill that the
+       assessors found in the document, as an FP if it does not
+       overlap any of the fill's byte ranges, and as a TP regardless,
+       and passes on the assertion paired with the last of the fills.
+       Given overlap_criteria, each of the extra OVERLAP modes gets
+       counted the same way under its own criterion for overlapping,
+       which does not change what gets passed on.
 
-    ## sort by date_hour
-    DOCS_TPs.sort(key=itemgetter(5))
+       FILL: excludes assertions that either:
 
-    return CM, DOCS_TPs
+          1) re-use an earlier (run)equiv_id that was not associated
+          with the same (truth)equiv_id from the truth set
 
-def increment_CM(is_annotated_TP, conf=0, cutoffs=None, CM=None, mode=None, target_id=None, unannotated_is_TN=False):
-    '''
-    for a given TP with some conf score, update the CM for the given mode
-    '''
-    assert target_id and isinstance(target_id, str) and target_id.startswith('http'), target_id
+          2) fail to re-use an earlier (run)equiv_id that _was_
+          associated with a (truth)equiv_id from the truth set
 
-    ## count T/F N/P for each mode
-    if is_annotated_TP:
-        for cutoff in cutoffs:                
-            if conf > cutoff:
-                CM[mode][target_id][cutoff]['TP'] += 1
+       DATE_HOUR: excludes the assertions of an equiv_id pairing after
+       the first one that it sees
 
-    ## In the annotation set and non-useful                       
-    elif not is_annotated_TP:
-        for cutoff in cutoffs:
-            if conf > cutoff:
-                ## Above the cutoff: false-positive
-                CM[mode][target_id][cutoff]['FP'] += 1
-            else:
-                ## Below the cutoff: true-negative
-                CM[mode][target_id][cutoff]['TN'] += 1
-
-    ## Not in the annotation set so its a negative (if flag is true)
-    elif unannotated_is_TN:
-        for cutoff in cutoffs:
-            if conf > cutoff:
-                ## Above the cutoff: false-positive
-                CM[mode][target_id][cutoff]['FP'] += 1
-            else:
-                ## Below the cutoff: true-negative
-                CM[mode][target_id][cutoff]['TN'] += 1    
-    
-    return CM
-
-def correct_FN(CM, mode, positives):
-    '''
-    Correct FN for things in the annotation set that are NOT in the run
-    '''
-    for target_id in CM[mode]:
-        for cutoff in CM[mode][target_id]:
-            ## Then subtract the number of TP at each cutoffs 
-            ## (since FN+TP==True things in annotation set)
-            CM[mode][target_id][cutoff]['FN'] = \
-                positives[mode][target_id] - CM[mode][target_id][cutoff]['TP']
-            assert positives[mode][target_id] >= CM[mode][target_id][cutoff]['TP'], \
-                "how did we get more TPs than available positives[mode=%s][target_id=%s] = %d >= %d = CM[mode][target_id][cutoff=%f]['TP']" \
-                % (mode, target_id, positives[mode][target_id], CM[mode][target_id][cutoff]['TP'], cutoff)
+    FILL and DATE_HOUR see the TPs of the stage before them in the
+    order of the dicts that they have always been de-duplicated in,
+    rather than in date_hour order.
 
-    return CM
+    Given date_hour_half_life, DATE_HOUR_LATENCY counts the same
+    assertions as DATE_HOUR, except that the first one of a pairing
+    only gets the latency_credit of its date_hour as a TP.
 
-
-def score_confusion_matrix_OVERLAP(CM, DOCS_TPs, annotation, positives,
-                                cutoff_step_size=50, unannotated_is_TN=False,
-                                debug=False):
-    '''
-    construct OVERLAP_TPs by excluding from DOCS_TPs those assertions
-    that do not overlap any string identified by an assessor
+    Given coref, a CorefScores, every assertion that reaches FILL also
+    gets added to it with its run and true equiv_ids.
     '''
-    cutoffs = range(0, 999, cutoff_step_size)
+    if overlap_criteria is None:
+        overlap_criteria = [(OVERLAP, make_criterion(DEFAULT_CRITERION))]
+    criteria = [criterion for mode, criterion in overlap_criteria]
+
+    num_TPs = dict((mode, 0) for mode in MODES)
 
     OVERLAP_TPs = dict()
 
@@ -342,94 +760,53 @@ def score_confusion_matrix_OVERLAP(CM, DOCS_TPs, annotation, positives,
         (stream_id, target_id, conf, rating, contains_mention, 
          date_hour, slot_type, runs_equiv_id, start_byte, end_byte) = rec
 
+        ## OVERLAP
         if positives[OVERLAP].get(target_id, 0) == 0:
             log('ignoring assertion on entity for which no OVERLAP positives are known: %s' % target_id)
             continue
 
-        start_byte = int(start_byte)
-        end_byte = int(end_byte)
-
-        for true_equiv_id, equiv_class in annotation[stream_id][target_id][slot_type].items():
-            offsets = equiv_class['stream_ids'][stream_id][1]
-            overlaps = False
-            for offset in offsets:
-                assert isinstance(offset[0], int)
-                assert isinstance(offset[1], int)
-
-                ## we could/should be much stricter here, 10x is a big window
-                true_len = offset[1] - offset[0]
-                runs_len = end_byte - start_byte
-                if start_byte <= offset[1] and end_byte >= offset[0] and runs_len < 10 * true_len:
-                    overlaps = True
-                    break
-
-            #log('(%d, %d) compared to offsets %r\n' % (start_byte, end_byte, offsets))
-
-            if not overlaps:
-                increment_CM(False, conf=conf, cutoffs=cutoffs, CM=CM, 
-                             mode=OVERLAP, 
-                             target_id=target_id, unannotated_is_TN=unannotated_is_TN)
-
-            #log('found one!!  system equiv_id (%r) --> assessors equiv_id (%r)'
-            #    % (runs_equiv_id, true_equiv_id))
-            rec = list(rec)
-            rec[7] = (runs_equiv_id, true_equiv_id)
-            rec = tuple(rec)
-
-            assertion_key = (stream_id, target_id, slot_type, start_byte, end_byte)
-            if assertion_key in OVERLAP_TPs:
-                other_row = OVERLAP_TPs[assertion_key]
-                if other_row[4] > conf:
-                    log('ignoring a duplicate row with lower conf: %d > %d'
-                        % (other_row[4], conf))
-                    continue
-
-            OVERLAP_TPs[assertion_key] = rec
-
-            increment_CM(True, conf=conf, cutoffs=cutoffs, CM=CM, 
-                         mode=OVERLAP, 
-                         target_id=target_id, unannotated_is_TN=unannotated_is_TN)
-
-    correct_FN(CM, OVERLAP, positives)
-
-    if OVERLAP_TPs:
-        assert CM[OVERLAP]
-
-    OVERLAP_TPs = OVERLAP_TPs.values()
-
-    return CM, OVERLAP_TPs
-
-
-def score_confusion_matrix_FILL(CM, OVERLAP_TPs, annotation, positives,
-                           unannotated_is_TN=False,
-                           cutoff_step_size=50, debug=False):
-    '''
-    construct FILL_TPs by excluding from OVERLAP_TPs those assertions
-    that either:
-
-       1) re-use an earlier (run)equiv_id that was not associated with
-       the same (truth)equiv_id from the truth set
-
-       1) fail to re-use an earlier (run)equiv_id that _was_
-       associated with a (truth)equiv_id from the truth set
-
-    '''
-    cutoffs = range(0, 999, cutoff_step_size)
+        true_equiv_id = None
+        for true_equiv_id, matches in annotation.overlapping_equiv_ids(
+                (stream_id, target_id, slot_type), start_byte, end_byte, criteria):
+            for (mode, criterion), overlaps in zip(overlap_criteria, matches):
+                if not overlaps:
+                    histograms[mode].add(target_id, conf, False)
+                    if drilldown:
+                        drilldown.add(mode, target_id, '%s %s %d-%d'
+                                      % (stream_id, slot_type, start_byte, end_byte), conf, False)
+
+                #log('found one!!  system equiv_id (%r) --> assessors equiv_id (%r)'
+                #    % (runs_equiv_id, true_equiv_id))
+                histograms[mode].add(target_id, conf, True)
+                if drilldown:
+                    drilldown.add(mode, target_id, '%s %s %d-%d'
+                                  % (stream_id, slot_type, start_byte, end_byte), conf, True,
+                                  truth='%s %s' % (stream_id, slot_type))
+
+        if true_equiv_id is None:
+            continue
+        num_TPs[OVERLAP] += 1
 
-    FILL_TPs = dict()
+        OVERLAP_TPs[(stream_id, target_id, slot_type, start_byte, end_byte)] = \
+            rec[:7] + ((runs_equiv_id, true_equiv_id),) + rec[8:]
 
     runs_to_true = dict()
     true_to_runs = dict()
 
-    log('considering %d unique FILL assertions' % len(OVERLAP_TPs))
-    for rec in OVERLAP_TPs:
-        (stream_id, target_id, conf, rating, contains_mention, date_hour, 
+    FILL_TPs = dict()
+
+    for rec in OVERLAP_TPs.values():
+        (stream_id, target_id, conf, rating, contains_mention, date_hour,
          slot_type, (runs_equiv_id, true_equiv_id), start_byte, end_byte) = rec
 
+        ## FILL
         if positives[FILL].get(target_id, 0) == 0:
             log('ignoring assertion on entity for which no FILL positives are known: %s' % target_id)
             continue
 
+        if coref:
+            coref.add(target_id, slot_type, runs_equiv_id, true_equiv_id, conf)
+
         ## this is a tri-state variable
         FILL_correct = None
 
@@ -455,75 +832,54 @@ def score_confusion_matrix_FILL(CM, OVERLAP_TPs, annotation, positives,
                 else:
                     FILL_correct = False
 
-        if FILL_correct in [True, None]:
-
-            assertion_key = (stream_id, target_id, slot_type, true_equiv_id)
-            if assertion_key in FILL_TPs:
-                other_row = FILL_TPs[assertion_key]
-                if other_row[4] > conf:
-                    log('ignoring a duplicate row with lower conf: %d > %d'
-                        % (other_row[4], conf))
-                    continue
-
-            FILL_TPs[assertion_key] = rec
-
-        increment_CM(FILL_correct, conf=conf, cutoffs=cutoffs, CM=CM, mode=FILL, 
-                     target_id=target_id, 
-                     unannotated_is_TN=unannotated_is_TN)
-
-    correct_FN(CM, FILL, positives)
-
-    FILL_TPs = FILL_TPs.values()
-
-    return CM, FILL_TPs
+        ## None, the first use of an equiv_id, passes on to DATE_HOUR
+        ## but counts as negative for FILL
+        histograms[FILL].add(target_id, conf, FILL_correct)
+        if drilldown:
+            drilldown.add(FILL, target_id, '%s %s %s' % (stream_id, slot_type, runs_equiv_id),
+                          conf, FILL_correct, truth='%s %s' % (stream_id, slot_type))
 
+        if FILL_correct is False:
+            continue
+        num_TPs[FILL] += 1
 
-def score_confusion_matrix_DATE_HOUR(CM, FILL_TPs, annotation, positives,
-                                cutoff_step_size=50, unannotated_is_TN=False,
-                                debug=False):
-    '''
-    construct DATE_HOUR_TPs by excluding from FILL_TPs those
-    assertions that happen after the first one
-    '''
-    cutoffs = range(0, 999, cutoff_step_size)
+        FILL_TPs[(stream_id, target_id, slot_type, true_equiv_id)] = rec
 
-    ## FILL_TPs are already in date_hour order, so we only have to
-    ## count the first one for each equiv_id
     seen = set()
-    DATE_HOUR_TPs = list()
 
-    log('considering %d unique DATE_HOUR assertions' % len(FILL_TPs))
-    for rec in FILL_TPs:
-        (stream_id, target_id, conf, rating, contains_mention, 
-         date_hour, slot_type, equiv_id, start_byte, end_byte) = rec
+    for rec in FILL_TPs.values():
+        (stream_id, target_id, conf, rating, contains_mention, date_hour,
+         slot_type, (runs_equiv_id, true_equiv_id), start_byte, end_byte) = rec
 
+        ## DATE_HOUR
         if positives[DATE_HOUR].get(target_id, 0) == 0:
             log('ignoring assertion on entity for which no DATE_HOUR positives are known: %s' % target_id)
             continue
 
-        if equiv_id in seen:
-            increment_CM(False, conf=conf, cutoffs=cutoffs, CM=CM, mode=DATE_HOUR, 
-                         target_id=target_id, 
-                         unannotated_is_TN=unannotated_is_TN)
-            continue
-
-        ## this way of filtering is inadequate -- should be giving
-        ## partial credit for finding slot fill late
+        ## this way of filtering gives no partial credit for finding
+        ## a slot fill late, which DATE_HOUR_LATENCY does
+        equiv_id = (runs_equiv_id, true_equiv_id)
+        is_first = equiv_id not in seen
         seen.add(equiv_id)
-        DATE_HOUR_TPs.append(rec)
 
-        increment_CM(True, conf=conf, cutoffs=cutoffs, CM=CM, mode=DATE_HOUR, 
-                     target_id=target_id, 
-                     unannotated_is_TN=unannotated_is_TN)
+        histograms[DATE_HOUR].add(target_id, conf, is_first)
+        if drilldown:
+            drilldown.add(DATE_HOUR, target_id, '%s %s %s' % (stream_id, slot_type, runs_equiv_id),
+                          conf, is_first, truth='%s %s' % (slot_type, true_equiv_id))
+
+        if date_hour_half_life:
+            if is_first:
+                histograms[DATE_HOUR_LATENCY].add_credit(
+                    target_id, conf, latency_credit(annotation, target_id, slot_type,
+                                                    true_equiv_id, date_hour,
+                                                    date_hour_half_life))
+            else:
+                histograms[DATE_HOUR_LATENCY].add(target_id, conf, False)
 
-        for cutoff in CM[DATE_HOUR][target_id]:
-            ## Then subtract the number of TP at each cutoffs 
-            ## (since FN+TP==True things in annotation set)
-            CM[DATE_HOUR][target_id][cutoff]['FN'] = \
-                positives[DATE_HOUR][target_id] - CM[DATE_HOUR][target_id][cutoff]['TP']
+        if is_first:
+            num_TPs[DATE_HOUR] += 1
 
-    log('considering %d DATE_HOUR_TPs' % len(DATE_HOUR_TPs))
-    return CM, DATE_HOUR_TPs
+    log('found %(OVERLAP)d OVERLAP, %(FILL)d FILL and %(DATE_HOUR)d DATE_HOUR TPs' % num_TPs)
 
 
 def make_description(args, mode):
@@ -532,11 +888,18 @@ def make_description(args, mode):
         entities = '-twitter-only'
     elif args.reject_twitter and not args.reject_wikipedia:
         entities = '-wikipedia-only'
+    elif args.group:
+        entities = '-' + args.group + '-only'
     else:
         assert not (args.reject_wikipedia and args.reject_twitter), \
             'cannot score with no entities'
         entities = '-all-entities'
 
+    if args.entity_type:
+        entity_type = '-' + args.entity_type
+    else:
+        entity_type = ''
+
     if args.slot_type:
         slot_type = '-' + args.slot_type
 
@@ -552,55 +915,73 @@ def make_description(args, mode):
             + '-' + mode \
             + pooled_only \
             + entities \
+            + entity_type \
             + slot_type \
             + '-cutoff-step-size-' \
             + str(args.cutoff_step_size)
 
     return description
 
-def ssf_runs(args):
+def write_docs_arena(annotation, path):
     '''
-    yield file handles for all of the SSF runs
+    write the (stream_id, target_id, slot_type) keys of the annotation
+    into an arena file, so that processes scoring runs can share one
+    memory-mapped copy of the DOCS lookups
+
+    :returns AnnotationArena: or None if the stream_ids cannot be packed
+    '''
+    ## keep the annotation's order, see write_arena
+    docs_keys = OrderedDict((assertion_key, True) for assertion_key in annotation)
+    if not docs_keys or not can_pack(docs_keys):
+        return None
+    return write_arena(docs_keys, path)
+
+def ssf_run_names(args, catalog=None):
+    '''
+    yield the file names of all of the SSF runs
+
+    :param catalog: from load_catalog for args.run_dir, if already loaded
     '''
 
     log( 'This assumes that all run file names end in .gz' )
-    run_count = 0
-    for run_file_name in os.listdir(args.run_dir):
-        if not run_file_name.endswith('.gz'):
-            log( 'ignoring: %s' % run_file_name )
-            continue
+    if catalog is None:
+        catalog = load_catalog(args.run_dir)
 
+    run_count = 0
+    for run_file_name, entry in sorted(catalog.items()):
         if args.run_name_filter and not run_file_name.startswith(args.run_name_filter):
             log( 'ignoring: %s' % run_file_name)
             continue
 
-        ## Open the run file    
-        run_file_path = os.path.join(args.run_dir, run_file_name)
-        if run_file_path.endswith('.gz'):
-            run_file_handle = gzip.open(run_file_path, 'r')
-        else:
-            run_file_handle =      open(run_file_path, 'r')
+        ## every run that SSF considers must have a JSON header
+        if entry['header'] is None:
+            sys.exit(entry['error'])
 
-        first_line = run_file_handle.readline()
-        assert first_line.startswith('#')
-        try:
-            filter_run = json.loads(first_line[1:])
-        except:
-            sys.exit('failed to get JSON out of: %r' % first_line[1:])
-        
         ### many CCR runs, including some from organizers have task_id
-        ### set to SSF :-(, so we must detect this.
-        ## read to first non-comment line
-        second_line = None
-        while not second_line:
-            second_line = run_file_handle.readline()
-            if second_line.strip().startswith('#'):
-                second_line = None
-
-        if 'NULL' in second_line or filter_run['task_id'] != 'kba-ssf-2013':
+        ### set to SSF :-(, so the catalog also checks that the first
+        ### row fills a slot
+        if entry['task'] != 'ssf' or entry['task_id'] != 'kba-ssf-2013':
             log( 'ignoring non-SSF run: %s' % run_file_name )
             continue
 
+        log( 'processing: %s' % run_file_name )
+        log( json.dumps(entry['header'], indent=4, sort_keys=True) )
+
+        yield run_file_name
+
+        #run_count += 1
+        #if run_count > 2:
+        #    break
+
+def ssf_runs(args, catalog=None, run_file_names=None):
+    '''
+    yield file handles for all of the SSF runs
+
+    :param run_file_names: from ssf_run_names, if already listed
+    '''
+    if run_file_names is None:
+        run_file_names = ssf_run_names(args, catalog)
+    for run_file_name in run_file_names:
         ## Open run file again now that we verified it is SSF
         run_file_path = os.path.join(args.run_dir, run_file_name)
         if run_file_path.endswith('.gz'):
@@ -608,17 +989,426 @@ def ssf_runs(args):
         else:
             run_file_handle =      open(run_file_path, 'r')
 
-        log( 'processing: %s' % run_file_name )
-        log( json.dumps(filter_run, indent=4, sort_keys=True) )
-
         yield run_file_name, run_file_handle
 
-        #run_count += 1
-        #if run_count > 2:
-        #    break
+def read_pooled_assertion_keys(args, catalog=None):
+    '''
+    :returns PoolIndex: (stream_id, target_id, slot_type) assertion
+    keys observed in at least one SSF run, along with the runs that
+    made each of them
+    '''
+    if catalog is None:
+        catalog = load_catalog(args.run_dir)
+    run_file_names = list(ssf_run_names(args, catalog))
+    return load_pool(args.run_dir, run_file_names, catalog, processes=args.pool_workers)
 
-if __name__ == '__main__':
-    start_time = time.time()
+def make_reject(args):
+    '''
+    construct the callable that rejects truth data for the entities
+    that args filter out
+    '''
+    accepted_target_ids = set()
+    if args.group or args.entity_type:
+        if not args.topics_path:
+            sys.exit('must specify --topics-path to use --group')
+        targets = json.load(open(args.topics_path))['targets']
+        for targ in targets:
+            if ('group' in targ and targ.get('group') == args.group) or targ['entity_type'] == args.entity_type:
+                accepted_target_ids.add(targ['target_id'])
+
+    def reject(target_id):
+        if args.reject_twitter and 'twitter.com' in target_id:
+            return True
+        if args.reject_wikipedia and 'wikipedia.org' in target_id:
+            return True
+        if args.group or args.entity_type:
+            if target_id not in accepted_target_ids:
+                return True  ## i.e. reject it
+        return False
+
+    return reject
+
+def load_run_annotation(args, reject, shared=None, catalog=None):
+    '''
+    load the annotation that every run gets scored against
+
+    :param shared: SharedInputs to get the truth data and the pooled
+    assertion keys from
+
+    :returns tuple: (annotation, positives) from load_annotation
+    '''
+    native_annotation = None
+    if shared:
+        native_annotation = shared.get('ssf-truth-json', args.annotation, read_truth_json)
+
+    ## stream_id --> target_id --> slot_type observed in at least one run
+    pooled_assertion_keys = set()
+    if args.pooled_only:
+        if shared:
+            pooled_assertion_keys = shared.get_for_sweep(
+                'ssf-pooled-assertion-keys', args.run_dir,
+                lambda run_dir, run_name_filter: read_pooled_assertion_keys(args, catalog),
+                args.run_name_filter)
+        else:
+            pooled_assertion_keys = read_pooled_assertion_keys(args, catalog)
+
+    ## Load in the annotation data
+    annotation, positives = load_annotation(
+        args.annotation, reject, 
+        slot_type_filter=args.slot_type,
+        pooled_only = args.pooled_only,
+        pooled_assertion_keys = pooled_assertion_keys,
+        native_annotation = native_annotation,
+        )
+
+    log_positives(positives)
+    exit_without_positives(args, positives)
+
+    return annotation, positives
+
+def log_positives(positives):
+    log('considering the following positives:\n%s' % json.dumps(positives, indent=4, sort_keys=True))
+    for mode in MODES:
+        log('considering the %d positives for %s' % (sum(positives[mode].values()), mode))
+
+def exit_without_positives(args, positives):
+    '''
+    exit, as ccr does, if the filters of args, e.g. a --facet with a
+    group that no target is in, leave no positives to score against
+    '''
+    if not sum(positives[DOCS].values()):
+        sys.exit('found no true positives given the filters of %s'
+                 % make_description(args, 'all-modes'))
+
+def facet_args(args):
+    '''
+    parse the --facet specs in args, like "slot-type=Affiliate" or
+    "reject-twitter,entity-type=PER"
+
+    :returns list: a copy of args for each facet, with the flags of the
+    facet set on top of the flags in args, leaving out facets that
+    repeat the scores of args or of an earlier facet
+    '''
+    facets = []
+    descriptions = set([make_description(args, 'all-modes')])
+    for spec in args.facet or []:
+        facet = copy.copy(args)
+        facet.facet = None
+        for flag in spec.split(','):
+            name, equals, value = flag.strip().partition('=')
+            if name not in FACET_FLAGS:
+                sys.exit('unknown flag %r in --facet %r, expected one of: %s'
+                         % (name, spec, ', '.join(sorted(FACET_FLAGS))))
+            dest, takes_value = FACET_FLAGS[name]
+            if takes_value != bool(equals):
+                sys.exit('flag %r in --facet %r %s a value'
+                         % (name, spec, takes_value and 'needs' or 'does not take'))
+            setattr(facet, dest, takes_value and value or True)
+        description = make_description(facet, 'all-modes')
+        if description in descriptions:
+            log('ignoring --facet %r, which repeats the scores of %s' % (spec, description))
+            continue
+        descriptions.add(description)
+        facets.append(facet)
+    return facets
+
+def load_facets(args, shared=None, catalog=None):
+    '''
+    load the annotation of each --facet in args
+
+    :param shared: SharedInputs, so that the truth data and the pooled
+    assertion keys get read once for all of the facets
+
+    :returns list: (args, annotation, positives) of each facet
+    '''
+    facets = []
+    for facet in facet_args(args):
+        annotation, positives = load_run_annotation(facet, make_reject(facet),
+                                                    shared=shared, catalog=catalog)
+        facets.append((facet, annotation, positives))
+    return facets
+
+def load_annotations(args, catalog=None):
+    '''
+    like load_run_annotation and load_facets together, but reads the
+    truth data file only once, filtering it for args and for each
+    --facet as it goes
+
+    :returns tuple: (annotation, positives, facets) where facets is
+    like from load_facets
+    '''
+    facets = facet_args(args)
+
+    pooled_assertion_keys = set()
+    if args.pooled_only:
+        pooled_assertion_keys = read_pooled_assertion_keys(args, catalog)
+
+    filters = [dict(reject=make_reject(facet), slot_type_filter=facet.slot_type,
+                    pooled_only=facet.pooled_only,
+                    pooled_assertion_keys=pooled_assertion_keys, earliest=dict())
+               for facet in [args] + facets]
+    streamed = stream_truth_json_filters(args.annotation, filters)
+
+    loaded = []
+    for facet, truth_filter in zip([args] + facets, filters):
+        ## drop each facet's skeleton once it is flattened
+        truth, positives = streamed.pop(0)
+        annotation, positives = load_annotation(
+            facet.annotation, truth_filter['reject'],
+            slot_type_filter=facet.slot_type,
+            pooled_only=facet.pooled_only,
+            pooled_assertion_keys=pooled_assertion_keys,
+            streamed_truth=(truth, positives, truth_filter['earliest']))
+        truth = truth_filter['earliest'] = None
+        log_positives(positives)
+        exit_without_positives(facet, positives)
+        loaded.append((facet, annotation, positives))
+
+    facet, annotation, positives = loaded[0]
+    return annotation, positives, loaded[1:]
+
+def add_drilldown_truth(drilldown, annotation, positives, CM):
+    '''
+    record the positives of each mode in drilldown, for listing the FNs
+    '''
+    for assertion_key in annotation:
+        stream_id, target_id, slot_type = assertion_key
+        for mode in CM:
+            if mode not in (DATE_HOUR, DATE_HOUR_LATENCY):
+                drilldown.add_truth(mode, target_id, '%s %s' % (stream_id, slot_type))
+        for equiv_id in annotation.fills(assertion_key):
+            drilldown.add_truth(DATE_HOUR, target_id, '%s %s' % (slot_type, equiv_id))
+    for mode in CM:
+        if mode == DATE_HOUR_LATENCY:
+            continue
+        num_positives = mode_positives(positives, mode)
+        drilldown.set_num_positives(mode, dict(
+                (target_id, num_positives.get(target_id, 0)) for target_id in CM[mode]))
+
+def process_ssf_run(args, run_file_name, run_file_handle, annotation, positives,
+                    writer=None, docs_arena=None, facets=(), target_orders=None):
+    '''
+    compute scores in all four modes and generate output files for a
+    single run
+
+    :param run_file_handle: iterable of the run's lines
+
+    :param writer: BackgroundWriter for the output files, or None to
+    write them before returning
+
+    :param docs_arena: AnnotationArena from write_docs_arena, or None
+    to look up DOCS matches in the annotation dict
+
+    :param facets: list of (args, annotation, positives) from
+    load_facets, to also score the run against in the same pass
+
+    :param target_orders: list that gets, for the run and then for
+    each facet, the mode --> target_ids of its max_scores in the order
+    that they were added, see pack_max_scores
+
+    :returns dict: mode --> max_scores for this one run, and given
+    facets, 'facets' --> list of the same for each facet
+    '''
+    memory = None
+    if args.memory_report or args.memory_budget:
+        memory = MemoryReport(run_file_name, args.memory_budget)
+        if docs_arena is not None:
+            memory.stage('load', annotation=annotation, positives=positives, docs_arena=docs_arena)
+        else:
+            memory.stage('load', annotation=annotation, positives=positives)
+
+    facets = [(args, annotation, positives, docs_arena)] \
+        + [(facet, facet_annotation, facet_positives, None)
+           for facet, facet_annotation, facet_positives in facets]
+
+    drilldowns = [args.drilldown and DrilldownRecorder('ssf', run_file_name) or None
+                  for facet in facets]
+    corefs = [args.fill_coref and CorefScores() or None for facet in facets]
+
+    ## Generate the confusion matrices for a run
+    CMs = score_facets(
+        run_file_handle,
+        [(facet_annotation, facet_positives, facet_docs_arena, drilldown, coref)
+         for (facet, facet_annotation, facet_positives, facet_docs_arena), drilldown, coref
+         in zip(facets, drilldowns, corefs)],
+        args.cutoff_step_size,
+        debug=args.debug,
+        spill_budget=args.out_of_core_mb and args.out_of_core_mb * 2**20,
+        run_file_path=os.path.join(args.run_dir, run_file_name),
+        parse_workers=args.parse_workers,
+        entity_index=args.entity_index,
+        memory=memory,
+        overlap_criteria=overlap_criteria(args),
+        date_hour_half_life=args.date_hour_half_life)
+
+    facet_max_scores = []
+    for (facet, facet_annotation, facet_positives, facet_docs_arena), drilldown, coref, CM \
+            in zip(facets, drilldowns, corefs, CMs):
+
+        if drilldown:
+            add_drilldown_truth(drilldown, facet_annotation, facet_positives, CM)
+            drilldown.write(os.path.join(
+                    args.run_dir,
+                    run_file_name + '-' + make_description(facet, 'all-modes') + '.drilldown'))
+
+        if coref:
+            coref_filepath = os.path.join(
+                facet.run_dir,
+                run_file_name + '-' + make_description(facet, FILL_COREF) + '.csv')
+            if writer:
+                writer.submit(write_coref_metrics, coref_filepath, coref.scores())
+            else:
+                write_coref_metrics(coref_filepath, coref.scores())
+
+        ## now we switch from calling it a confusion matrix to calling
+        ## it the general statistics matrix:
+        facet_target_orders = None
+        if target_orders is not None:
+            facet_target_orders = dict()
+            target_orders.append(facet_target_orders)
+        facet_max_scores.append(write_run_scores(facet, run_file_name, CM, writer,
+                                                 target_orders=facet_target_orders))
+
+    if memory:
+        memory.stage('metrics', stats=CMs)
+        memory.write(os.path.join(
+                args.run_dir,
+                run_file_name + '-' + make_description(args, 'all-modes') + '.memory.json'))
+
+    run_max_scores = facet_max_scores[0]
+    if len(facets) > 1:
+        run_max_scores['facets'] = facet_max_scores[1:]
+    return run_max_scores
+
+def output_paths(args, run_file_name, facets=()):
+    '''
+    :returns list: paths of the CSV and PNG files that process_ssf_run
+    writes for the run
+    '''
+    paths = []
+    for facet in [args] + [facet for facet, _, _ in facets]:
+        for mode in scored_modes(facet):
+            base_output_filepath = os.path.join(
+                facet.run_dir, run_file_name + '-' + make_description(facet, mode))
+            paths += [base_output_filepath + '.csv', base_output_filepath + '.png']
+        if facet.fill_coref:
+            paths.append(os.path.join(
+                    facet.run_dir,
+                    run_file_name + '-' + make_description(facet, FILL_COREF) + '.csv'))
+    return paths
+
+## what every process_ssf_run in a worker process of main scores
+## against, set by _init_run_worker when the pool forks the worker
+_worker_inputs = None
+
+def _init_run_worker(annotation, positives, docs_arena, facets):
+    global _worker_inputs
+    _worker_inputs = (annotation, positives, docs_arena, facets)
+
+def _process_ssf_run_job(job):
+    '''
+    process_ssf_run in a worker process of main
+
+    :returns tuple: (packed max_scores from pack_max_scores, paths of
+    the files written)
+    '''
+    args, run_file_name = job
+    annotation, positives, docs_arena, facets = _worker_inputs
+    target_orders = []
+    try:
+        run_file_handle = open_run(os.path.join(args.run_dir, run_file_name))
+        try:
+            run_max_scores = process_ssf_run(args, run_file_name, run_file_handle,
+                                             annotation, positives,
+                                             docs_arena=docs_arena, facets=facets,
+                                             target_orders=target_orders)
+        finally:
+            run_file_handle.close()
+    except Exception, exc:
+        ## the traceback does not survive the trip back to the parent
+        log('died on %s:\n%s' % (run_file_name, traceback.format_exc(exc)))
+        raise
+    return pack_max_scores(run_max_scores, target_orders), \
+        output_paths(args, run_file_name, facets)
+
+def pack_max_scores(run_max_scores, target_orders):
+    '''
+    :returns list: for the run and then each of its facets, mode -->
+    (target_id, scores) of its max_scores, in the order from
+    target_orders.  A dict that unpickles gets its keys in its old
+    iteration order rather than in the order they were added, which
+    can change the order that it iterates in, and so the order of the
+    rows in the target_id overviews.
+    '''
+    packed = []
+    for max_scores, orders in zip([run_max_scores] + run_max_scores.get('facets', []),
+                                  target_orders):
+        packed.append(dict((mode, [(target_id, max_scores[mode][target_id])
+                                   for target_id in orders[mode]])
+                           for mode in orders))
+    return packed
+
+def unpack_max_scores(packed):
+    '''
+    rebuild the max_scores of process_ssf_run from pack_max_scores
+    '''
+    facet_max_scores = []
+    for modes in packed:
+        max_scores = dict()
+        for mode, items in modes.iteritems():
+            max_scores[mode] = defaultdict(dict)
+            for target_id, scores in items:
+                max_scores[mode][target_id] = scores
+        facet_max_scores.append(max_scores)
+    run_max_scores = facet_max_scores[0]
+    if len(facet_max_scores) > 1:
+        run_max_scores['facets'] = facet_max_scores[1:]
+    return run_max_scores
+
+def write_run_scores(args, run_file_name, stats, writer=None, target_orders=None):
+    '''
+    compute the performance metrics of a run from its confusion
+    matrices, and write the CSV and PNG file of each mode
+
+    :param target_orders: dict that gets mode --> target_ids of its
+    max_scores in the order that they were added
+
+    :returns dict: mode --> max_scores
+    '''
+    run_max_scores = dict()
+    for mode in scored_modes(args):
+        
+        description = make_description(args, mode)
+
+        ## Generate performance metrics for a run
+        compile_and_average_performance_metrics(stats[mode])
+
+        run_max_scores[mode] = find_max_scores(stats[mode])
+        if target_orders is not None:
+            target_orders[mode] = list(stats[mode])
+
+        ## Output the key performance statistics
+        base_output_filepath = os.path.join(
+            args.run_dir, 
+            run_file_name + '-' + description)
+
+        output_filepath = base_output_filepath + '.csv'
+
+        ## Output a graph of the key performance statistics
+        graph_filepath = base_output_filepath + '.png'
+
+        if writer:
+            writer.submit(write_performance_metrics, output_filepath, stats[mode])
+            writer.submit(write_graph, graph_filepath, stats[mode])
+        else:
+            write_performance_metrics(output_filepath, stats[mode])
+            write_graph(graph_filepath, stats[mode])
+
+    log(json.dumps(stats, indent=4, sort_keys=True))
+
+    return run_max_scores
+
+def make_parser():
     parser = argparse.ArgumentParser(description=__doc__, usage=__usage__)
     parser.add_argument(
         'run_dir', 
@@ -636,112 +1426,211 @@ if __name__ == '__main__':
     parser.add_argument(
         '--pooled-only', default=False, action='store_true',
         help='limit scoring to truth data that at least one run found')
+    parser.add_argument(
+        '--pool-workers', default=None, type=int, metavar='N',
+        help='with --pooled-only, read the runs that are new to the pool index kept in <run_dir>/.ssf-pool in N processes; defaults to the number of CPUs')
     parser.add_argument(
         '--reject-twitter', default=False, action='store_true', 
         help='exclude twitter entities from the truth data')
     parser.add_argument(
         '--reject-wikipedia', default=False, action='store_true', 
         help='exclude twitter entities from the truth data')
+    parser.add_argument(
+        '--group', default=None,
+        help='limit entities to this group')
+    parser.add_argument(
+        '--entity-type', default=None,
+        help='limit entities to this entity-type')
+    parser.add_argument(
+        '--topics-path', default=None,
+        help='path to file containing JSON structure of query topics')
+    parser.add_argument(
+        '--facet', default=None, action='append', metavar='SPEC',
+        help='also score each run against the truth data of a facet, while reading the run only once.  SPEC is a comma-separated list of flags among slot-type=SLOT_TYPE, group=GROUP, entity-type=ENTITY_TYPE, reject-twitter and reject-wikipedia, which get set on top of the other flags, and the facet gets its own CSVs and overviews named by those flags.  Repeat for more facets.')
     parser.add_argument(
         '--debug', default=False, action='store_true', dest='debug',
         help='print out debugging diagnostics')
     parser.add_argument(
         '--run-name-filter', default=None,
         help='beginning of string of filename to filter runs that get considered')
-    args = parser.parse_args()
-
-    ## construct reject callable
-    def reject(target_id):
-        if args.reject_twitter and 'twitter.com' in target_id:
-            return True
-        if args.reject_wikipedia and 'wikipedia.org' in target_id:
-            return True
-        return False
-
-    ## stream_id --> target_id --> slot_type observed in at least one run
-    pooled_assertion_keys = set()
-    if args.pooled_only:
-        for run_file_name, run_file_handle in ssf_runs(args):
-            for assertion_key, row in assertions(run_file_handle):
-                pooled_assertion_keys.add(assertion_key)
-
-    ## Load in the annotation data
-    annotation, positives = load_annotation(
-        args.annotation, reject, 
-        slot_type_filter=args.slot_type,
-        pooled_only = args.pooled_only,
-        pooled_assertion_keys = pooled_assertion_keys,
-        )
+    parser.add_argument(
+        '--out-of-core-mb', default=None, type=int, metavar='MB',
+        help='partition each run by target_id into temporary spill files and de-duplicate each partition within MB megabytes of memory, for runs that are larger than RAM')
+    parser.add_argument(
+        '--parse-workers', default=None, type=int, metavar='N',
+        help='parse each run in N processes; needs BGZF runs or runs whose member index was built on an earlier read')
+    parser.add_argument(
+        '--entity-index', default=False, action='store_true',
+        help='keep a per-entity index next to each run, so that scorings of a subset of the entities only decompress the parts of the run that hold those entities')
+    parser.add_argument(
+        '--prefetch', default=False, action='store_true',
+        help='read the next run in a background thread while scoring the current one, and write output files from another thread')
+    parser.add_argument(
+        '--annotation-arena', default=False, action='store_true',
+        help='look up DOCS matches in a read-only memory-mapped arena that scoring processes can share instead of each holding the annotation dict')
+    parser.add_argument(
+        '--bundle-teams', default=False, action='store_true',
+        help='after scoring, package each team\'s CSV and PNG files into <team_id>.zip in the run_dir')
+    parser.add_argument(
+        '--memory-report', default=False, action='store_true',
+        help='record the peak RSS and the sizes of the annotation, run_set, DOCS TPs and confidence histograms after each stage of scoring a run, in <run>-<description>.memory.json next to its CSVs')
+    parser.add_argument(
+        '--memory-budget', default=None, type=int, metavar='MB',
+        help='warn when the process nears or passes MB megabytes of RSS; implies --memory-report')
+    parser.add_argument(
+        '--status-file', default=None, metavar='PATH',
+        help='keep the runs done, rows/sec, current run and ETA up to date in PATH, in Prometheus text format')
+    parser.add_argument(
+        '--status-port', default=None, type=int, metavar='PORT',
+        help='serve the same progress metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument(
+        '--run-workers', default=None, type=int, metavar='N',
+        help='score N runs at a time in separate processes, which share the annotation that the parent loaded; the overviews come out the same as when scoring one run at a time')
+    parser.add_argument(
+        '--overlap-criteria', default=None, metavar='LIST',
+        help='also score OVERLAP under each of a comma-separated list of criteria for matching byte ranges, in the same pass, as the modes OVERLAP-<criterion>: ratio-N for less than N times the length of the truth (OVERLAP uses ratio-10), jaccard-T for an intersection of at least T of the union, contains, and within')
+    parser.add_argument(
+        '--date-hour-half-life', default=None, type=float, metavar='HOURS',
+        help='also score the mode DATE_HOUR-latency, which gives the first assertion of each fill partial credit that halves for every HOURS hours that its date_hour comes after the earliest document that the assessors found for the fill, instead of the full credit of DATE_HOUR')
+    parser.add_argument(
+        '--fill-coref', default=False, action='store_true',
+        help='also score how the equiv_ids of the assertions that reach FILL group them, compared to the assessors\' equiv_ids, with B-cubed and pairwise precision and recall at each cutoff, in <run>-ssf-FILL-coref-....csv next to its CSVs')
+    parser.add_argument(
+        '--drilldown', default=False, action='store_true',
+        help='save the judged assertions of each run in each mode in <run>-<description>.drilldown next to its CSVs, for listing the TP/FP/FN of a target_id at a cutoff with python -m kba.scorer.drilldown')
+    return parser
 
-    log('considering the following positives:\n%s' % json.dumps(positives, indent=4, sort_keys=True))
-    for mode in MODES:
-        log('considering the %d positives for %s' % (sum(positives[mode].values()), mode))
-    
+def main(args, shared=None):
+    '''
+    score the SSF runs in args.run_dir, where args come from make_parser
 
-    ## mode --> team_id --> system_id --> score type
-    team_scores = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(dict))))
+    :param shared: SharedInputs holding the truth data, the pooled
+    assertion keys and run catalogs that earlier jobs in this process
+    already loaded, see kba.scorer.orchestrate
+    '''
+    start_time = time.time()
 
-    for run_file_name, run_file_handle in ssf_runs(args):
+    if args.date_hour_half_life is not None and args.date_hour_half_life <= 0:
+        sys.exit('--date-hour-half-life must be a positive number of hours')
 
-        ## Generate the confusion matrices for a run
-        CM, DOCS_TPs = score_confusion_matrix_DOCS(
-            run_file_handle,
-            annotation, 
-            positives,
-            args.cutoff_step_size, args.unan_is_true,
-            debug=args.debug)
+    ## construct reject callable
+    reject = make_reject(args)
 
-        CM, OVERLAP_TPs, = score_confusion_matrix_OVERLAP(
-            CM, DOCS_TPs, annotation, positives,
-            cutoff_step_size=50, debug=args.debug)
+    catalog = None
+    if shared:
+        catalog = shared.get_for_sweep('run-catalog', args.run_dir, load_catalog)
 
-        CM, FILL_TPs, = score_confusion_matrix_FILL(
-            CM, OVERLAP_TPs, annotation, positives,
-            cutoff_step_size=50, debug=args.debug)
+    if args.facet and not shared:
+        ## read the truth data and the pool once for all of the facets
+        annotation, positives, facets = load_annotations(args, catalog=catalog)
+    else:
+        annotation, positives = load_run_annotation(args, reject, shared=shared, catalog=catalog)
+        facets = load_facets(args, shared=shared, catalog=catalog)
+
+    docs_arena = None
+    if args.annotation_arena:
+        arena_dir = tempfile.mkdtemp(prefix='kba-arena-')
+        docs_arena = write_docs_arena(annotation, os.path.join(arena_dir, 'docs.arena'))
+        if docs_arena is None:
+            log('stream_ids in the annotation do not all look like <epoch>-<md5>, '
+                'so DOCS matches are looked up in the annotation dict')
+        else:
+            log('wrote DOCS arena of %d records' % len(docs_arena))
+
+    ## facet --> mode --> team_id --> system_id --> score type
+    team_scores = [defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(dict))))
+                   for _ in xrange(1 + len(facets))]
+
+    run_file_names = list(ssf_run_names(args, catalog))
+
+    pool = None
+    if args.run_workers > 1:
+        if args.parse_workers > 1:
+            log('ignoring --parse-workers, because --run-workers already runs several processes')
+            args.parse_workers = None
+        ## the workers fork with the annotation already loaded, so they
+        ## share its pages instead of each unpickling a copy
+        pool = multiprocessing.Pool(args.run_workers, initializer=_init_run_worker,
+                                    initargs=(annotation, positives, docs_arena, facets))
+        ## imap hands back the results in the order of run_file_names,
+        ## so team_scores and the overviews do not depend on which
+        ## worker finishes first
+        pooled_scores = pool.imap(_process_ssf_run_job,
+                                  [(args, run_file_name) for run_file_name in run_file_names],
+                                  chunksize=1)
+        runs = ((run_file_name, None) for run_file_name in run_file_names)
+        writer = None
+    elif args.prefetch and not (args.parse_workers > 1 or args.entity_index):
+        runs = ((os.path.basename(run_file_path), run_lines)
+                for run_file_path, run_lines in prefetch_runs(
+                    [os.path.join(args.run_dir, run_file_name)
+                     for run_file_name in run_file_names]))
+        writer = BackgroundWriter()
+    else:
+        runs = ssf_runs(args, catalog, run_file_names)
+        writer = None
+
+    progress = None
+    if args.status_file or args.status_port:
+        ## ssf_run_names already saved the catalog, if it was not shared
+        catalog = catalog or load_catalog(args.run_dir)
+        progress = Progress('ssf', make_description(args, 'all-modes'),
+                            dict((run_file_name, catalog[run_file_name]['num_rows'])
+                                 for run_file_name in run_file_names),
+                            status_file=args.status_file, status_port=args.status_port)
+
+    for run_file_name, run_file_handle in runs:
+        if progress:
+            progress.start_run(run_file_name)
+
+        if pool:
+            packed_scores, run_output_paths = pooled_scores.next()
+            run_max_scores = unpack_max_scores(packed_scores)
+            log('scored %s into %d files' % (run_file_name, len(run_output_paths)))
+        else:
+            run_max_scores = process_ssf_run(
+                args, run_file_name, run_file_handle, annotation, positives,
+                writer=writer, docs_arena=docs_arena, facets=facets)
 
-        CM, DATE_HOUR_TPs, = score_confusion_matrix_DATE_HOUR(
-            CM, FILL_TPs, annotation, positives,
-            cutoff_step_size=50, debug=args.debug)
+        if progress:
+            progress.finish_run()
 
         ## split into team name and create stats file
         team_id, system_id = run_file_name[:-3].split('-')
 
-        ## now we switch from calling it a confusion matrix to calling
-        ## it the general statistics matrix:
-        stats = CM
+        for facet_scores, max_scores in zip(team_scores,
+                                            [run_max_scores] + run_max_scores.get('facets', [])):
+            for mode in scored_modes(args):
+                facet_scores[mode][team_id][system_id] = max_scores[mode]
 
-        for mode in MODES:
-            
-            description = make_description(args, mode)
+    if writer:
+        writer.close()
 
-            ## Generate performance metrics for a run
-            compile_and_average_performance_metrics(stats[mode])
+    if progress:
+        progress.close()
 
-            max_scores = find_max_scores(stats[mode])
+    if pool:
+        pool.close()
+        pool.join()
 
-            team_scores[mode][team_id][system_id] = max_scores
+    if args.annotation_arena:
+        if docs_arena is not None:
+            docs_arena.close()
+        shutil.rmtree(arena_dir, ignore_errors=True)
 
-            ## Output the key performance statistics
-            base_output_filepath = os.path.join(
-                args.run_dir, 
-                run_file_name + '-' + description)
-
-            output_filepath = base_output_filepath + '.csv'
-
-            write_performance_metrics(output_filepath, stats[mode])
+    for facet, facet_scores in zip([args] + [facet for facet, _, _ in facets], team_scores):
+        for mode in scored_modes(args):
+            description = make_description(facet, mode)
 
-            ## Output a graph of the key performance statistics
-            graph_filepath = base_output_filepath + '.png'
-            write_graph(graph_filepath, stats[mode])
+            ## When folder is finished running output a high level summary of the scores to overview.csv
+            write_team_summary(description, facet_scores[mode])
 
-        log(json.dumps(stats, indent=4, sort_keys=True))
-
-    for mode in MODES:
-        description = make_description(args, mode)
-
-        ## When folder is finished running output a high level summary of the scores to overview.csv
-        write_team_summary(description, team_scores[mode])
+    if args.bundle_teams:
+        write_team_bundles(args.run_dir)
 
     elapsed = time.time() - start_time
     log('finished after %d seconds at at %r'
         % (elapsed, datetime.utcnow()))
+
+if __name__ == '__main__':
+    main(make_parser().parse_args())
@@ -13,8 +13,6 @@ from __future__ import absolute_import
 
 from collections import Counter as StringCounter
 from collections import defaultdict
-import csv
-import gzip
 import json
 import math
 import os
@@ -26,6 +24,10 @@ import yaml
 
 from streamcorpus import Chunk
 from kba.scorer2.metrics import get_metric_by_name, available_metrics
+from kba.scorer._runparser import iter_rows, open_run, sniff_run
+from kba.scorer._catalog import select_runs
+from kba.scorer._memory import MemoryReport
+from kba.scorer._progress import Progress
 
 def log(m):
     sys.stderr.write(m)
@@ -113,40 +115,36 @@ def profiles_from_runfile(runfile_path, offset_c_prepended = False,
                           decode_utf = False,
                           streamitems_dir = None,
                           max_lines = None,
+                          progress = None,
                           ):
 
     '''
     Returns a dictionary mappping from entity-name to ComparableProfile, where the
-    ComparableProfiles are constructed from a runfile.
+    ComparableProfiles are constructed from a runfile.  Use select_runs
+    to find the runfiles with task_id kba-ssf-2014; other runfiles get
+    None.  If given a Progress, counts the stream items fetched in it.
     '''
-    runfile = gzip.open(runfile_path, 'r')
-    filter_run = runfile.readline()
-    assert filter_run.startswith('#')
-    filter_run = json.loads(filter_run[1:])
+    filter_run, first_row = sniff_run(runfile_path)
     if filter_run['task_id'] != 'kba-ssf-2014':
         # do nothing
         return
 
     runfile_profiles = dict()
-    runfile_csv = csv.reader(runfile, delimiter='\t')
 
-    count = 1
-    for row in runfile_csv:
+    ## slot values can hold spaces, so split only on tabs.  In 2014
+    ## runs, the equiv_id column holds the slot value, and byte_range
+    ## can hold a list of them, which gets parsed below.
+    rows = iter_rows(open_run(runfile_path),
+                     ('stream_id', 'target_id', 'slot_type', 'equiv_id', 'byte_range'),
+                     delimiter='\t', converters=dict(byte_range=None))
 
-        #skip comments
-        if row[0].startswith('#'):
-            continue
+    count = 1
+    for stream_item, profile_name, slot_name, slot_value, offset_str in rows:
 
         if max_lines is not None and count > max_lines:
             break
 
         count += 1
-        #parse the row
-        stream_item = row[2]
-        profile_name = row[3]
-        slot_name = row[8]
-        slot_value = row[9]
-        offset_str = row[10]
 
         #initialize profile
         if profile_name not in runfile_profiles:
@@ -194,6 +192,9 @@ def profiles_from_runfile(runfile_path, offset_c_prepended = False,
 
         si = [si for si in c][0] #collect the single si in this chunk
 
+        if progress:
+            progress.add_stream_items()
+
         #are the offsets indexes in the decoded string or the undecoded string?
         if decode_utf:
             clean_visible = si.body.clean_visible.decode('utf-8')
@@ -295,6 +296,14 @@ if __name__ == '__main__':
     parser.add_argument('streamitems_dir', default='~/trec-kba-2014-ssf-stream-items')
     parser.add_argument('--metric', default='all')
     parser.add_argument('--max-lines', default=None, type=int)
+    parser.add_argument('--memory-report', default=False, action='store_true',
+                        help='record the peak RSS and the sizes of the truth and run profiles for each run, in <run>-profiles.memory.json in the runfile_dir')
+    parser.add_argument('--memory-budget', default=None, type=int, metavar='MB',
+                        help='warn when the process nears or passes MB megabytes of RSS; implies --memory-report')
+    parser.add_argument('--status-file', default=None, metavar='PATH',
+                        help='keep the runs done, rows/sec, stream items fetched, current run and ETA up to date in PATH, in Prometheus text format')
+    parser.add_argument('--status-port', default=None, type=int, metavar='PORT',
+                        help='serve the same progress metrics at http://127.0.0.1:PORT/metrics')
     args = parser.parse_args()
 
     #load truth-data
@@ -310,16 +319,39 @@ if __name__ == '__main__':
     
     #mapping from metric name to a mapping from runfile name to score
     metric_to_scores = defaultdict(dict)
-    for runfile in os.listdir(args.runfile_dir):
-        if not runfile.endswith('.gz'): continue
+    runs = select_runs(args.runfile_dir, task_id='kba-ssf-2014')
+
+    progress = None
+    if args.status_file or args.status_port:
+        progress = Progress('scorer2', 'ssf-2014',
+                            dict((runfile, entry['num_rows']) for runfile, entry in runs),
+                            status_file=args.status_file, status_port=args.status_port)
+
+    for runfile, entry in runs:
 
         runfile_config = get_config_by_name(runfile)
 
+        if progress:
+            progress.start_run(runfile)
+
+        memory = None
+        if args.memory_report or args.memory_budget:
+            memory = MemoryReport(runfile, args.memory_budget)
+            memory.stage('truth', truth_profiles=truth_profiles)
+
         runfile_profiles = profiles_from_runfile(os.path.join(args.runfile_dir, runfile), 
                                                  streamitems_dir=args.streamitems_dir,
                                                  max_lines = args.max_lines,
+                                                 progress = progress,
                                                  **runfile_config)
 
+        if progress:
+            progress.finish_run()
+
+        if memory:
+            memory.stage('profiles', runfile_profiles=runfile_profiles)
+            memory.write(os.path.join(args.runfile_dir, runfile[:-len('.gz')] + '-profiles.memory.json'))
+
         if not runfile_profiles:
             continue
 
@@ -332,6 +364,9 @@ if __name__ == '__main__':
         for metric_name, score in scores.items():
             metric_to_scores[metric_name][runfile] = score
 
+    if progress:
+        progress.close()
+
     #print out results
     for metric, scores in metric_to_scores.items():
         print '\n\nusing the {} metric:'.format(metric)
@@ -1,12 +1,10 @@
 '''
 run the CCR scorer on all the groups, including no restriction to a single group
 '''
-import os
 import sys
 import json
-import subprocess
-import multiprocessing
-from collections import defaultdict
+from kba.scorer.orchestrate import run_jobs
+from kba.scorer.jobqueue import publish
 targets = json.load(open('../../trec-kba-ccr-and-ssf-query-topics-2013-07-16.json'))['targets']
 groups = set()
 for targ in targets:
@@ -17,111 +15,58 @@ groups.sort()
 
 slot_types = ['Affiliate', 'TopMembers', 'FoundedBy', 'Contact_Meet_Entity', 'AssociateOf', 'Contact_Meet_PlaceTime', 'AwardsWon', 'DateOfDeath', 'CauseOfDeath', 'Titles', 'FounderOf', 'EmployeeOf', 'SignificantOther', 'Children']
 
-primary_commands = []
-commands = []
-ccr_template = "(python -m  kba.scorer.ccr %s --cutoff-step %d ../../2013-kba-runs/ ../../trec-kba-ccr-judgments-2013-09-26-expanded-with-ssf-inferred-vitals-plus-len-clean_visible-corrected.before-and-after-cutoff.filter-run.txt | gzip ) >& logs/2013-kba-runs-ccr-%s.log.gz"
+ccr_args = ['../../2013-kba-runs/', '../../trec-kba-ccr-judgments-2013-09-26-expanded-with-ssf-inferred-vitals-plus-len-clean_visible-corrected.before-and-after-cutoff.filter-run.txt']
 
-ssf_template = "(python -m  kba.scorer.ssf %s --cutoff-step %d ../../2013-kba-runs/ ../../trec-kba-ssf-target-events-2013-07-16-expanded-stream-ids.json | gzip ) &> logs/2013-kba-runs-ssf-%s.log.gz"
+ssf_args = ['../../2013-kba-runs/', '../../trec-kba-ssf-target-events-2013-07-16-expanded-stream-ids.json']
 
-avg_flag = ''
+topics_path = '../../trec-kba-ccr-and-ssf-query-topics-2013-07-16.json'
+
+jobs = []
+def add_job(scorer, name, flags, step_size):
+    if scorer == 'ccr':
+        args = flags + ['--cutoff-step', str(step_size)] + ccr_args
+    else:
+        args = flags + ['--cutoff-step-size', str(step_size)] + ssf_args
+    jobs.append(dict(name='2013-kba-runs-%s-%s' % (scorer, name), scorer=scorer, args=args))
+
+## the primary scores use every cutoff
+step_size = 1
+add_job('ssf', 'primary-pooled-only', ['--pooled-only'], step_size)
+add_job('ssf', 'primary', [], step_size)
+## ccr requires 4 positives by default, so a separate req-pos job
+## would score the same runs into the same files
+add_job('ccr', 'primary', [], step_size)
 
 step_size = 10
 for group in groups:
-    flags = avg_flag + ' --group %s --topics-path ../../trec-kba-ccr-and-ssf-query-topics-2013-07-16.json ' % group
-    log_name = avg_flag + '-' + group
-    cmd = ccr_template % (flags, step_size, log_name)
-    commands.append(cmd)
-    #print cmd
+    add_job('ccr', group, ['--group', group, '--topics-path', topics_path], step_size)
 
 for entity_type in ['PER', 'ORG', 'FAC']:
-    flags = avg_flag + ' --entity-type %s --topics-path ../../trec-kba-ccr-and-ssf-query-topics-2013-07-16.json ' % entity_type
-    log_name = avg_flag + '-' + entity_type
-    cmd = ccr_template % (flags, step_size, log_name)
-    commands.append(cmd)
-    #print cmd
+    add_job('ccr', entity_type, ['--entity-type', entity_type, '--topics-path', topics_path], step_size)
 
-for slot_type in slot_types:
-    flags = avg_flag + ' --slot-type ' + slot_type + ' '
-    log_name = avg_flag + '-' + slot_type
-    cmd = ssf_template % (flags, step_size, log_name)
-    commands.append(cmd)
-    #print cmd
+## one pass over each run scores SSF for every slot type and for each
+## kind of entity
+facets = ['slot-type=' + slot_type for slot_type in slot_types] \
+    + ['reject-wikipedia', 'reject-twitter']
+add_job('ssf', 'facets', sum([['--facet', facet] for facet in facets], []), step_size)
 
 for reject_flag in ['', '--reject-wikipedia', '--reject-twitter']:
-    flags = ' '.join([avg_flag, reject_flag])
-    log_name = '-'.join([avg_flag, reject_flag])
-    cmd = ssf_template % (flags, step_size, log_name)
-    if flags.strip():
-        ## only do cmds with at least one flag
-        commands.append(cmd)
-        #print cmd
-
     for rating_flag in ['', '--include-useful']:
-        flags = ' '.join([avg_flag, rating_flag, reject_flag])
-        log_name = '-'.join([avg_flag, rating_flag, reject_flag])
-        cmd = ccr_template % (flags, step_size, log_name)
-        if flags.strip():
-            ## only do cmds with at least one flag
-            commands.append(cmd)
-            #print cmd
-
-step_size = 1
-cmd = ccr_template % ('', step_size, 'primary')
-commands.insert(0, cmd)
-cmd = ccr_template % (' --require-positiv ', step_size, 'primary-req-pos')
-commands.insert(0, cmd)
-cmd = ssf_template % ('', step_size, 'primary')
-commands.insert(0, cmd)
-cmd = ssf_template % (' --pooled-only ', step_size, 'primary-pooled-only')
-commands.insert(0, cmd)
+        flags = [flag for flag in [rating_flag, reject_flag] if flag]
+        if flags:
+            ## only do jobs with at least one flag
+            add_job('ccr', '-'.join(flag[2:] for flag in flags), flags, step_size)
 
-print len(commands), 'tasks to do'
+print len(jobs), 'tasks to do'
 
 sys.stdout.flush()
 
-def run(cmd):
-    print cmd
-    sys.stdout.flush()
-    p = subprocess.Popen(cmd, shell=True, executable="/bin/bash")
-    p.wait()
-
-#sys.exit()
-
-#pool = multiprocessing.Pool(3, maxtasksperchild=1)
-#pool.map(run, primary_commands)
-#pool.close()
-#pool.join()
-
-pool = multiprocessing.Pool(8, maxtasksperchild=1)
-pool.map(run, commands)
-pool.close()
-pool.join()
-
-'''
-ips = open('good-ips').read().splitlines()
-
-base_cmd = "cd /data/trec-kba/users/jrf/KBA/2013/entities/score/src && ("
-
-assignments = defaultdict(set)
-i = 0
-while commands:
-    i += 1
-    assignments[ips[i % len(ips)]].add(commands.pop())
-
-counts = defaultdict(int)
-for ip in ips:
-    counts[len(assignments[ip])] += 1
-
-print counts
-
-remote_cmds = dict()
-for ip in ips:
-    remote_cmds[ip] = base_cmd + ') && ('.join(list(assignments[ip])) + ')'
-
-#print '\n'.join(map(str, remote_cmds.items()))
-
-for ip, remote_cmd in remote_cmds.items():
-    cmd = 'ssh %s "echo \\"%s\\" > jobs.sh; chmod a+x jobs.sh" &' % (ip, remote_cmd)
-    print cmd
-    os.system(cmd)
-'''
+if len(sys.argv) > 1:
+    ## publish the sweep to a job queue in this directory on a shared
+    ## filesystem, for workers on any number of machines:
+    ##   python -m kba.scorer.jobqueue work QUEUE_DIR
+    ##   python -m kba.scorer.jobqueue coordinate QUEUE_DIR
+    publish(sys.argv[1], jobs)
+else:
+    ## the checkpoint lets an interrupted sweep pick up where it stopped
+    run_jobs(jobs, processes=8, checkpoint_path='logs/2013-kba-runs.checkpoint', log_dir='logs')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+## test this source tree, whether or not kba.scorer is installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,269 @@
+'''
+tiny synthetic runs and truth data for comparing the scorers' output
+with the output of the baseline scorers, which is kept in golden/, and
+for comparing the faster ways of scoring with the plain serial ones
+
+To write golden/ again from some other tree of the scorers:
+
+    PYTHONPATH=src python src/tests/kba/scorer/conftest.py /path/to/other/src
+
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from kba.scorer._bgzf import write_bgzf
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+## name --> (scorer, args, only keep the overviews) of the scorings
+## kept in golden/, of which the variants only keep their overviews
+## to keep golden/ small
+GOLDEN_SCORINGS = dict([
+    ('ccr', ('ccr', [], False)),
+    ('ssf', ('ssf', [], False)),
+    ('ssf-pooled-only', ('ssf', ['--pooled-only'], True)),
+    ('ssf-Affiliate', ('ssf', ['--slot-type', 'Affiliate'], True)),
+])
+
+SLOT_TYPES = ['Affiliate', 'TopMembers', 'FoundedBy', 'Titles']
+
+def make_stream_id(rand, epoch):
+    return '%d-%032x' % (epoch, rand.getrandbits(128))
+
+def make_target_ids(num):
+    return ['http://en.wikipedia.org/wiki/Entity_%d' % idx for idx in range(num)]
+
+def run_header(team_id, system_id, task_id):
+    return '#' + json.dumps(dict(team_id=team_id, system_id=system_id, task_id=task_id,
+                                 poc_name='POC %s' % team_id,
+                                 poc_email='%s@example.com' % team_id)) + '\n'
+
+def run_line(team_id, system_id, stream_id, target_id, conf, rating=2, contains_mention=1,
+             date_hour='2011-10-07-14', slot_type='NULL', equiv_id='-1', byte_range='0-0'):
+    return '\t'.join([team_id, system_id, stream_id, target_id, str(conf), str(rating),
+                      str(contains_mention), date_hour, slot_type, equiv_id, byte_range]) + '\n'
+
+def write_run(path, lines):
+    '''
+    write a run as BGZF, so that --parse-workers can split it
+    '''
+    write_bgzf(lines, path)
+
+def make_ssf_data(data_dir):
+    '''
+    write two SSF runs and one CCR run into data_dir/runs, and the
+    truth data that they get scored against
+
+    :returns tuple: (run_dir, path to the truth JSON)
+    '''
+    rand = random.Random(11)
+    truth = dict()
+    docs = []
+    for target_id in make_target_ids(6):
+        truth[target_id] = dict()
+        for slot_type in rand.sample(SLOT_TYPES, 3):
+            fills = truth[target_id][slot_type] = dict()
+            for equiv_num in range(rand.randint(1, 3)):
+                stream_ids = dict()
+                for doc_num in range(rand.randint(1, 5)):
+                    epoch = 1317000000 + rand.randint(0, 3600 * 500)
+                    stream_id = make_stream_id(rand, epoch)
+                    byte_ranges = []
+                    for range_num in range(rand.randint(1, 2)):
+                        start = rand.randint(0, 2000)
+                        byte_ranges.append([start, start + rand.randint(1, 40)])
+                    date_hour = time.strftime('%Y-%m-%d-%H', time.gmtime(epoch))
+                    stream_ids[stream_id] = [date_hour, byte_ranges]
+                    docs.append((stream_id, target_id, slot_type, 'eq%d' % equiv_num,
+                                 date_hour, byte_ranges))
+                fills['eq%d' % equiv_num] = dict(stream_ids=stream_ids, fill='x')
+    truth_path = os.path.join(data_dir, 'ssf-truth.json')
+    json.dump(truth, open(truth_path, 'w'))
+
+    run_dir = os.path.join(data_dir, 'runs')
+    os.makedirs(run_dir)
+    for team_id, system_id in [('teamA', 'ssf1'), ('teamB', 'ssf2')]:
+        rows = []
+        ## enough rows for a few BGZF blocks
+        for repeat in range(12):
+            for stream_id, target_id, slot_type, equiv_id, date_hour, byte_ranges in docs:
+                if rand.random() < 0.5:
+                    continue
+                start, end = rand.choice(byte_ranges)
+                rows.append((stream_id, target_id, rand.randint(1, 1000), date_hour,
+                             rand.choice(SLOT_TYPES + [slot_type] * 4),
+                             rand.choice(['r' + equiv_id, 'r' + equiv_id, 'rX%d' % rand.randint(0, 2)]),
+                             '%d-%d' % (max(start + rand.randint(-5, 5), 0),
+                                        end + rand.randint(-5, 60))))
+        for stream_id, target_id, slot_type, equiv_id, date_hour, byte_ranges in docs[:20]:
+            rows.append((make_stream_id(rand, int(stream_id.split('-')[0])), target_id,
+                         rand.randint(1, 1000), date_hour, slot_type, 'rZ', '10-20'))
+        rows.sort(key=lambda row: int(row[0].split('-')[0]))
+        write_run(os.path.join(run_dir, '%s-%s.gz' % (team_id, system_id)),
+                  [run_header(team_id, system_id, 'kba-ssf-2013')] +
+                  [run_line(team_id, system_id, stream_id, target_id, conf,
+                            date_hour=date_hour, slot_type=slot_type, equiv_id=equiv_id,
+                            byte_range=byte_range)
+                   for stream_id, target_id, conf, date_hour, slot_type, equiv_id, byte_range in rows])
+
+    ## a CCR run among the SSF runs, which ssf has to skip
+    write_run(os.path.join(run_dir, 'teamC-sys3.gz'),
+              [run_header('teamC', 'sys3', 'kba-ccr-2013')] +
+              [run_line('teamC', 'sys3', doc[0], doc[1], 500) for doc in docs[:10]])
+    return run_dir, truth_path
+
+def make_ccr_data(data_dir):
+    '''
+    write three CCR runs in stream order into data_dir/runs, and the
+    judgments that they get scored against
+
+    :returns tuple: (run_dir, path to the truth data)
+    '''
+    rand = random.Random(13)
+    judgments = []
+    for target_id in make_target_ids(8):
+        for doc_num in range(40):
+            epoch = 1317000000 + rand.randint(0, 3600 * 500)
+            judgments.append((make_stream_id(rand, epoch), target_id, rand.choice([-1, 0, 1, 2, 2])))
+    judgments.sort(key=lambda judgment: int(judgment[0].split('-')[0]))
+    truth_path = os.path.join(data_dir, 'ccr-truth.txt')
+    truth_file = open(truth_path, 'w')
+    truth_file.write(run_header('kba.trec.nist.gov', 'annotators', 'kba-ccr-2013'))
+    for stream_id, target_id, rating in judgments:
+        truth_file.write(run_line('kba.trec.nist.gov', 'a1', stream_id, target_id, 1000, rating))
+    truth_file.close()
+
+    run_dir = os.path.join(data_dir, 'runs')
+    os.makedirs(run_dir)
+    for team_id, system_id in [('teamA', 'sys1'), ('teamB', 'sys2'), ('teamC', 'sys3')]:
+        rows = []
+        for repeat in range(6):
+            for stream_id, target_id, rating in judgments:
+                if rand.random() < 0.4:
+                    rows.append((stream_id, target_id, rand.randint(1, 1000),
+                                 rand.choice([0, 1, 2, 2])))
+            ## and some unjudged documents
+            for doc_num in range(50):
+                stream_id, target_id, rating = rand.choice(judgments)
+                rows.append((make_stream_id(rand, int(stream_id.split('-')[0])), target_id,
+                             rand.randint(1, 1000), 2))
+        rows.sort(key=lambda row: int(row[0].split('-')[0]))
+        write_run(os.path.join(run_dir, '%s-%s.gz' % (team_id, system_id)),
+                  [run_header(team_id, system_id, 'kba-ccr-2013')] +
+                  [run_line(team_id, system_id, stream_id, target_id, conf, rating)
+                   for stream_id, target_id, conf, rating in rows])
+    return run_dir, truth_path
+
+@pytest.fixture
+def ssf_data(tmpdir):
+    '''
+    :returns tuple: (run_dir, path to the truth JSON) of two SSF runs
+    and one CCR run
+    '''
+    return make_ssf_data(str(tmpdir.mkdir('ssf-data')))
+
+@pytest.fixture
+def ccr_data(tmpdir):
+    '''
+    :returns tuple: (run_dir, path to the truth data) of three CCR runs
+    in stream order
+    '''
+    return make_ccr_data(str(tmpdir.mkdir('ccr-data')))
+
+def run_scorer(scorer, run_dir, truth_path, out_dir, args=(), src_dir=SRC_DIR):
+    '''
+    score a copy of run_dir with ``python -m kba.scorer.<scorer>`` from
+    src_dir, in out_dir, logging to out_dir/log
+
+    :returns tuple: (run_dir, out_dir) holding what the scorer wrote
+    '''
+    runs_copy = os.path.join(out_dir, 'runs')
+    shutil.copytree(run_dir, runs_copy)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = src_dir
+    log_file = open(os.path.join(out_dir, 'log'), 'w')
+    try:
+        subprocess.check_call(
+            [sys.executable, '-m', 'kba.scorer.%s' % scorer, runs_copy, truth_path] + list(args),
+            cwd=out_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    finally:
+        log_file.close()
+    return runs_copy, out_dir
+
+@pytest.fixture
+def score(tmpdir):
+    '''
+    :returns callable: (scorer, run_dir, truth_path, name, args) -->
+    (run_dir, out_dir) of a scoring in tmpdir/name, see run_scorer
+    '''
+    def score(scorer, run_dir, truth_path, name, args=()):
+        return run_scorer(scorer, run_dir, truth_path, str(tmpdir.mkdir(name)), args)
+    return score
+
+def _read_outputs(run_dir, out_dir, overviews_only=False):
+    outputs = dict()
+    dir_paths = [os.path.join(out_dir, 'overviews')]
+    if not overviews_only:
+        dir_paths.append(run_dir)
+    for dir_path in dir_paths:
+        for fname in os.listdir(dir_path):
+            if fname.endswith('.csv'):
+                outputs[fname] = open(os.path.join(dir_path, fname)).read()
+    return outputs
+
+def _read_golden(name):
+    golden_dir = os.path.join(GOLDEN_DIR, name)
+    return dict((fname, open(os.path.join(golden_dir, fname)).read())
+                for fname in os.listdir(golden_dir))
+
+@pytest.fixture
+def read_outputs():
+    '''
+    :returns callable: (run_dir, out_dir, overviews_only=False) -->
+    dict of file name --> contents of the CSVs that a scorer wrote
+    next to the runs and into out_dir/overviews
+    '''
+    return _read_outputs
+
+@pytest.fixture
+def golden():
+    '''
+    :returns callable: name --> dict like read_outputs of what the
+    baseline scorer wrote for make_<scorer>_data in the GOLDEN_SCORINGS
+    of that name
+    '''
+    return _read_golden
+
+def write_golden(src_dir, tmp_dir):
+    make_data = dict(ccr=make_ccr_data, ssf=make_ssf_data)
+    for name, (scorer, args, overviews_only) in GOLDEN_SCORINGS.items():
+        data_dir = os.path.join(tmp_dir, name)
+        out_dir = os.path.join(tmp_dir, name + '-out')
+        os.makedirs(data_dir)
+        os.makedirs(out_dir)
+        run_dir, truth_path = make_data[scorer](data_dir)
+        outputs = _read_outputs(*run_scorer(scorer, run_dir, truth_path, out_dir, args,
+                                            src_dir=src_dir),
+                                overviews_only=overviews_only)
+        golden_dir = os.path.join(GOLDEN_DIR, name)
+        if os.path.exists(golden_dir):
+            shutil.rmtree(golden_dir)
+        os.makedirs(golden_dir)
+        for fname, contents in outputs.items():
+            open(os.path.join(golden_dir, fname), 'w').write(contents)
+
+if __name__ == '__main__':
+    import tempfile
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        write_golden(os.path.abspath(sys.argv[1]), tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,67 @@
+import pickle
+import random
+
+import pytest
+
+from kba.scorer._arena import write_arena, can_pack, KEY_SIZE, RECORD_SIZE, BLOCK_RECORDS
+
+def make_annotation(key_len, num_keys=500, seed=7):
+    rand = random.Random(seed)
+    annotation = dict()
+    while len(annotation) < num_keys:
+        key = ('%d-%032x' % (1317000000 + rand.randint(0, 1000), rand.getrandbits(128)),
+               'http://en.wikipedia.org/wiki/Entity_%d' % rand.randint(0, 9))
+        if key_len == 3:
+            key += (rand.choice(['Affiliate', 'Titles', 'FoundedBy']),)
+        annotation[key] = rand.choice([True, False])
+    return annotation
+
+def missing_keys(annotation):
+    for key in annotation:
+        yield (key[0][:-1] + 'f',) + key[1:]
+        yield (key[0], 'http://en.wikipedia.org/wiki/Other') + key[2:]
+        yield ('not-a-stream-id',) + key[1:]
+
+@pytest.mark.parametrize('key_len', [2, 3])
+def test_arena_like_the_dict(tmpdir, key_len):
+    annotation = make_annotation(key_len)
+    assert can_pack(annotation)
+    arena = write_arena(annotation, str(tmpdir.join('annotation.arena')))
+    assert len(arena) == len(annotation)
+    for key, label in annotation.items():
+        assert arena.get(key) == label
+        assert arena[key] == label
+    for key in missing_keys(annotation):
+        if key not in annotation:
+            assert arena.get(key) is None
+            assert key not in arena
+    assert sorted(arena.items()) == sorted((key, int(label)) for key, label in annotation.items())
+
+    num_positives = dict()
+    for key, label in annotation.items():
+        num_positives[key[1]] = num_positives.get(key[1], 0) + int(label)
+    assert arena.num_positives() == num_positives
+
+    ## workers get the path and map the same file
+    attached = pickle.loads(pickle.dumps(arena))
+    assert attached.items() == arena.items()
+
+def test_lookups_across_blocks(tmpdir):
+    ## several blocks and a partial last one
+    annotation = make_annotation(3, num_keys=BLOCK_RECORDS * 5 + 7)
+    arena = write_arena(annotation, str(tmpdir.join('annotation.arena')))
+    for key, label in annotation.items():
+        assert arena.get(key) == label
+    target_id, slot_type = annotation.keys()[0][1:]
+    ## before the first key and after the last one
+    for epoch in [0, 2**32 - 1]:
+        assert arena.get(('%d-%032x' % (epoch, 0), target_id, slot_type)) is None
+    ## bytes that match across the end of one record and the start of
+    ## the next are not a key
+    records = arena._mm[arena._offset:arena._offset + 2 * RECORD_SIZE]
+    assert arena._find(records[1:1 + KEY_SIZE]) is None
+    assert arena._find(records[RECORD_SIZE:RECORD_SIZE + KEY_SIZE]) is not None
+
+def test_can_pack():
+    assert not can_pack({('1317000000-abc', 'a'): True})
+    assert not can_pack({('x-%032x' % 1, 'a'): True})
@@ -0,0 +1,74 @@
+import os
+import time
+import zipfile
+
+from kba.scorer._bundles import write_team_bundles, bundle_team, team_points_of_contact
+
+def archived(zip_fpath):
+    fh = zipfile.ZipFile(zip_fpath)
+    members = dict((name, fh.read(name)) for name in fh.namelist())
+    fh.close()
+    return members
+
+def touch(fpath, contents, mtime):
+    open(fpath, 'w').write(contents)
+    os.utime(fpath, (mtime, mtime))
+
+def test_bundles_hold_the_score_files(ccr_data, score, read_outputs):
+    run_dir, truth_path = ccr_data
+    runs_copy, out_dir = score('ccr', run_dir, truth_path, 'bundled', ['--bundle-teams'])
+    outputs = read_outputs(runs_copy, out_dir)
+    for team_id in ['teamA', 'teamB', 'teamC']:
+        members = archived(os.path.join(runs_copy, '%s.zip' % team_id))
+        assert members
+        for fname, contents in members.items():
+            assert fname.startswith(team_id + '-')
+            assert outputs[fname] == contents
+    assert team_points_of_contact(runs_copy)['teamA'] == set(['POC teamA <teamA@example.com>'])
+
+def test_only_changed_files_get_compressed_again(tmpdir):
+    run_dir = str(tmpdir)
+    mtime = time.time() - 3600
+    for fname in ['teamA-1.csv', 'teamA-2.csv', 'teamA-3.png']:
+        touch(os.path.join(run_dir, fname), fname * 100, mtime)
+    zip_fpath = os.path.join(run_dir, 'teamA.zip')
+    fnames = ['teamA-1.csv', 'teamA-2.csv', 'teamA-3.png']
+    assert bundle_team(zip_fpath, run_dir, fnames) == 3
+    assert bundle_team(zip_fpath, run_dir, fnames) == 0
+
+    touch(os.path.join(run_dir, 'teamA-2.csv'), 'changed', mtime + 10)
+    touch(os.path.join(run_dir, 'teamA-4.csv'), 'new', mtime)
+    assert bundle_team(zip_fpath, run_dir, fnames[1:] + ['teamA-4.csv']) == 2
+    assert archived(zip_fpath) == {
+        'teamA-2.csv': 'changed', 'teamA-3.png': 'teamA-3.png' * 100, 'teamA-4.csv': 'new'}
+    assert zipfile.ZipFile(zip_fpath).getinfo('teamA-3.png').compress_type == zipfile.ZIP_STORED
+
+def test_write_team_bundles(tmpdir):
+    run_dir = str(tmpdir)
+    for fname in ['teamA-1.csv', 'teamB-1.csv', 'teamB-2.png', 'notes.txt']:
+        touch(os.path.join(run_dir, fname), fname, time.time() - 3600)
+    assert write_team_bundles(run_dir, processes=2) == dict(teamA=1, teamB=2)
+    assert sorted(archived(os.path.join(run_dir, 'teamB.zip'))) == ['teamB-1.csv', 'teamB-2.png']
+    assert write_team_bundles(run_dir, processes=1) == dict(teamA=0, teamB=0)
+
+def test_stale_and_corrupt_bundles(tmpdir):
+    run_dir = str(tmpdir)
+    mtime = time.time() - 3600
+    for fname in ['teamA-1.csv', 'teamB-1.csv']:
+        touch(os.path.join(run_dir, fname), fname, mtime)
+    assert write_team_bundles(run_dir, processes=1) == dict(teamA=1, teamB=1)
+
+    ## teamB has no score files left, and some other zip is not a bundle
+    os.remove(os.path.join(run_dir, 'teamB-1.csv'))
+    other = zipfile.ZipFile(os.path.join(run_dir, 'runs.zip'), 'w')
+    other.writestr('teamA-sys1.gz', 'not a score file')
+    other.close()
+    ## and the bundle of teamA got cut short
+    open(os.path.join(run_dir, 'teamA.zip'), 'w').write('PK\x03\x04')
+    touch(os.path.join(run_dir, 'teamA-2.csv'), 'new', mtime)
+
+    assert write_team_bundles(run_dir, processes=1) == dict(teamA=2)
+    assert sorted(fname for fname in os.listdir(run_dir) if fname.endswith(('.zip', '.tmp'))) == \
+        ['runs.zip', 'teamA.zip']
+    assert archived(os.path.join(run_dir, 'teamA.zip')) == {
+        'teamA-1.csv': 'teamA-1.csv', 'teamA-2.csv': 'new'}
@@ -0,0 +1,56 @@
+import os
+import gzip
+import json
+
+from kba.scorer import _catalog
+from kba.scorer._catalog import load_catalog, select_runs, CATALOG_NAME
+
+def write_run(path, lines):
+    run_file = gzip.open(path, 'wb')
+    run_file.writelines(lines)
+    run_file.close()
+
+def make_runs(run_dir):
+    header = '#' + json.dumps(dict(team_id='teamA', system_id='ssf1', task_id='kba-ssf-2013')) + '\n'
+    row = 'teamA\tssf1\t1317000000-%s\thttp://a\t500\t2\t1\t2011-10-07-14\t%s\tr1\t10-20\n'
+    write_run(os.path.join(run_dir, 'teamA-ssf1.gz'), [header, row % ('0' * 32, 'Titles')])
+    ## a CCR run that claims to be SSF, like some organizer runs did
+    write_run(os.path.join(run_dir, 'teamB-sys2.gz'),
+              [header.replace('ssf1', 'sys2'), row % ('1' * 32, 'NULL'), row % ('2' * 32, 'NULL')])
+    write_run(os.path.join(run_dir, 'teamC-sys3.gz'), [row % ('3' * 32, 'NULL')])
+
+def test_entries(tmpdir):
+    run_dir = str(tmpdir)
+    make_runs(run_dir)
+    catalog = load_catalog(run_dir)
+    assert sorted(catalog) == ['teamA-ssf1.gz', 'teamB-sys2.gz', 'teamC-sys3.gz']
+    assert catalog['teamA-ssf1.gz']['task'] == 'ssf'
+    assert catalog['teamB-sys2.gz']['task'] == 'ccr'
+    assert catalog['teamB-sys2.gz']['num_rows'] == 2
+    ## a run without a header gets cataloged rather than stopping the scorers
+    assert catalog['teamC-sys3.gz']['header'] is None
+    assert catalog['teamC-sys3.gz']['error']
+    assert [fname for fname, entry in select_runs(run_dir, task='ccr', catalog=catalog)] == \
+        ['teamB-sys2.gz']
+    assert [fname for fname, entry in select_runs(run_dir, catalog=catalog)] == sorted(catalog)
+
+def test_only_changed_runs_get_read_again(tmpdir, monkeypatch):
+    run_dir = str(tmpdir)
+    make_runs(run_dir)
+    catalog = load_catalog(run_dir)
+    assert os.path.exists(os.path.join(run_dir, CATALOG_NAME))
+
+    read = []
+    catalog_entry = _catalog._catalog_entry
+    def recording_catalog_entry(path_to_run_file, st):
+        read.append(os.path.basename(path_to_run_file))
+        return catalog_entry(path_to_run_file, st)
+    monkeypatch.setattr(_catalog, '_catalog_entry', recording_catalog_entry)
+
+    assert load_catalog(run_dir) == catalog
+    assert read == []
+    path = os.path.join(run_dir, 'teamA-ssf1.gz')
+    os.utime(path, (1, 1))
+    os.remove(os.path.join(run_dir, 'teamB-sys2.gz'))
+    assert sorted(load_catalog(run_dir)) == ['teamA-ssf1.gz', 'teamC-sys3.gz']
+    assert read == ['teamA-ssf1.gz']
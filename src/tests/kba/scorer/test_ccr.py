@@ -0,0 +1,51 @@
+import os
+import gzip
+
+import pytest
+
+def test_same_scores_as_baseline(ccr_data, score, read_outputs, golden):
+    run_dir, truth_path = ccr_data
+    assert read_outputs(*score('ccr', run_dir, truth_path, 'default')) == golden('ccr')
+
+@pytest.mark.parametrize('flags', [
+    ['--out-of-core-mb', '1'],
+    ['--parse-workers', '2'],
+    ['--entity-index'],
+    ['--prefetch'],
+    ['--run-workers', '2'],
+    ['--run-workers', '3'],
+    ['--sorted-merge'],
+])
+def test_faster_scorings_same_as_baseline(ccr_data, score, read_outputs, golden, flags):
+    run_dir, truth_path = ccr_data
+    assert read_outputs(*score('ccr', run_dir, truth_path, 'faster', flags)) == golden('ccr')
+
+def test_entity_index_on_a_subset(tmpdir, ccr_data, score, read_outputs):
+    run_dir, truth_path = ccr_data
+    entity_list = tmpdir.join('entities.txt')
+    entity_list.write('\n'.join(['http://en.wikipedia.org/wiki/Entity_%d' % idx for idx in [1, 4, 6]]))
+    args = ['--restricted-entity-list', str(entity_list)]
+    plain = read_outputs(*score('ccr', run_dir, truth_path, 'plain', args))
+    ## the first scoring writes the indexes and the second one reads them
+    runs_copy, out_dir = score('ccr', run_dir, truth_path, 'indexing', args + ['--entity-index'])
+    assert [path for path in tmpdir.join('indexing', 'runs').listdir()
+            if path.basename.endswith('.entities.json')]
+    assert read_outputs(runs_copy, out_dir) == plain
+    assert read_outputs(*score('ccr', runs_copy, truth_path, 'indexed',
+                               args + ['--entity-index'])) == plain
+
+def test_header_less_run_gets_scored(ccr_data, score, read_outputs, golden):
+    run_dir, truth_path = ccr_data
+    ## the same rows as teamA-sys1 without its header line
+    lines = gzip.open(os.path.join(run_dir, 'teamA-sys1.gz')).readlines()
+    assert lines[0].startswith('#')
+    run_file = gzip.open(os.path.join(run_dir, 'teamD-sys4.gz'), 'wb')
+    run_file.writelines(line.replace('teamA\tsys1', 'teamD\tsys4') for line in lines[1:])
+    run_file.close()
+    outputs = read_outputs(*score('ccr', run_dir, truth_path, 'header-less'))
+    expected = golden('ccr')
+    fnames = [fname for fname in expected if fname.startswith('teamA-sys1')]
+    assert fnames
+    for fname in fnames:
+        assert outputs[fname] == expected[fname]
+        assert outputs[fname.replace('teamA-sys1', 'teamD-sys4')] == expected[fname]
@@ -0,0 +1,72 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+from kba.scorer._confusion import ConfusionHistogram
+
+def count_at_each_cutoff(assertions, cutoffs, positives):
+    '''
+    the counts that the scorers used to add up at every cutoff for
+    each assertion
+    '''
+    CM = defaultdict(lambda: dict((cutoff, dict(TP=0, FP=0, FN=0, TN=0)) for cutoff in cutoffs))
+    for target_id, conf, is_positive in assertions:
+        for cutoff in cutoffs:
+            if is_positive:
+                if conf > cutoff:
+                    CM[target_id][cutoff]['TP'] += 1
+            elif conf > cutoff:
+                CM[target_id][cutoff]['FP'] += 1
+            else:
+                CM[target_id][cutoff]['TN'] += 1
+    for target_id in CM:
+        for cutoff in cutoffs:
+            CM[target_id][cutoff]['FN'] = positives[target_id] - CM[target_id][cutoff]['TP']
+    return dict(CM)
+
+@pytest.mark.parametrize('cutoff_step_size', [1, 10, 50, 7])
+def test_confusion_matrix_like_counting_at_each_cutoff(cutoff_step_size):
+    rand = random.Random(cutoff_step_size)
+    cutoffs = range(0, 999, cutoff_step_size)
+    target_ids = ['http://en.wikipedia.org/wiki/Entity_%d' % idx for idx in range(4)]
+    ## confs on and around the cutoffs, too
+    assertions = [(rand.choice(target_ids), rand.choice([rand.randint(1, 1000), 50, 51, 1000]),
+                   rand.random() < 0.4)
+                  for idx in range(300)]
+    positives = dict((target_id, 300) for target_id in target_ids)
+    histogram = ConfusionHistogram(cutoffs)
+    for target_id, conf, is_positive in assertions:
+        histogram.add(target_id, conf, is_positive)
+    assert histogram.confusion_matrix(positives) == \
+        count_at_each_cutoff(assertions, cutoffs, positives)
+
+def test_FN_needs_TP():
+    histogram = ConfusionHistogram(range(0, 999, 100))
+    histogram.add_target('http://a')
+    histogram.add('http://b', 500, False)
+    histogram.add('http://c', 500, True)
+    CM = histogram.confusion_matrix({'http://a': 3, 'http://b': 3, 'http://c': 3}, FN_needs_TP=True)
+    assert CM['http://a'][0]['FN'] == CM['http://b'][0]['FN'] == 0
+    assert CM['http://c'][0]['FN'] == 2
+    assert CM['http://c'][500]['FN'] == 3
+
+def test_fractional_credit():
+    histogram = ConfusionHistogram(range(0, 999, 100), fractional=True)
+    histogram.add_credit('http://a', 500, 0.25)
+    histogram.add_credit('http://a', 800, 0.5)
+    CM = histogram.confusion_matrix({'http://a': 2})
+    assert CM['http://a'][0]['TP'] == pytest.approx(0.75)
+    assert CM['http://a'][0]['FN'] == pytest.approx(1.25)
+    assert CM['http://a'][500]['TP'] == pytest.approx(0.5)
+
+def test_FN_needs_TP_without_credit():
+    histogram = ConfusionHistogram(range(0, 999, 100), fractional=True)
+    histogram.add_target('http://a')
+    ## a TP that earned no credit, like one with an unparseable date_hour
+    histogram.add_credit('http://b', 500, 0.0)
+    CM = histogram.confusion_matrix({'http://a': 2, 'http://b': 2}, FN_needs_TP=True)
+    assert CM['http://a'][0]['FN'] == 0
+    assert CM['http://b'][0]['TP'] == 0
+    assert CM['http://b'][0]['FN'] == 2
+    assert histogram.num_positive('http://b') == 1
@@ -0,0 +1,64 @@
+from __future__ import division
+
+import random
+from itertools import combinations
+
+import pytest
+
+from kba.scorer._coref import CorefScores
+
+def brute_force(assertions):
+    '''
+    B-cubed and pairwise P and R straight from their definitions, for a
+    list of (run cluster, true cluster) of each assertion
+    '''
+    num = len(assertions)
+    if not num:
+        return dict(B3_P=0.0, B3_R=0.0, pairwise_TP=0, pairwise_FP=0, pairwise_FN=0)
+    B3_P = B3_R = 0.0
+    for run_cluster, true_cluster in assertions:
+        same_run = [other for other in assertions if other[0] == run_cluster]
+        same_true = [other for other in assertions if other[1] == true_cluster]
+        both = [other for other in same_run if other[1] == true_cluster]
+        B3_P += len(both) / len(same_run)
+        B3_R += len(both) / len(same_true)
+    TP = FP = FN = 0
+    for first, second in combinations(assertions, 2):
+        same_run = first[0] == second[0]
+        same_true = first[1] == second[1]
+        TP += same_run and same_true
+        FP += same_run and not same_true
+        FN += same_true and not same_run
+    return dict(B3_P=B3_P / num, B3_R=B3_R / num,
+                pairwise_TP=TP, pairwise_FP=FP, pairwise_FN=FN)
+
+def test_scores_like_brute_force():
+    rand = random.Random(8)
+    cutoffs = range(0, 999, 100)
+    target_ids = ['http://en.wikipedia.org/wiki/Entity_%d' % idx for idx in range(3)]
+    coref = CorefScores()
+    coref.set_cutoffs(cutoffs)
+    for target_id in target_ids:
+        coref.add_target(target_id)
+    added = []
+    for idx in range(120):
+        ## the last target_id gets no assertions
+        target_id = rand.choice(target_ids[:2])
+        assertion = (target_id, rand.choice(['Titles', 'Affiliate']),
+                     'r%d' % rand.randint(0, 4), 'eq%d' % rand.randint(0, 3),
+                     rand.randint(1, 1000))
+        coref.add(*assertion)
+        added.append(assertion)
+    stats = coref.scores()
+
+    for cutoff in cutoffs:
+        for target_id in target_ids:
+            expected = brute_force([((slot_type, runs_equiv_id), (slot_type, true_equiv_id))
+                                    for other_id, slot_type, runs_equiv_id, true_equiv_id, conf
+                                    in added if other_id == target_id and conf > cutoff])
+            for name, value in expected.items():
+                assert stats[target_id][cutoff][name] == pytest.approx(value), (target_id, cutoff, name)
+        assert stats['micro_average'][cutoff]['N'] == \
+            len([assertion for assertion in added if assertion[-1] > cutoff])
+        assert stats['macro_average'][cutoff]['B3_P'] == pytest.approx(
+            sum(stats[target_id][cutoff]['B3_P'] for target_id in target_ids) / len(target_ids))
@@ -0,0 +1,22 @@
+import random
+
+from kba.scorer._intervals import IntervalIndex
+
+def test_search_like_brute_force():
+    rand = random.Random(4)
+    for num_intervals in [0, 1, 2, 10, 200]:
+        intervals = []
+        for label in range(num_intervals):
+            start = rand.randint(0, 1000)
+            intervals.append((start, start + rand.randint(0, 60), label))
+        index = IntervalIndex(intervals)
+        assert len(index) == num_intervals
+        if intervals:
+            ## the root holds the largest end of all
+            assert index.max_ends[num_intervals // 2] == max(interval[1] for interval in intervals)
+        for query in range(100):
+            start = rand.randint(-10, 1100)
+            end = start + rand.randint(0, 80)
+            expected = sorted(interval for interval in intervals
+                              if interval[0] <= end and interval[1] >= start)
+            assert sorted(index.search(start, end)) == expected
@@ -0,0 +1,67 @@
+import os
+import json
+
+from kba.scorer import jobqueue
+from kba.scorer.jobqueue import publish, work, coordinate, queue_status, requeue_stale, \
+    unit_id, MAX_ATTEMPTS
+
+def make_job(run_dir, truth_path):
+    return dict(name='ccr-vital', scorer='ccr', args=[run_dir, truth_path])
+
+def test_overviews_like_the_baseline(tmpdir, monkeypatch, ccr_data, read_outputs, golden):
+    run_dir, truth_path = ccr_data
+    monkeypatch.chdir(tmpdir)
+    queue_dir = str(tmpdir.join('queue'))
+    publish(queue_dir, [make_job(run_dir, truth_path)])
+    assert len(os.listdir(os.path.join(queue_dir, 'todo'))) == 3
+    work(queue_dir, worker_id='w1')
+    assert coordinate(queue_dir) == []
+    assert dict(queue_status(queue_dir)) == {'ccr-vital': dict(todo=0, claimed=0, results=3, failed=0)}
+    assert read_outputs(run_dir, str(tmpdir)) == golden('ccr')
+
+def test_requeue_stale(tmpdir, monkeypatch):
+    queue_dir = str(tmpdir.join('queue'))
+    monkeypatch.setattr(jobqueue, 'job_runs', lambda job: ['teamA-sys1.gz', 'teamB-sys2.gz'])
+    publish(queue_dir, [make_job('runs', 'truth')])
+    first, second = sorted(os.listdir(os.path.join(queue_dir, 'todo')))
+    ## a dead worker, which never sent a heartbeat, and one that is alive
+    os.rename(os.path.join(queue_dir, 'todo', first),
+              os.path.join(queue_dir, 'claimed', first + '@dead'))
+    os.rename(os.path.join(queue_dir, 'todo', second),
+              os.path.join(queue_dir, 'claimed', second + '@alive'))
+    alive = os.path.join(queue_dir, 'workers', 'alive')
+    open(alive, 'w').close()
+    now = os.stat(alive).st_mtime
+
+    requeue_stale(queue_dir, now, stale_seconds=60)
+    assert os.listdir(os.path.join(queue_dir, 'todo')) == [first]
+    assert json.load(open(os.path.join(queue_dir, 'todo', first)))['attempts'] == 1
+    assert os.listdir(os.path.join(queue_dir, 'claimed')) == [second + '@alive']
+
+    ## and after too many attempts, the unit fails
+    for attempt in range(1, MAX_ATTEMPTS):
+        os.rename(os.path.join(queue_dir, 'todo', first),
+                  os.path.join(queue_dir, 'claimed', first + '@dead'))
+        requeue_stale(queue_dir, now, stale_seconds=60)
+    assert os.listdir(os.path.join(queue_dir, 'failed')) == [first]
+    assert os.listdir(os.path.join(queue_dir, 'todo')) == []
+
+def test_publish_again_retries_failed_units(tmpdir, monkeypatch):
+    queue_dir = str(tmpdir.join('queue'))
+    monkeypatch.setattr(jobqueue, 'job_runs', lambda job: ['teamA-sys1.gz', 'teamB-sys2.gz'])
+    job = make_job('runs', 'truth')
+    publish(queue_dir, [job])
+    done, failed = [unit_id(job['name'], run_file_name) + '.json'
+                    for run_file_name in ['teamA-sys1.gz', 'teamB-sys2.gz']]
+    for fname in [done, failed]:
+        os.rename(os.path.join(queue_dir, 'todo', fname), os.path.join(queue_dir, 'failed', fname))
+    open(os.path.join(queue_dir, 'results', done), 'w').write('{}')
+
+    ## a unit that failed and also has a result only counts as a result
+    assert queue_status(queue_dir)['ccr-vital'] == dict(todo=0, claimed=0, results=1, failed=1)
+
+    publish(queue_dir, [job])
+    assert os.listdir(os.path.join(queue_dir, 'todo')) == [failed]
+    assert os.listdir(os.path.join(queue_dir, 'failed')) == [done]
+    assert queue_status(queue_dir)['ccr-vital'] == dict(todo=1, claimed=0, results=1, failed=0)
+
@@ -0,0 +1,49 @@
+import json
+import random
+from StringIO import StringIO
+
+import pytest
+
+from kba.scorer._jsonstream import JSONStream
+
+def walk(stream):
+    '''
+    rebuild the three levels of nested objects that the SSF truth data
+    has, with a JSONStream
+    '''
+    data = dict()
+    for target_id in stream.members():
+        data[target_id] = dict()
+        for slot_type in stream.members():
+            data[target_id][slot_type] = dict()
+            for equiv_id in stream.members():
+                data[target_id][slot_type][equiv_id] = stream.value()
+    return data
+
+def make_truth(seed):
+    rand = random.Random(seed)
+    truth = dict()
+    for target_num in range(5):
+        slots = truth[u'http://en.wikipedia.org/wiki/Entity_\xe9%d' % target_num] = dict()
+        for slot_type in ['Titles', 'Affiliate'][:rand.randint(0, 2)]:
+            slots[slot_type] = dict(('eq%d' % equiv_num, dict(
+                stream_ids=dict(('%d-%032x' % (1317000000 + idx, rand.getrandbits(128)),
+                                 ['2011-10-07-14', [[idx, idx + rand.randint(1, 9)]]])
+                                for idx in range(rand.randint(0, 3))),
+                fill=u'a "quoted" fill, \xfc', score=rand.random(), num=rand.randint(-5, 5),
+                flag=rand.choice([True, False, None])))
+                for equiv_num in range(rand.randint(0, 3)))
+    return truth
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64, 2**20])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_walk_like_json_load(chunk_size, indent):
+    for seed in range(5):
+        ## with the non-ASCII characters as UTF-8, which a chunk can split
+        text = json.dumps(make_truth(seed), indent=indent, ensure_ascii=False).encode('utf-8')
+        assert walk(JSONStream(StringIO(text), chunk_size=chunk_size)) == json.loads(text)
+
+def test_truncated_file_fails():
+    text = json.dumps(make_truth(1))
+    with pytest.raises(ValueError):
+        walk(JSONStream(StringIO(text[:len(text) // 2]), chunk_size=16))
@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+from kba.scorer._merge import merge_join, annotation_by_time, epoch_windows, RunOutOfOrder
+
+def make_line(stream_id, target_id):
+    return 'teamA\tsys1\t%s\t%s\t500\t2\n' % (stream_id, target_id)
+
+def test_merge_join_like_dict_lookups():
+    rand = random.Random(9)
+    stream_ids = ['%d-%032x' % (1317000000 + rand.randint(0, 50), rand.getrandbits(128))
+                  for idx in range(200)]
+    target_ids = ['http://en.wikipedia.org/wiki/Entity_%d' % idx for idx in range(4)]
+    annotation = dict(((rand.choice(stream_ids), rand.choice(target_ids)), rand.random() < 0.5)
+                      for idx in range(150))
+    lines = ['#{"team_id": "teamA"}\n'] + \
+        [make_line(stream_id, rand.choice(target_ids))
+         for stream_id in sorted(stream_ids, key=lambda stream_id: int(stream_id.split('-')[0]))]
+
+    num_lines = 0
+    for window, window_annotation in merge_join(iter(lines), annotation_by_time(annotation)):
+        epochs = set(line.split()[2].split('-')[0] for line in window)
+        assert len(epochs) == 1
+        assert window_annotation == dict((key, label) for key, label in annotation.items()
+                                         if key[0].split('-')[0] in epochs)
+        num_lines += len(window)
+    assert num_lines == len(stream_ids)
+
+def test_run_out_of_order():
+    lines = [make_line('1317000005-%032x' % 0, 'http://a'),
+             make_line('1317000004-%032x' % 0, 'http://a')]
+    with pytest.raises(RunOutOfOrder):
+        list(epoch_windows(iter(lines)))
@@ -0,0 +1,34 @@
+from kba.scorer.orchestrate import run_jobs
+
+def only(outputs, scorer):
+    '''
+    drop the overviews of the other scorer, which also land in
+    overviews/ when both run in one sweep
+    '''
+    other = dict(ccr='ssf', ssf='ccr')[scorer]
+    return dict((fname, contents) for fname, contents in outputs.items()
+                if not fname.startswith(other + '-'))
+
+def test_sweep_like_the_baseline(tmpdir, monkeypatch, ccr_data, ssf_data, read_outputs, golden):
+    monkeypatch.chdir(tmpdir)
+    jobs = [dict(name='ccr-vital', scorer='ccr', args=list(ccr_data)),
+            dict(name='ssf-all', scorer='ssf', args=list(ssf_data))]
+    checkpoint_path = str(tmpdir.join('checkpoint.jsonl'))
+    records = run_jobs(jobs, processes=2, checkpoint_path=checkpoint_path)
+    assert sorted((record['name'], record['status']) for record in records) == \
+        [('ccr-vital', 'done'), ('ssf-all', 'done')]
+    for scorer, (run_dir, truth_path) in [('ccr', ccr_data), ('ssf', ssf_data)]:
+        assert only(read_outputs(run_dir, str(tmpdir)), scorer) == golden(scorer)
+
+    ## a second sweep finds both jobs in the checkpoint
+    assert run_jobs(jobs, processes=2, checkpoint_path=checkpoint_path) == []
+
+def test_failed_job_runs_again(tmpdir, monkeypatch, ccr_data):
+    monkeypatch.chdir(tmpdir)
+    run_dir, truth_path = ccr_data
+    checkpoint_path = str(tmpdir.join('checkpoint.jsonl'))
+    jobs = [dict(name='ccr-missing', scorer='ccr', args=[run_dir, str(tmpdir.join('missing'))])]
+    records = run_jobs(jobs, checkpoint_path=checkpoint_path)
+    assert [record['status'] for record in records] == ['failed']
+    assert [record['status'] for record in run_jobs(jobs, checkpoint_path=checkpoint_path)] == \
+        ['failed']
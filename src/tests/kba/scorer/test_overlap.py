@@ -0,0 +1,22 @@
+import pytest
+
+from kba.scorer._overlap import make_criterion, DEFAULT_CRITERION
+
+def test_default_criterion_is_the_official_overlap():
+    criterion = make_criterion(DEFAULT_CRITERION)
+    ## less than ten times as long as the fill
+    assert criterion(0, 99, 10, 20)
+    assert not criterion(0, 100, 10, 20)
+
+def test_criteria():
+    assert make_criterion('jaccard-0.5')(10, 20, 10, 30)
+    assert not make_criterion('jaccard-0.6')(10, 20, 10, 30)
+    assert make_criterion('contains')(5, 40, 10, 30)
+    assert not make_criterion('contains')(15, 40, 10, 30)
+    assert make_criterion('within')(15, 25, 10, 30)
+    assert not make_criterion('within')(5, 25, 10, 30)
+
+@pytest.mark.parametrize('name', ['jaccard-2', 'overlaps', 'ratio'])
+def test_bad_criteria(name):
+    with pytest.raises(ValueError):
+        make_criterion(name)
@@ -0,0 +1,110 @@
+import random
+from StringIO import StringIO
+
+import pytest
+
+from kba.scorer._runparser import iter_rows, iter_column_batches, \
+    COLUMNS, CCR_COLUMNS, SSF_COLUMNS, RunFormatError
+
+def make_lines(num_rows, seed=3):
+    rand = random.Random(seed)
+    lines = ['#{"team_id": "teamA"}\n']
+    for idx in range(num_rows):
+        start = rand.randint(0, 1000)
+        lines.append('\t'.join([
+            'teamA', 'sys1', '%d-%032x' % (1317000000 + idx, rand.getrandbits(128)),
+            'http://en.wikipedia.org/wiki/Entity_%d' % rand.randint(0, 5),
+            str(rand.randint(1, 1000)), str(rand.choice([-1, 0, 1, 2])), str(rand.randint(0, 1)),
+            '2011-10-07-14', rand.choice(['NULL', 'Titles']), 'r%d' % rand.randint(0, 3),
+            '%d-%d' % (start, start + rand.randint(0, 50))]) + '\n')
+        if idx % 17 == 0:
+            lines.append('\n')
+            lines.append('# a comment\n')
+    return lines
+
+def split_rows(lines, columns):
+    '''
+    the line by line split() that the scorers used to read runs with
+    '''
+    indexes = [COLUMNS.index(name) for name in columns]
+    for line in lines:
+        if line.startswith('#') or len(line.strip()) == 0:
+            continue
+        row = line.split()
+        for name in ['conf', 'rating', 'contains_mention']:
+            row[COLUMNS.index(name)] = int(float(row[COLUMNS.index(name)]))
+        yield tuple(row[idx] for idx in indexes)
+
+@pytest.mark.parametrize('columns', [CCR_COLUMNS, SSF_COLUMNS])
+@pytest.mark.parametrize('batch_size', [1, 7, 10000])
+def test_iter_rows_like_split(columns, batch_size):
+    lines = make_lines(200)
+    assert list(iter_rows(iter(lines), columns, batch_size=batch_size)) == \
+        list(split_rows(lines, columns))
+
+def test_column_batches_hold_every_row():
+    lines = make_lines(50)
+    batches = list(iter_column_batches(iter(lines), CCR_COLUMNS, batch_size=10))
+    for batch in batches:
+        assert len(set(len(values) for values in batch.values())) == 1
+    assert sum(len(batch['conf']) for batch in batches) == 50
+
+@pytest.mark.parametrize('column, value, message', [
+    ('conf', 'high', 'line 6'),
+    ('conf', '1001', 'line 6'),
+    ('stream_id', 'abc-def', 'line 6'),
+    ('byte_range', '10', 'line 6'),
+])
+def test_bad_value_names_its_line(column, value, message):
+    lines = [line for line in make_lines(10) if not line.startswith('#') and line.strip()]
+    row = lines[5].rstrip('\n').split('\t')
+    row[COLUMNS.index(column)] = value
+    lines[5] = '\t'.join(row) + '\n'
+    with pytest.raises(RunFormatError) as excinfo:
+        list(iter_rows(iter(lines), SSF_COLUMNS, batch_size=4))
+    assert message in str(excinfo.value)
+
+def test_num_columns():
+    lines = [line for line in make_lines(10) if not line.startswith('#') and line.strip()]
+    assert len(list(iter_rows(iter(lines), SSF_COLUMNS, num_columns=len(COLUMNS)))) == 10
+    lines[2] = lines[2].rstrip('\n') + '\textra\n'
+    ## without num_columns, the extra column goes unnoticed
+    assert len(list(iter_rows(iter(lines), CCR_COLUMNS))) == 10
+    with pytest.raises(RunFormatError) as excinfo:
+        list(iter_rows(iter(lines), CCR_COLUMNS, num_columns=len(COLUMNS)))
+    assert 'line 3' in str(excinfo.value)
+
+def test_converters_replace_checks():
+    lines = [line for line in make_lines(3) if not line.startswith('#') and line.strip()]
+    row = lines[1].rstrip('\n').split('\t')
+    row[COLUMNS.index('byte_range')] = '[[1,2],[5,9]]'
+    lines[1] = '\t'.join(row) + '\n'
+    with pytest.raises(RunFormatError):
+        list(iter_rows(iter(lines), SSF_COLUMNS))
+    rows = list(iter_rows(iter(lines), SSF_COLUMNS, converters=dict(byte_range=None)))
+    assert rows[1][-1] == '[[1,2],[5,9]]'
+
+@pytest.mark.parametrize('delimiter', [None, '\t'])
+def test_crlf_like_lf(delimiter):
+    lines = make_lines(100)
+    crlf = ''.join(line.replace('\n', '\r\n') for line in lines)
+    expected = list(iter_rows(iter(lines), SSF_COLUMNS, delimiter=delimiter))
+    assert list(iter_rows(StringIO(crlf), SSF_COLUMNS, delimiter=delimiter)) == expected
+    assert list(iter_rows(iter(StringIO(crlf)), SSF_COLUMNS, delimiter=delimiter)) == expected
+
+def test_tab_delimiter_reads_quoted_values():
+    lines = [line for line in make_lines(3) if not line.startswith('#') and line.strip()]
+    row = lines[1].rstrip('\n').split('\t')
+    row[COLUMNS.index('equiv_id')] = '"a slot\tvalue, ""quoted"""'
+    row[COLUMNS.index('byte_range')] = '"[[1, 2], [5, 9]]"'
+    lines[1] = '\t'.join(row) + '\r\n'
+    rows = list(iter_rows(StringIO(''.join(lines)), ('equiv_id', 'byte_range'), delimiter='\t',
+                          num_columns=len(COLUMNS), converters=dict(byte_range=None)))
+    assert rows[1] == ('a slot\tvalue, "quoted"', '[[1, 2], [5, 9]]')
+    assert len(rows) == 3
+
+    ## a quote that is not closed on its line
+    lines[1] = lines[1].replace('"quoted"""', '"quoted""')
+    with pytest.raises(RunFormatError) as excinfo:
+        list(iter_rows(StringIO(''.join(lines)), ('equiv_id',), delimiter='\t'))
+    assert 'line 2' in str(excinfo.value)
@@ -0,0 +1,44 @@
+import os
+import random
+from collections import defaultdict
+
+from kba.scorer._spill import partition_lines
+
+def make_lines(num_rows, num_targets, seed=5):
+    rand = random.Random(seed)
+    lines = ['#{"team_id": "teamA"}\n']
+    for idx in range(num_rows):
+        lines.append('teamA\tsys1\t%d-%032x\thttp://en.wikipedia.org/wiki/Entity_%d\t%d\t2\n'
+                     % (1317000000 + idx, rand.getrandbits(128), rand.randint(0, num_targets - 1),
+                        rand.randint(1, 1000)))
+    return lines
+
+def by_target(lines):
+    rows = defaultdict(list)
+    for line in lines:
+        if not line.startswith('#'):
+            rows[line.split()[3]].append(line)
+    return rows
+
+def test_partitions_hold_each_target_once_in_order(tmpdir):
+    lines = make_lines(2000, 30)
+    partitions = []
+    ## a budget small enough that the first partitions get split again
+    for partition in partition_lines(iter(lines), 3, 20000, num_partitions=4,
+                                     tmp_dir=str(tmpdir)):
+        partitions.append(by_target(partition.readlines()))
+    assert len(partitions) > 4
+    seen = dict()
+    for rows in partitions:
+        for target_id in rows:
+            assert target_id not in seen
+            seen[target_id] = rows[target_id]
+    assert seen == by_target(lines)
+    ## the spill files are gone
+    assert os.listdir(str(tmpdir)) == []
+
+def test_one_large_target_is_not_split_forever(tmpdir):
+    lines = make_lines(500, 1)
+    partitions = [partition.readlines() for partition in
+                  partition_lines(iter(lines), 3, 1000, num_partitions=4, tmp_dir=str(tmpdir))]
+    assert partitions == [lines[1:]]
@@ -0,0 +1,162 @@
+import os
+import csv
+import gzip
+import json
+import subprocess
+from cStringIO import StringIO
+
+import pytest
+
+from kba.scorer import ssf
+from kba.scorer.drilldown import Drilldown
+
+def test_same_scores_as_baseline(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    assert read_outputs(*score('ssf', run_dir, truth_path, 'default')) == golden('ssf')
+
+@pytest.mark.parametrize('name, args', [
+    ('ssf-pooled-only', ['--pooled-only']),
+    ('ssf-Affiliate', ['--slot-type', 'Affiliate']),
+])
+def test_variants_same_as_baseline(ssf_data, score, read_outputs, golden, name, args):
+    run_dir, truth_path = ssf_data
+    assert read_outputs(*score('ssf', run_dir, truth_path, name, args),
+                        overviews_only=True) == golden(name)
+
+def test_pool_index_gets_reused(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    runs_copy, out_dir = score('ssf', run_dir, truth_path, 'pooling', ['--pooled-only'])
+    assert os.listdir(os.path.join(runs_copy, '.ssf-pool'))
+    ## the second scoring reads the keys from the pool index
+    assert read_outputs(*score('ssf', runs_copy, truth_path, 'pooled', ['--pooled-only']),
+                        overviews_only=True) == golden('ssf-pooled-only')
+
+@pytest.mark.parametrize('flags', [
+    ['--out-of-core-mb', '1'],
+    ['--parse-workers', '2'],
+    ['--entity-index'],
+    ['--prefetch'],
+    ['--annotation-arena'],
+    ['--run-workers', '2'],
+])
+def test_faster_scorings_same_as_baseline(ssf_data, score, read_outputs, golden, flags):
+    run_dir, truth_path = ssf_data
+    assert read_outputs(*score('ssf', run_dir, truth_path, 'faster', flags)) == golden('ssf')
+
+@pytest.mark.parametrize('flags', [[], ['--run-workers', '3']])
+def test_facets_same_as_baseline(ssf_data, score, read_outputs, golden, flags):
+    run_dir, truth_path = ssf_data
+    outputs = read_outputs(*score('ssf', run_dir, truth_path, 'faceted',
+                                  ['--facet', 'slot-type=Affiliate', '--facet', 'slot-type=Titles']
+                                  + flags))
+    expected = dict(golden('ssf'))
+    expected.update(golden('ssf-Affiliate'))
+    assert dict((fname, contents) for fname, contents in outputs.items()
+                if '-Titles-' not in fname and
+                (fname.endswith('overview.csv') or 'Affiliate' not in fname)) == expected
+    assert [fname for fname in outputs if '-Titles-' in fname]
+
+def test_streamed_truth_like_json_load(ssf_data):
+    run_dir, truth_path = ssf_data
+    reject = lambda target_id: target_id.endswith('_3')
+    for kwargs in [dict(), dict(slot_type_filter='Titles')]:
+        streamed, streamed_positives = ssf.load_annotation(truth_path, reject, **kwargs)
+        loaded, loaded_positives = ssf.load_annotation(
+            truth_path, reject, native_annotation=json.load(open(truth_path)), **kwargs)
+        assert json.dumps(streamed_positives) == json.dumps(loaded_positives)
+        assert list(streamed) == list(loaded)
+        for key in loaded:
+            assert streamed.fills(key) == loaded.fills(key)
+
+def test_facet_without_targets_exits(tmpdir, ssf_data, score):
+    run_dir, truth_path = ssf_data
+    topics_path = str(tmpdir.join('topics.json'))
+    json.dump(dict(targets=[dict(target_id=target_id, group='bar', entity_type='PER')
+                            for target_id in json.load(open(truth_path))]),
+              open(topics_path, 'w'))
+    for name, flags in [('facet', ['--facet', 'group=foo']), ('group', ['--group', 'foo'])]:
+        with pytest.raises(subprocess.CalledProcessError):
+            score('ssf', run_dir, truth_path, name, ['--topics-path', topics_path] + flags)
+        log = open(str(tmpdir.join(name, 'log'))).read()
+        assert 'found no true positives given the filters of ssf-all-modes-foo-only' in log
+
+def test_overlap_criteria_keep_the_baseline_modes(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    outputs = read_outputs(*score('ssf', run_dir, truth_path, 'criteria',
+                                  ['--overlap-criteria', 'ratio-10,jaccard-0.5,within']))
+    expected = golden('ssf')
+    assert dict((fname, outputs.get(fname)) for fname in expected) == expected
+    ## ratio-10 is OVERLAP itself, and does not get scored twice
+    assert not [fname for fname in outputs if 'ratio-10' in fname]
+    assert [fname for fname in outputs if 'OVERLAP-within' in fname]
+
+def test_fill_coref_keeps_the_baseline_modes(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    runs_copy, out_dir = score('ssf', run_dir, truth_path, 'coref', ['--fill-coref'])
+    outputs = read_outputs(runs_copy, out_dir)
+    expected = golden('ssf')
+    assert dict((fname, outputs.get(fname)) for fname in expected) == expected
+    assert [fname for fname in outputs if 'FILL-coref' in fname]
+
+def test_slow_latency_decay_scores_like_DATE_HOUR(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    outputs = read_outputs(*score('ssf', run_dir, truth_path, 'latency',
+                                  ['--date-hour-half-life', '1e300']))
+    expected = golden('ssf')
+    assert dict((fname, outputs.get(fname)) for fname in expected) == expected
+    ## the CSVs of the runs write the fractional TPs as floats
+    for fname in expected:
+        if 'DATE_HOUR' in fname and fname.endswith('overview.csv'):
+            assert outputs[fname.replace('DATE_HOUR', ssf.DATE_HOUR_LATENCY)] == \
+                expected[fname].replace('DATE_HOUR', ssf.DATE_HOUR_LATENCY)
+
+def test_header_less_run_is_refused(ssf_data, score):
+    run_dir, truth_path = ssf_data
+    run_file = gzip.open(os.path.join(run_dir, 'teamD-bad.gz'), 'wb')
+    run_file.write('teamD\tbad\t1317000000-%s\thttp://en.wikipedia.org/wiki/Entity_0\t'
+                   '500\t2\t1\t2011-10-07-14\tTitles\tr1\t10-20\n' % ('0' * 32))
+    run_file.close()
+    with pytest.raises(subprocess.CalledProcessError):
+        score('ssf', run_dir, truth_path, 'header-less')
+
+def test_stream_truth_json_filters_like_one_at_a_time(ssf_data):
+    run_dir, truth_path = ssf_data
+    filters = [dict(reject=lambda target_id: False),
+               dict(reject=lambda target_id: target_id.endswith('_2'), slot_type_filter='Titles')]
+    together = ssf.stream_truth_json_filters(truth_path, filters)
+    for truth_filter, (truth, positives) in zip(filters, together):
+        alone_truth, alone_positives = ssf.stream_truth_json(truth_path, **truth_filter)
+        assert truth == alone_truth
+        assert json.dumps(positives) == json.dumps(alone_positives)
+
+def test_drilldown_counts_like_the_csv_files(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    runs_copy, out_dir = score('ssf', run_dir, truth_path, 'drilldown', ['--drilldown'])
+    assert read_outputs(runs_copy, out_dir) == golden('ssf')
+
+    drilldown = Drilldown(os.path.join(
+        runs_copy, 'teamA-ssf1.gz-ssf-all-modes-all-entities-all-slots-cutoff-step-size-50.drilldown'))
+    for mode in [ssf.DOCS, ssf.OVERLAP, ssf.FILL, ssf.DATE_HOUR]:
+        rows = list(csv.DictReader(open(os.path.join(
+            runs_copy, 'teamA-ssf1.gz-ssf-%s-all-entities-all-slots-cutoff-step-size-50.csv' % mode))))
+        rows = [row for row in rows if row['target_id'] in drilldown.target_ids(mode)]
+        assert rows
+        for row in rows:
+            counts = drilldown.query(row['target_id'], int(row['cutoff']), mode)['counts']
+            for name in ['TP', 'FP', 'TN']:
+                assert counts[name] == int(row[name]), (mode, row)
+
+def test_later_modes_count_in_steps_of_50(ssf_data, score, read_outputs, golden):
+    run_dir, truth_path = ssf_data
+    outputs = read_outputs(*score('ssf', run_dir, truth_path, 'step-25',
+                                  ['--cutoff-step-size', '25']))
+    golden_outputs = golden('ssf')
+    for mode in [ssf.OVERLAP, ssf.FILL, ssf.DATE_HOUR]:
+        for run_file_name in ['teamA-ssf1.gz', 'teamB-ssf2.gz']:
+            fname = '%s-ssf-%s-all-entities-all-slots-cutoff-step-size-%%d.csv' % (run_file_name, mode)
+            rows = list(csv.DictReader(StringIO(outputs[fname % 25])))
+            assert [row for row in rows if int(row['cutoff']) % 50 == 0] == \
+                list(csv.DictReader(StringIO(golden_outputs[fname % 50])))
+            for row in rows:
+                if int(row['cutoff']) % 50:
+                    assert float(row['TP']) == float(row['FP']) == float(row['TN']) == 0
@@ -0,0 +1,67 @@
+import pickle
+import random
+
+from kba.scorer._ssf_annotation import SSFAnnotation
+from kba.scorer._overlap import make_criterion, DEFAULT_CRITERION
+
+def make_fills(seed=3):
+    '''
+    :returns dict: (stream_id, target_id, slot_type) --> list of
+    (equiv_id, byte ranges) like in the truth data
+    '''
+    rand = random.Random(seed)
+    fills = dict()
+    for idx in range(100):
+        key = ('%d-%032x' % (1317000000 + idx, rand.getrandbits(128)),
+               'http://en.wikipedia.org/wiki/Entity_%d' % rand.randint(0, 5),
+               rand.choice(['Affiliate', 'Titles', 'FoundedBy']))
+        fills[key] = []
+        for equiv_num in range(rand.randint(1, 3)):
+            offsets = []
+            ## and every tenth key with enough byte ranges to get indexed
+            for range_num in range(rand.randint(1, idx % 10 and 3 or 12)):
+                start = rand.randint(0, 500)
+                offsets.append([start, start + rand.randint(0, 40)])
+            fills[key].append(('eq%d' % equiv_num, offsets))
+    return fills
+
+def overlapping_equiv_ids(fills, start_byte, end_byte, criteria):
+    '''
+    the byte range test that OVERLAP has always used, and each of the
+    other criteria on the byte ranges that overlap at all
+    '''
+    runs_len = end_byte - start_byte
+    for equiv_id, offsets in fills:
+        overlaps = False
+        matches = [False] * len(criteria)
+        for offset in offsets:
+            true_len = offset[1] - offset[0]
+            if start_byte <= offset[1] and end_byte >= offset[0]:
+                if runs_len < 10 * true_len:
+                    overlaps = True
+                for idx, criterion in enumerate(criteria):
+                    if criterion(start_byte, end_byte, offset[0], offset[1]):
+                        matches[idx] = True
+        assert matches[0] == overlaps
+        yield equiv_id, matches
+
+def test_lookups_like_the_truth_data():
+    fills = make_fills()
+    annotation = SSFAnnotation()
+    for key, key_fills in fills.items():
+        annotation.add(key[0], key[1], key[2], key_fills)
+    assert len(annotation) == len(fills)
+    assert list(annotation) == list(fills)
+    criteria = [make_criterion(DEFAULT_CRITERION), make_criterion('within')]
+    ## and the same after a trip to a worker process
+    for annotation in [annotation, pickle.loads(pickle.dumps(annotation))]:
+        rand = random.Random(8)
+        for key, key_fills in fills.items():
+            assert key in annotation
+            assert annotation.fills(key) == [equiv_id for equiv_id, offsets in key_fills]
+            for query in range(20):
+                start = rand.randint(0, 550)
+                end = start + rand.randint(0, 300)
+                assert annotation.overlapping_equiv_ids(key, start, end, criteria) == \
+                    list(overlapping_equiv_ids(key_fills, start, end, criteria))
+        assert (key[0], key[1], 'Other') not in annotation